@@ -0,0 +1,119 @@
+"""
+A deterministic stand-in for the OpenAI API, so benchmarks measure this app rather than the model provider.
+Embeddings are derived from a hash of the input text, and chat answers are streamed at a fixed token rate.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+
+import fastapi
+from fastapi.responses import StreamingResponse
+
+DEFAULT_EMBEDDING_DIMENSIONS = 1536
+URL_PATTERN = re.compile(r"https:\/\/hdmall\.co\.th\/[\w.,@?^=%&:\/~+#-]+")
+
+
+def fake_embedding(text: str, dimensions: int = DEFAULT_EMBEDDING_DIMENSIONS) -> list[float]:
+    """A unit vector seeded by the text, so the same text always gets the same embedding."""
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector]
+
+
+def get_message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def build_answer(messages: list[dict], answer_tokens: int) -> list[str]:
+    """Answer tokens that cite the first source URL, so product card lookups are exercised too."""
+    urls = URL_PATTERN.findall(get_message_text(messages[-1])) if messages else []
+    tokens = [f"token{i} " for i in range(answer_tokens)]
+    if urls:
+        tokens.insert(len(tokens) // 2, f"{urls[0]} ")
+    return tokens
+
+
+def create_fake_openai_app(
+    embedding_latency: float = 0.05,
+    chat_latency: float = 0.3,
+    token_latency: float = 0.01,
+    answer_tokens: int = 100,
+) -> fastapi.FastAPI:
+    app = fastapi.FastAPI()
+
+    @app.post("/v1/embeddings")
+    async def embeddings_handler(request: dict):
+        await asyncio.sleep(embedding_latency)
+        inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+        dimensions = request.get("dimensions") or DEFAULT_EMBEDDING_DIMENSIONS
+        return {
+            "object": "list",
+            "model": request["model"],
+            "data": [
+                {"object": "embedding", "index": index, "embedding": fake_embedding(text, dimensions)}
+                for index, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions_handler(request: dict):
+        messages = request.get("messages", [])
+        tool_names = [tool["function"]["name"] for tool in request.get("tools", [])]
+        created = int(time.time())
+
+        if request.get("stream"):
+
+            async def stream():
+                await asyncio.sleep(chat_latency)
+                chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created}
+                chunk["model"] = request["model"]
+                first_delta = {"role": "assistant", "content": ""}
+                yield f"data: {json.dumps(chunk | {'choices': [{'index': 0, 'delta': first_delta}]})}\n\n"
+                for token in build_answer(messages, answer_tokens):
+                    await asyncio.sleep(token_latency)
+                    choices = [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+                    yield f"data: {json.dumps(chunk | {'choices': choices})}\n\n"
+                choices = [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                yield f"data: {json.dumps(chunk | {'choices': choices})}\n\n"
+                if request.get("stream_options", {}).get("include_usage"):
+                    usage = {"prompt_tokens": 0, "completion_tokens": answer_tokens, "total_tokens": answer_tokens}
+                    yield f"data: {json.dumps(chunk | {'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(chat_latency)
+        message: dict = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        if "search_database" in tool_names:
+            # Rewrite the question into a search query, without filters
+            arguments = json.dumps({"search_query": get_message_text(messages[-1])}, ensure_ascii=False)
+            message["tool_calls"] = [
+                {"id": "call_fake", "type": "function", "function": {"name": "search_database", "arguments": arguments}}
+            ]
+            finish_reason = "tool_calls"
+        elif "specify_package" in tool_names:
+            # Never pin a package, so the advanced flow always takes the hybrid search path
+            message["content"] = ""
+        else:
+            message["content"] = "".join(build_answer(messages, answer_tokens))
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": created,
+            "model": request["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": answer_tokens, "total_tokens": answer_tokens},
+        }
+
+    return app
@@ -0,0 +1,137 @@
+"""Load driver: sends requests at a fixed concurrency and reports throughput and latency percentiles per stage."""
+
+import asyncio
+import json
+import statistics
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+
+import httpx
+
+# A request returns its stage timings in seconds, e.g. {"first_token": 0.4, "total": 1.2}
+Request = Callable[[httpx.AsyncClient, str], Awaitable[dict[str, float]]]
+
+
+class ScenarioResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.timings: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+        self.elapsed = 0.0
+
+    @property
+    def completed(self) -> int:
+        return len(self.timings.get("total", []))
+
+    def percentiles(self, stage: str) -> dict[str, float]:
+        values = self.timings[stage]
+        if len(values) < 2:
+            return {"p50": values[0], "p95": values[0], "p99": values[0]} if values else {}
+        quantiles = statistics.quantiles(values, n=100, method="inclusive")
+        return {"p50": quantiles[49], "p95": quantiles[94], "p99": quantiles[98]}
+
+    def to_dict(self) -> dict:
+        return {
+            "scenario": self.name,
+            "completed": self.completed,
+            "errors": self.errors,
+            "throughput": self.completed / self.elapsed if self.elapsed else 0.0,
+            "stages": {stage: self.percentiles(stage) for stage in self.timings},
+        }
+
+
+async def search_request(client: httpx.AsyncClient, query: str) -> dict[str, float]:
+    start = time.perf_counter()
+    response = await client.get("/search", params={"query": query, "top": 5})
+    response.raise_for_status()
+    return {"total": time.perf_counter() - start}
+
+
+def chat_request(use_advanced_flow: bool) -> Request:
+    async def request(client: httpx.AsyncClient, query: str) -> dict[str, float]:
+        start = time.perf_counter()
+        response = await client.post("/chat", json=build_chat_body(query, use_advanced_flow))
+        response.raise_for_status()
+        return {"total": time.perf_counter() - start}
+
+    return request
+
+
+def chat_stream_request(use_advanced_flow: bool) -> Request:
+    async def request(client: httpx.AsyncClient, query: str) -> dict[str, float]:
+        start = time.perf_counter()
+        timings = {}
+        async with client.stream("POST", "/chat/stream", json=build_chat_body(query, use_advanced_flow)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "error" in event:
+                    raise RuntimeError(event["error"])
+                if "context" in event and "context" not in timings:
+                    timings["context"] = time.perf_counter() - start
+                elif event.get("delta", {}).get("content") and "first_token" not in timings:
+                    timings["first_token"] = time.perf_counter() - start
+        timings["total"] = time.perf_counter() - start
+        return timings
+
+    return request
+
+
+def build_chat_body(query: str, use_advanced_flow: bool) -> dict:
+    return {
+        "messages": [{"role": "user", "content": query}],
+        "context": {"overrides": {"use_advanced_flow": use_advanced_flow, "retrieval_mode": "hybrid", "top": 3}},
+    }
+
+
+SCENARIOS: dict[str, Request] = {
+    "search": search_request,
+    "chat_simple": chat_request(use_advanced_flow=False),
+    "chat_advanced": chat_request(use_advanced_flow=True),
+    "chat_stream_simple": chat_stream_request(use_advanced_flow=False),
+    "chat_stream_advanced": chat_stream_request(use_advanced_flow=True),
+}
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, name: str, queries: list[str], total_requests: int, concurrency: int
+) -> ScenarioResult:
+    """Send `total_requests` requests, cycling through the queries, with `concurrency` requests in flight."""
+    request = SCENARIOS[name]
+    result = ScenarioResult(name)
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total_requests:
+            query = queries[next_index % len(queries)]
+            next_index += 1
+            try:
+                timings = await request(client, query)
+            except Exception:
+                result.errors += 1
+                continue
+            for stage, seconds in timings.items():
+                result.timings[stage].append(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def format_report(results: list[ScenarioResult]) -> str:
+    lines = [f"{'scenario':<22} {'stage':<12} {'req/s':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for result in results:
+        summary = result.to_dict()
+        if not summary["stages"]:
+            lines.append(f"{result.name:<22} {'-':<12} {0.0:>8.1f} {result.errors:>6}")
+        for stage, percentiles in summary["stages"].items():
+            lines.append(
+                f"{result.name:<22} {stage:<12} {summary['throughput']:>8.1f} {result.errors:>6} "
+                + " ".join(f"{percentiles[key] * 1000:>9.1f}" for key in ("p50", "p95", "p99"))
+            )
+    return "\n".join(lines)
@@ -0,0 +1,146 @@
+"""
+Run the end-to-end benchmark: start the fake OpenAI server, seed a synthetic catalog into the local Postgres,
+start the app from create_app() with uvicorn, then drive each scenario and report latency percentiles.
+
+    python -m benchmarks.run --packages 500 --requests 200 --concurrency 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import uvicorn
+from dotenv import load_dotenv
+
+from benchmarks.fake_openai import create_fake_openai_app
+from benchmarks.load import SCENARIOS, format_report, run_scenario
+from benchmarks.seed import build_synthetic_catalog, seed_synthetic_catalog
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+
+logger = logging.getLogger("ragapp")
+
+EMBED_MODEL = "text-embedding-ada-002"
+EMBED_DIMENSIONS = 1536
+
+
+async def start_fake_openai(args) -> uvicorn.Server:
+    app = create_fake_openai_app(
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        answer_tokens=args.answer_tokens,
+    )
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.openai_port, log_level="warning"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+def build_app_env(args, env_file: str) -> dict[str, str]:
+    """Point the app at the fake OpenAI server; the Postgres settings come from the environment or .env."""
+    overrides = {
+        "OPENAI_CHAT_HOST": "openai",
+        "OPENAI_EMBED_HOST": "openai",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAICOM_KEY": "fake",
+        "OPENAICOM_CHAT_MODEL": "gpt-35-turbo",
+        "OPENAICOM_EMBED_MODEL": EMBED_MODEL,
+        "OPENAICOM_EMBED_DIMENSIONS": str(EMBED_DIMENSIONS),
+        "RUNNING_IN_PRODUCTION": "true",
+    }
+    # The app reloads its dotenv file on startup, so give it one that holds the benchmark settings
+    with open(env_file, "w") as f:
+        f.writelines(f"{key}={value}\n" for key, value in overrides.items())
+    return os.environ | overrides | {"DOTENV_PATH": env_file}
+
+
+async def wait_for_app(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                if (await client.get("/pool-stats")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The app did not start within {timeout} seconds")
+            await asyncio.sleep(0.5)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app against a fake OpenAI server and local Postgres")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once")
+    parser.add_argument("--packages", type=int, default=500, help="Synthetic packages to seed")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the synthetic catalog of a previous run")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the app")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Fake embedding latency in seconds")
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="Fake time to first chat token in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Fake delay between streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=100, help="Tokens in each fake chat answer")
+    parser.add_argument("--output", type=str, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fake_openai = await start_fake_openai(args)
+
+    if not args.skip_seed:
+        engine = await create_postgres_engine_from_env()
+        await seed_synthetic_catalog(engine, args.packages, EMBED_MODEL, EMBED_DIMENSIONS)
+        await engine.dispose()
+    queries = [package["package_name"] for package in build_synthetic_catalog(args.packages)]
+
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app_process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "fastapi_app:create_app",
+                "--factory",
+                "--port",
+                str(args.app_port),
+                "--workers",
+                str(args.workers),
+                "--log-level",
+                "warning",
+            ],
+            env=build_app_env(args, os.path.join(tmpdir, "benchmark.env")),
+            cwd=tmpdir,
+        )
+        try:
+            await wait_for_app(base_url)
+            results = []
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+                for scenario in args.scenarios:
+                    logger.info("Running the %s scenario...", scenario)
+                    results.append(await run_scenario(client, scenario, queries, args.requests, args.concurrency))
+        finally:
+            app_process.terminate()
+            app_process.wait()
+            fake_openai.should_exit = True
+
+    print(format_report(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Seed a synthetic catalog, embedded with the fake embeddings, so benchmark runs are reproducible."""
+
+import logging
+import os
+import random
+
+from sqlalchemy import String, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.fake_openai import fake_embedding
+from fastapi_app.embedding_pipeline import collect_pending_texts, save_package_embeddings
+from fastapi_app.postgres_models import Item, PackageEmbedding
+from fastapi_app.retrieval_cache import bump_catalog_generation
+from fastapi_app.setup_postgres_database import create_db_schema
+
+logger = logging.getLogger("ragapp")
+
+BENCHMARK_URL_PREFIX = "https://hdmall.co.th/benchmark/"
+CATEGORIES = ["ตรวจสุขภาพ", "ทำฟัน", "ฉีดวัคซีน", "ผ่าตัด", "ความงาม", "กายภาพบำบัด"]
+SHOPS = ["โรงพยาบาลกรุงเทพ", "โรงพยาบาลสมิติเวช", "คลินิกทันตกรรม CSDC", "โรงพยาบาลพญาไท"]
+
+
+def build_synthetic_package(index: int, rng: random.Random) -> dict:
+    category = rng.choice(CATEGORIES)
+    shop = rng.choice(SHOPS)
+    columns = Item.__table__.columns
+    package = {column.key: f"{column.key} {index}" for column in columns if isinstance(column.type, String)}
+    return package | {
+        "url": f"{BENCHMARK_URL_PREFIX}package-{index}",
+        "package_name": f"แพ็กเกจ{category} {index} ที่ {shop}",
+        "shop_name": shop,
+        "category": category,
+        "category_tags": f"{category}, benchmark",
+        "price": float(rng.randrange(500, 50000, 100)),
+        "cash_discount": float(rng.randrange(0, 2000, 100)),
+        "price_to_reserve_for_this_package": float(rng.randrange(0, 1000, 100)),
+        "brand_ranking_position": rng.randrange(1, 100),
+    }
+
+
+def build_synthetic_catalog(count: int, seed: int = 42) -> list[dict]:
+    rng = random.Random(seed)
+    return [build_synthetic_package(index, rng) for index in range(count)]
+
+
+async def seed_synthetic_catalog(engine, count: int, embed_model: str, embed_dimensions: int, seed: int = 42):
+    """Replace the benchmark packages with `count` synthetic ones and their field embeddings."""
+    await create_db_schema(
+        engine, os.getenv("POSTGRES_VECTOR_QUANTIZATION"), os.getenv("POSTGRES_TEXT_SEARCH_CONFIG") or "thai"
+    )
+    packages = build_synthetic_catalog(count, seed)
+    items = [Item(**package) for package in packages]
+    pending = collect_pending_texts(items, embed_model, embed_dimensions)
+    logger.info("Seeding %d synthetic packages with %d field embeddings...", count, len(pending))
+
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session, session.begin():
+        await session.execute(
+            text(f"DELETE FROM {Item.__tablename__} WHERE url LIKE :prefix"), {"prefix": f"{BENCHMARK_URL_PREFIX}%"}
+        )
+        await session.execute(insert(Item.__table__), packages)
+        await save_package_embeddings(
+            session,
+            [
+                PackageEmbedding(
+                    package_url=url,
+                    field=field,
+                    embedding=fake_embedding(field_value, embed_dimensions),
+                    content_hash=content_hash,
+                )
+                for url, field, field_value, content_hash in pending
+            ],
+        )
+        await bump_catalog_generation(session)
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import logging
 import os
@@ -7,16 +8,28 @@ from dotenv import load_dotenv
 from environs import Env
 from fastapi import FastAPI
 
+from .embedding_cache import create_embedding_cache_from_env
 from .globals import global_storage
+from .metrics import PrometheusMiddleware
 from .openai_clients import create_openai_chat_client, create_openai_embed_client
 from .postgres_engine import create_postgres_engine_from_env
+from .postgres_models import get_vector_quantization
+from .postgres_searcher import PostgresSearcher
+from .product_cards import create_product_card_snapshot_from_env
+from .prompt_templates import PromptTemplates
+from .rag_advanced import AdvancedRAGChat
+from .rag_simple import SimpleRAGChat
+from .response_cache import create_response_cache_from_env
+from .retrieval_cache import create_retrieval_cache_from_env
+from .tracing import configure_tracing, instrument_app
 
 logger = logging.getLogger("ragapp")
 
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
-    load_dotenv(override=True)
+    # DOTENV_PATH lets tools such as the benchmarks point the app at another dotenv file
+    load_dotenv(os.getenv("DOTENV_PATH"), override=True)
 
     azure_credential = None
     try:
@@ -35,6 +48,7 @@ async def lifespan(app: FastAPI):
 
     engine = await create_postgres_engine_from_env(azure_credential)
     global_storage.engine = engine
+    configure_tracing(engine)
 
     openai_chat_client, openai_chat_model = await create_openai_chat_client(azure_credential)
     global_storage.openai_chat_client = openai_chat_client
@@ -47,8 +61,60 @@ async def lifespan(app: FastAPI):
     global_storage.openai_embed_model = openai_embed_model
     global_storage.openai_embed_dimensions = openai_embed_dimensions
 
+    embedding_cache = create_embedding_cache_from_env(engine)
+    if embedding_cache is not None and embedding_cache.shared_store is not None:
+        await embedding_cache.shared_store.purge_expired()
+    global_storage.embedding_cache = embedding_cache
+    retrieval_cache = create_retrieval_cache_from_env(engine)
+    global_storage.retrieval_cache = retrieval_cache
+    response_cache = create_response_cache_from_env(engine)
+    if response_cache is not None:
+        await response_cache.purge_expired()
+    global_storage.response_cache = response_cache
+    # Card lookups read the database until the snapshot has loaded
+    product_card_snapshot = create_product_card_snapshot_from_env(engine)
+    if product_card_snapshot is not None:
+        product_card_snapshot.start()
+    global_storage.product_card_snapshot = product_card_snapshot
+
+    # Build the searcher and RAG flows once per worker; they hold no per-request state
+    prompt_templates = await asyncio.to_thread(PromptTemplates)
+    global_storage.prompt_templates = prompt_templates
+    searcher = PostgresSearcher(
+        engine,
+        openai_embed_client=openai_embed_client,
+        embed_deployment=global_storage.openai_embed_deployment,
+        embed_model=openai_embed_model,
+        embed_dimensions=openai_embed_dimensions,
+        embedding_cache=embedding_cache,
+        vector_quantization=get_vector_quantization(os.getenv("POSTGRES_VECTOR_QUANTIZATION")),
+        quantized_oversampling=int(os.getenv("POSTGRES_VECTOR_OVERSAMPLING", "4")),
+        exact_search_max_packages=int(os.getenv("POSTGRES_EXACT_SEARCH_MAX_PACKAGES", "2000")),
+        retrieval_cache=retrieval_cache,
+        product_card_snapshot=product_card_snapshot,
+    )
+    global_storage.searcher = searcher
+    global_storage.advanced_rag_chat = AdvancedRAGChat(
+        searcher=searcher,
+        openai_chat_client=openai_chat_client,
+        chat_model=openai_chat_model,
+        chat_deployment=global_storage.openai_chat_deployment,
+        prompt_templates=prompt_templates,
+        context_token_limit=int(os.getenv("CHAT_CONTEXT_TOKEN_LIMIT", "0")) or None,
+        speculative_search=os.getenv("CHAT_SPECULATIVE_SEARCH", "false").lower() == "true",
+    )
+    global_storage.simple_rag_chat = SimpleRAGChat(
+        searcher=searcher,
+        openai_chat_client=openai_chat_client,
+        chat_model=openai_chat_model,
+        chat_deployment=global_storage.openai_chat_deployment,
+        prompt_templates=prompt_templates,
+    )
+
     yield
 
+    if product_card_snapshot is not None:
+        await product_card_snapshot.stop()
     await engine.dispose()
 
 
@@ -62,6 +128,8 @@ def create_app():
         logging.basicConfig(level=logging.WARNING)
 
     app = FastAPI(docs_url="/docs", lifespan=lifespan)
+    app.add_middleware(PrometheusMiddleware, get_engine=lambda: global_storage.engine)
+    instrument_app(app)
 
     from . import api_routes  # noqa
     from . import frontend_routes  # noqa
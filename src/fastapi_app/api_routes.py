@@ -1,83 +1,186 @@
+import asyncio
+import json
+import logging
+from collections.abc import AsyncGenerator
+from typing import Annotated
+
 import fastapi
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select
-from sqlalchemy.ext.asyncio import async_sessionmaker
 
 from fastapi_app.api_models import ChatRequest
 from fastapi_app.globals import global_storage
-from fastapi_app.postgres_models import Item
+from fastapi_app.metrics import generate_metrics, update_pool_metrics
+from fastapi_app.postgres_engine import get_pool_stats
+from fastapi_app.postgres_models import PackageNeighbor
 from fastapi_app.postgres_searcher import PostgresSearcher
 from fastapi_app.rag_advanced import AdvancedRAGChat
 from fastapi_app.rag_simple import SimpleRAGChat
+from fastapi_app.response_cache import find_package_urls, get_single_turn_question
+
+logger = logging.getLogger("ragapp")
 
 router = fastapi.APIRouter()
 
 
-@router.get("/items/{id}")
-async def item_handler(id: int):
-    """A simple API to get an item by ID."""
-    async_session_maker = async_sessionmaker(global_storage.engine, expire_on_commit=False)
-    async with async_session_maker() as session:
-        item = (await session.scalars(select(Item).where(Item.id == id))).first()
-        return item.to_dict()
+def get_searcher() -> PostgresSearcher:
+    return global_storage.searcher
+
+
+def get_advanced_rag_chat() -> AdvancedRAGChat:
+    return global_storage.advanced_rag_chat
+
+
+def get_simple_rag_chat() -> SimpleRAGChat:
+    return global_storage.simple_rag_chat
+
+
+SearcherDep = Annotated[PostgresSearcher, fastapi.Depends(get_searcher)]
+AdvancedRAGChatDep = Annotated[AdvancedRAGChat, fastapi.Depends(get_advanced_rag_chat)]
+SimpleRAGChatDep = Annotated[SimpleRAGChat, fastapi.Depends(get_simple_rag_chat)]
+
+
+@router.get("/items")
+async def item_handler(searcher: SearcherDep, url: str):
+    """A simple API to get a package by URL."""
+    async with searcher.async_session_maker() as session:
+        items = await searcher.fetch_items(session, [url])
+    if not items:
+        raise fastapi.HTTPException(status_code=404, detail="Package not found")
+    return items[0].to_dict()
 
 
 @router.get("/similar")
-async def similar_handler(id: int, n: int = 5):
-    """A similarity API to find items similar to items with given ID."""
-    async_session_maker = async_sessionmaker(global_storage.engine, expire_on_commit=False)
-    async with async_session_maker() as session:
-        item = (await session.scalars(select(Item).where(Item.id == id))).first()
-        closest = await session.execute(
-            select(Item, Item.embedding.l2_distance(item.embedding))
-            .filter(Item.id != id)
-            .order_by(Item.embedding.l2_distance(item.embedding))
-            .limit(n)
-        )
-        return [item.to_dict() | {"distance": round(distance, 2)} for item, distance in closest]
+async def similar_handler(searcher: SearcherDep, url: str, n: int = 5):
+    """The packages most similar to the package with the given URL, from the precomputed package_neighbors."""
+    async with searcher.async_session_maker() as session:
+        neighbors = (
+            await session.execute(
+                select(PackageNeighbor.neighbor_url, PackageNeighbor.score)
+                .where(PackageNeighbor.package_url == url)
+                .order_by(PackageNeighbor.rank)
+                .limit(n)
+            )
+        ).all()
+        if not neighbors and not await searcher.fetch_items(session, [url]):
+            raise fastapi.HTTPException(status_code=404, detail="Package not found")
+        items = await searcher.fetch_items(session, [neighbor_url for neighbor_url, _ in neighbors])
+    scores = dict(neighbors)
+    return [item.to_dict() | {"score": round(scores[item.url], 4)} for item in items]
 
 
 @router.get("/search")
-async def search_handler(query: str, top: int = 5, enable_vector_search: bool = True, enable_text_search: bool = True):
+async def search_handler(
+    searcher: SearcherDep,
+    query: str,
+    top: int = 5,
+    enable_vector_search: bool = True,
+    enable_text_search: bool = True,
+):
     """A search API to find items based on a query."""
-    searcher = PostgresSearcher(
-        global_storage.engine,
-        openai_embed_client=global_storage.openai_embed_client,
-        embed_deployment=global_storage.openai_embed_deployment,
-        embed_model=global_storage.openai_embed_model,
-        embed_dimensions=global_storage.openai_embed_dimensions,
-    )
     results = await searcher.search_and_embed(
         query, top=top, enable_vector_search=enable_vector_search, enable_text_search=enable_text_search
     )
     return [item.to_dict() for item in results]
 
 
+@router.get("/embedding-cache/stats")
+async def embedding_cache_stats_handler():
+    """Hit/miss counters of this worker's query embedding cache."""
+    if global_storage.embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True} | global_storage.embedding_cache.stats()
+
+
+@router.get("/retrieval-cache/stats")
+async def retrieval_cache_stats_handler():
+    """Hit/miss counters of this worker's retrieval result cache."""
+    if global_storage.retrieval_cache is None:
+        return {"enabled": False}
+    return {"enabled": True} | global_storage.retrieval_cache.stats()
+
+
+@router.get("/pool-stats")
+async def pool_stats_handler():
+    """Connection pool usage of this worker's database engine."""
+    return get_pool_stats(global_storage.engine)
+
+
+@router.get("/metrics")
+async def metrics_handler():
+    """Prometheus metrics, aggregated over all gunicorn workers."""
+    update_pool_metrics(global_storage.engine)
+    content, content_type = generate_metrics()
+    return fastapi.Response(content, media_type=content_type)
+
+
+@router.post("/prompts/reload")
+async def reload_prompts_handler():
+    """Re-read the prompt templates from disk (in the worker that serves this request)."""
+    await asyncio.to_thread(global_storage.prompt_templates.load)
+    return {"reloaded": True}
+
+
 @router.post("/chat")
-async def chat_handler(chat_request: ChatRequest):
+async def chat_handler(
+    chat_request: ChatRequest,
+    advanced_rag_chat: AdvancedRAGChatDep,
+    simple_rag_chat: SimpleRAGChatDep,
+    searcher: SearcherDep,
+    background_tasks: fastapi.BackgroundTasks,
+):
     messages = [message.model_dump() for message in chat_request.messages]
     overrides = chat_request.context.get("overrides", {})
+    ragchat = advanced_rag_chat if overrides.get("use_advanced_flow") else simple_rag_chat
 
-    searcher = PostgresSearcher(
-        global_storage.engine,
-        openai_embed_client=global_storage.openai_embed_client,
-        embed_deployment=global_storage.openai_embed_deployment,
-        embed_model=global_storage.openai_embed_model,
-        embed_dimensions=global_storage.openai_embed_dimensions,
-    )
-    if overrides.get("use_advanced_flow"):
-        ragchat = AdvancedRAGChat(
-            searcher=searcher,
-            openai_chat_client=global_storage.openai_chat_client,
-            chat_model=global_storage.openai_chat_model,
-            chat_deployment=global_storage.openai_chat_deployment,
-        )
-    else:
-        ragchat = SimpleRAGChat(
-            searcher=searcher,
-            openai_chat_client=global_storage.openai_chat_client,
-            chat_model=global_storage.openai_chat_model,
-            chat_deployment=global_storage.openai_chat_deployment,
-        )
+    # Single-turn questions may be answered from the semantic response cache
+    response_cache = global_storage.response_cache
+    question = None
+    if response_cache is not None and overrides.get("use_response_cache", True):
+        question = get_single_turn_question(messages)
+    if question:
+        settings_key = response_cache.make_settings_key(global_storage.openai_chat_model, overrides)
+        embedding = await searcher.compute_query_embedding(question)
+        if (entry := await response_cache.lookup(settings_key, embedding)) is not None:
+            product_cards = None
+            if overrides.get("use_advanced_flow"):
+                product_cards = await searcher.get_product_cards_info(find_package_urls(entry["answer"]))
+            return response_cache.build_chat_response(entry, product_cards)
 
     response = await ragchat.run(messages, overrides=overrides)
+
+    if question:
+        choice = response["choices"][0]
+        if choice["finish_reason"] == "stop" and choice["message"]["content"]:
+            background_tasks.add_task(
+                response_cache.store,
+                settings_key,
+                question,
+                embedding,
+                choice["message"]["content"],
+                choice["context"]["data_points"],
+            )
     return response
+
+
+async def format_as_ndjson(events: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+    try:
+        async for event in events:
+            yield json.dumps(jsonable_encoder(event), ensure_ascii=False) + "\n"
+    except Exception as error:
+        logger.exception("Exception while generating response stream: %s", error)
+        yield json.dumps({"error": str(error)}, ensure_ascii=False) + "\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream_handler(
+    chat_request: ChatRequest, advanced_rag_chat: AdvancedRAGChatDep, simple_rag_chat: SimpleRAGChatDep
+):
+    """Stream the chat answer as NDJSON: the retrieval context first, then answer deltas, then product cards."""
+    messages = [message.model_dump() for message in chat_request.messages]
+    overrides = chat_request.context.get("overrides", {})
+    ragchat = advanced_rag_chat if overrides.get("use_advanced_flow") else simple_rag_chat
+
+    result = ragchat.run_stream(messages, overrides=overrides)
+    return StreamingResponse(format_as_ndjson(result), media_type="application/x-ndjson")
@@ -0,0 +1,192 @@
+import logging
+from dataclasses import dataclass, field
+
+from openai_messages_token_helper import build_messages, count_tokens_for_message, count_tokens_for_system_and_tools
+from openai_messages_token_helper.model_helper import encoding_for_model
+
+from .postgres_models import Item
+
+logger = logging.getLogger("ragapp")
+
+# Package fields sent as sources, most important first: when the budget runs out, fields are dropped from the end
+BROAD_RAG_FIELDS = ("package_name", "url", "price", "locations", "brand")
+NARROW_RAG_FIELDS = (
+    "package_name",
+    "url",
+    "price",
+    "cash_discount",
+    "installment_month",
+    "installment_limit",
+    "price_to_reserve_for_this_package",
+    "shop_name",
+    "brand",
+    "locations",
+    "category",
+    "package_details",
+    "price_details",
+    "important_info",
+    "payment_booking_info",
+    "selling_point",
+    "min_max_age",
+    "preview_1_10",
+    "common_question",
+    "faq",
+    "hdcare_summary",
+    "general_info",
+    "meta_description",
+    "how_to_diagnose",
+    "early_signs_for_diagnosis",
+    "know_this_disease",
+    "courses_of_action",
+    "signals_to_proceed_surgery",
+    "get_to_know_this_surgery",
+    "comparisons",
+    "getting_ready",
+    "recovery",
+    "side_effects",
+    "review_4_5_stars",
+    "brand_option_in_thai_name",
+    "brand_ranking_position",
+    "category_tags",
+    "meta_keywords",
+    "package_picture",
+)
+
+SOURCES_HEADER = "\n\nSources:\n"
+TRUNCATION_MARKER = " ..."
+
+
+@dataclass
+class PackingReport:
+    """What was left out of the answer prompt to fit the token budget, shown in the thoughts."""
+
+    token_budget: int
+    prompt_tokens: int = 0
+    dropped_messages: int = 0
+    dropped_sources: list[str] = field(default_factory=list)
+    dropped_fields: dict[str, list[str]] = field(default_factory=dict)
+    truncated_fields: dict[str, list[str]] = field(default_factory=dict)
+
+
+class ContextAssembler:
+    """
+    Builds prompts that fit a token budget. Sources are packed one field rank at a time across all packages,
+    so every package gets its name and price before any package gets its long descriptions,
+    and past turns are kept from the newest to the oldest.
+    """
+
+    def __init__(
+        self, model: str, max_field_tokens: int = 400, min_field_tokens: int = 32, history_share: float = 0.25
+    ):
+        self.model = model
+        self.encoding = encoding_for_model(model, default_to_cl100k=True)
+        self.max_field_tokens = max_field_tokens
+        self.min_field_tokens = min_field_tokens
+        self.history_share = history_share
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def count_message(self, message: dict) -> int:
+        return count_tokens_for_message(self.model, message, default_to_cl100k=True)
+
+    def count_prompt(self, messages: list[dict]) -> int:
+        system_message, *other_messages = messages
+        return count_tokens_for_system_and_tools(self.model, system_message, default_to_cl100k=True) + sum(
+            self.count_message(message) for message in other_messages
+        )
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens tokens, marker included."""
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        kept_tokens = max(max_tokens - self.count_tokens(TRUNCATION_MARKER), 0)
+        return self.encoding.decode(tokens[:kept_tokens]) + TRUNCATION_MARKER
+
+    def count_recent_history(self, past_messages: list[dict], max_tokens: int) -> int:
+        """Count the tokens of the newest past messages that fit in max_tokens, as build_messages would keep them."""
+        used = 0
+        for message in reversed(past_messages):
+            tokens = self.count_message(message)
+            if used + tokens > max_tokens:
+                break
+            used += tokens
+        return used
+
+    def pack_sources(
+        self, items: list[Item], fields: tuple[str, ...], max_tokens: int, report: PackingReport
+    ) -> tuple[list[str], int]:
+        """Render the fields of the ranked items that fit in max_tokens, returning the sources and their token count."""
+        admitted: dict[str, list[str]] = {}
+        used = 0
+        for rank, name in enumerate(fields):
+            for item in items:
+                if rank > 0 and item.url not in admitted:
+                    continue
+                value = getattr(item, name, None)
+                text = "" if value is None else str(value)
+                line = f"    {name}: {self.truncate(text, self.max_field_tokens)}\n" if text else ""
+                tokens = self.count_tokens(line)
+                if rank == 0:
+                    # The first field admits the package, and pays for its header
+                    tokens += self.count_tokens(f"[{item.url}]:\n\n")
+                    if used + tokens > max_tokens:
+                        report.dropped_sources.append(item.url)
+                        continue
+                    admitted[item.url] = []
+                elif not text:
+                    continue
+                elif used + tokens > max_tokens:
+                    available = max_tokens - used - self.count_tokens(f"    {name}: \n")
+                    if available < self.min_field_tokens:
+                        report.dropped_fields.setdefault(item.url, []).append(name)
+                        continue
+                    line = f"    {name}: {self.truncate(text, available)}\n"
+                    tokens = self.count_tokens(line)
+                if line.endswith(TRUNCATION_MARKER + "\n"):
+                    report.truncated_fields.setdefault(item.url, []).append(name)
+                if line:
+                    admitted[item.url].append(line)
+                used += tokens
+
+        sources = [f"[{url}]:\n" + "".join(lines) + "\n" for url, lines in admitted.items()]
+        return sources, used
+
+    def assemble(
+        self, system_prompt: str, messages: list[dict], items: list[Item], fields: tuple[str, ...], max_tokens: int
+    ) -> tuple[list[dict], list[str], PackingReport]:
+        """
+        Build the answer prompt: the system prompt, the past messages and the last user message with the sources.
+        The system prompt and the question are always sent; sources come next, and past messages get what is left,
+        with up to history_share of the remaining budget reserved for them. The past messages are fitted by
+        openai_messages_token_helper.build_messages, like the other prompts of the RAG flows.
+        """
+        report = PackingReport(token_budget=max_tokens)
+        *past_messages, user_message = messages
+        used = (
+            count_tokens_for_system_and_tools(
+                self.model, {"role": "system", "content": system_prompt}, default_to_cl100k=True
+            )
+            + self.count_message(user_message)
+            + self.count_tokens(SOURCES_HEADER)
+        )
+        if used > max_tokens:
+            logger.warning("The system prompt and question take %d tokens, over the budget of %d", used, max_tokens)
+
+        # Reserve room for the newest past messages that fit in history_share of the remaining budget
+        history_reserve = self.count_recent_history(past_messages, int(max(max_tokens - used, 0) * self.history_share))
+        sources, _ = self.pack_sources(items, fields, max_tokens - used - history_reserve, report)
+
+        answer_messages = build_messages(
+            self.model,
+            system_prompt,
+            new_user_content=[*user_message["content"], {"type": "text", "text": SOURCES_HEADER + "\n".join(sources)}],
+            past_messages=past_messages,
+            max_tokens=max_tokens,
+            fallback_to_default=True,
+        )
+        # build_messages returns the system message, the kept past messages and the user message
+        report.dropped_messages = len(past_messages) - (len(answer_messages) - 2)
+        report.prompt_tokens = self.count_prompt(answer_messages)
+        return answer_messages, sources, report
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+from collections.abc import AsyncGenerator, Iterable
+
+import pandas as pd
+from sqlalchemy import text
+
+from fastapi_app.postgres_models import Item
+
+logger = logging.getLogger("ragapp")
+
+PACKAGES_CSV_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "packages.csv")
+
+# Columns loaded from the CSV; search_tsv is generated
+SYNC_COLUMNS = [column.key for column in Item.__table__.columns if column.computed is None]
+# Rows missing one of these would make the whole INSERT from the staging table fail
+REQUIRED_COLUMNS = [column.key for column in Item.__table__.columns if column.computed is None and not column.nullable]
+NUMERIC_COLUMNS = ["price", "cash_discount", "price_to_reserve_for_this_package", "brand_ranking_position"]
+INTEGER_COLUMNS = ["brand_ranking_position"]
+STAGING_TABLE = "packages_staging"
+
+_END_OF_FILE = object()
+
+
+def read_csv_chunks(csv_path: str = PACKAGES_CSV_PATH, chunksize: int = 5000):
+    """Read the CSV lazily in chunks, keeping every column as text until it is coerced."""
+    return pd.read_csv(
+        csv_path,
+        delimiter=",",
+        quotechar='"',
+        escapechar="\\",
+        on_bad_lines="skip",
+        encoding="utf-8",
+        dtype=str,
+        chunksize=chunksize,
+    )
+
+
+def normalize_chunk(chunk: pd.DataFrame, required_columns: Iterable[str] = REQUIRED_COLUMNS) -> list[tuple]:
+    """
+    Coerce a CSV chunk to the column types of the packages table with vectorized conversions,
+    and return its valid rows as tuples in SYNC_COLUMNS order. Rows missing a required value, including numbers
+    that failed to parse, are logged and dropped.
+    """
+    chunk = chunk.reindex(columns=SYNC_COLUMNS)
+    for column in NUMERIC_COLUMNS:
+        values = pd.to_numeric(chunk[column], errors="coerce")
+        if column in INTEGER_COLUMNS:
+            values = values.where(values % 1 == 0).astype("Int64")
+        chunk[column] = values
+
+    missing = chunk[list(required_columns)].isna()
+    valid = ~missing.any(axis=1)
+    if not valid.all():
+        missing_counts = missing.sum()
+        logger.warning(
+            "Rejected %d rows with missing or invalid values (%s), e.g. %s",
+            (~valid).sum(),
+            ", ".join(f"{column}: {count}" for column, count in missing_counts[missing_counts > 0].items()),
+            chunk.loc[~valid, "url"].head(5).tolist(),
+        )
+        chunk = chunk[valid]
+
+    chunk = chunk.astype(object)
+    chunk = chunk.where(chunk.notna(), None)
+    return list(chunk.itertuples(index=False, name=None))
+
+
+async def stream_csv_rows(
+    csv_path: str = PACKAGES_CSV_PATH,
+    required_columns: Iterable[str] = REQUIRED_COLUMNS,
+    chunksize: int = 5000,
+    max_pending_chunks: int = 4,
+) -> AsyncGenerator[tuple[list[tuple], int], None]:
+    """
+    Parse and normalize the CSV in a worker thread while the caller writes the previous chunks,
+    yielding the valid rows of each chunk with the number of rows rejected from it.
+    The bounded queue applies backpressure, so at most `max_pending_chunks` chunks are held in memory.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending_chunks)
+
+    async def produce():
+        try:
+            reader = await asyncio.to_thread(read_csv_chunks, csv_path, chunksize)
+            with reader:
+                while (chunk := await asyncio.to_thread(next, reader, None)) is not None:
+                    rows = await asyncio.to_thread(normalize_chunk, chunk, required_columns)
+                    await queue.put((rows, len(chunk) - len(rows)))
+            await queue.put(_END_OF_FILE)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (chunk_rows := await queue.get()) is not _END_OF_FILE:
+            if isinstance(chunk_rows, Exception):
+                raise chunk_rows
+            yield chunk_rows
+    finally:
+        producer.cancel()
+
+
+async def copy_csv_to_staging(
+    session,
+    csv_path: str = PACKAGES_CSV_PATH,
+    required_columns: Iterable[str] = REQUIRED_COLUMNS,
+    chunksize: int = 5000,
+) -> tuple[int, int]:
+    """
+    Create a transaction-scoped staging table and stream the CSV into it with COPY, chunk by chunk.
+    The csv_row column keeps the file order, so later rows for the same URL can win.
+    Invalid rows are left out, so they cannot fail the statements that read the staging table.
+    Returns the number of staged rows and the number of rejected rows.
+    """
+    await session.execute(
+        text(
+            f"""
+            CREATE TEMP TABLE {STAGING_TABLE} ON COMMIT DROP AS
+            SELECT {", ".join(SYNC_COLUMNS)} FROM {Item.__tablename__} WITH NO DATA
+            """
+        )
+    )
+    await session.execute(text(f"ALTER TABLE {STAGING_TABLE} ADD COLUMN csv_row BIGSERIAL"))
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    staged = rejected = 0
+    async for rows, chunk_rejected in stream_csv_rows(csv_path, required_columns, chunksize):
+        if rows:
+            await raw_connection.driver_connection.copy_records_to_table(
+                STAGING_TABLE, records=rows, columns=SYNC_COLUMNS
+            )
+        staged += len(rows)
+        rejected += chunk_rejected
+        logger.info(f"Staged {staged} records...")
+    return staged, rejected
+
+
+def latest_staged_rows_query() -> str:
+    """Select the staged rows, keeping only the last CSV row for each URL."""
+    return f"""
+        SELECT DISTINCT ON (url) {", ".join(SYNC_COLUMNS)} FROM {STAGING_TABLE}
+        ORDER BY url, csv_row DESC
+    """
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+
+from pgvector.utils import to_db
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fastapi_app.metrics import CACHE_LOOKUPS
+from fastapi_app.postgres_models import EmbeddingCacheEntry
+
+logger = logging.getLogger("ragapp")
+
+
+def normalize_query_text(q: str) -> str:
+    """Normalize text so that trivially different spellings of a query share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", q).lower().split())
+
+
+class PostgresEmbeddingCacheStore:
+    """Shared cache tier backed by the embedding_cache table, so hits are shared between gunicorn workers."""
+
+    def __init__(self, engine: AsyncEngine, ttl: float):
+        self.engine = engine
+        self.ttl = ttl
+
+    async def get(self, key: str) -> list[float] | None:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                text(
+                    f"""
+                    SELECT embedding::text FROM {EmbeddingCacheEntry.__tablename__}
+                    WHERE key = :key AND created_at > now() - make_interval(secs => :ttl)
+                    """
+                ),
+                {"key": key, "ttl": self.ttl},
+            )
+            row = result.first()
+        if row is None:
+            return None
+        return [float(value) for value in row[0].strip("[]").split(",")]
+
+    async def set(self, key: str, embedding: list[float]):
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                text(
+                    f"""
+                    INSERT INTO {EmbeddingCacheEntry.__tablename__} (key, embedding, created_at)
+                    VALUES (:key, CAST(:embedding AS vector), now())
+                    ON CONFLICT (key) DO UPDATE SET embedding = EXCLUDED.embedding, created_at = EXCLUDED.created_at
+                    """
+                ),
+                {"key": key, "embedding": to_db(embedding)},
+            )
+
+    async def purge_expired(self):
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(
+                    text(
+                        f"""
+                        DELETE FROM {EmbeddingCacheEntry.__tablename__}
+                        WHERE created_at <= now() - make_interval(secs => :ttl)
+                        """
+                    ),
+                    {"ttl": self.ttl},
+                )
+        except Exception as e:
+            logger.warning("Failed to purge the shared embedding cache: %s", e)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings: an in-process LRU with TTL eviction,
+    in front of an optional shared store.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, shared_store: PostgresEmbeddingCacheStore = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_store = shared_store
+        self.entries: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(embed_model: str, embed_dimensions, q: str) -> str:
+        return hashlib.sha256(f"{embed_model}|{embed_dimensions}|{normalize_query_text(q)}".encode()).hexdigest()
+
+    async def get(self, key: str) -> list[float] | None:
+        if entry := self.entries.get(key):
+            expires_at, embedding = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.labels(cache="embedding", result="hit").inc()
+                return embedding
+            del self.entries[key]
+
+        if self.shared_store is not None:
+            try:
+                embedding = await self.shared_store.get(key)
+            except Exception as e:
+                logger.warning("Failed to read from the shared embedding cache: %s", e)
+                embedding = None
+            if embedding is not None:
+                self.shared_hits += 1
+                CACHE_LOOKUPS.labels(cache="embedding", result="shared_hit").inc()
+                self._set_local(key, embedding)
+                return embedding
+
+        self.misses += 1
+        CACHE_LOOKUPS.labels(cache="embedding", result="miss").inc()
+        return None
+
+    async def set(self, key: str, embedding: list[float]):
+        self._set_local(key, embedding)
+        if self.shared_store is not None:
+            try:
+                await self.shared_store.set(key, embedding)
+            except Exception as e:
+                logger.warning("Failed to write to the shared embedding cache: %s", e)
+
+    def _set_local(self, key: str, embedding: list[float]):
+        self.entries[key] = (time.monotonic() + self.ttl, embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+        }
+
+
+def create_embedding_cache_from_env(engine: AsyncEngine) -> EmbeddingCache | None:
+    max_size = int(os.getenv("EMBEDDING_CACHE_MAX_SIZE", "10000"))
+    if max_size <= 0:
+        logger.info("Query embedding cache is disabled")
+        return None
+    ttl = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+    shared_store = None
+    if os.getenv("EMBEDDING_CACHE_SHARED") == "postgres":
+        logger.info("Sharing the query embedding cache between workers using Postgres...")
+        shared_store = PostgresEmbeddingCacheStore(engine, ttl)
+    return EmbeddingCache(max_size=max_size, ttl=ttl, shared_store=shared_store)
@@ -0,0 +1,207 @@
+import hashlib
+import logging
+from collections.abc import AsyncGenerator
+
+from sqlalchemy import ARRAY, String, any_, bindparam, delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from fastapi_app.embeddings import compute_text_embeddings
+from fastapi_app.postgres_models import EMBEDDING_FIELDS, Item, PackageEmbedding
+
+logger = logging.getLogger("ragapp")
+
+
+def get_to_str_method(item, field):
+    method_name = f"to_str_for_embedding_{field}"
+    return getattr(item, method_name, None)
+
+
+def compute_content_hash(field_value: str, embed_model: str, embed_dimensions) -> str:
+    return hashlib.sha256(f"{embed_model}|{embed_dimensions}|{field_value}".encode()).hexdigest()
+
+
+def collect_pending_texts(
+    items: list[Item],
+    embed_model: str,
+    embed_dimensions,
+    existing_hashes: dict[tuple[str, str], str] | None = None,
+    fields: list[str] = EMBEDDING_FIELDS,
+) -> list[tuple[str, str, str, str]]:
+    """
+    Collect the (url, field, text, content hash) tuples that need an embedding, skipping empty fields.
+    When existing hashes are given, fields whose text and embedding model are unchanged are skipped too.
+    """
+    existing_hashes = existing_hashes or {}
+    pending = []
+    for item in items:
+        for field in fields:
+            to_str_method = get_to_str_method(item, field)
+            if to_str_method and (field_value := to_str_method()):
+                content_hash = compute_content_hash(field_value, embed_model, embed_dimensions)
+                if existing_hashes.get((item.url, field)) != content_hash:
+                    pending.append((item.url, field, field_value, content_hash))
+    return pending
+
+
+def find_emptied_fields(
+    items: list[Item], existing_hashes: dict[tuple[str, str], str], fields: list[str] = EMBEDDING_FIELDS
+) -> list[tuple[str, str]]:
+    """Find the (url, field) pairs that still have an embedding although their text is now empty."""
+    emptied = []
+    for item in items:
+        for field in fields:
+            to_str_method = get_to_str_method(item, field)
+            if (item.url, field) in existing_hashes and not (to_str_method and to_str_method()):
+                emptied.append((item.url, field))
+    return emptied
+
+
+async def iter_item_batches(
+    session_maker, batch_size: int = 100, urls: list[str] | None = None
+) -> AsyncGenerator[list[Item], None]:
+    """
+    Stream items in pages ordered by URL using keyset pagination (WHERE url > last url),
+    optionally limited to the given URLs. Each page is read in its own short transaction, which has ended
+    by the time the page is yielded, so slow embedding calls never hold a snapshot open and block vacuum.
+    """
+    last_url = None
+    while True:
+        stmt = select(Item).order_by(Item.url).limit(batch_size)
+        if urls is not None:
+            stmt = stmt.where(Item.url == any_(bindparam("urls", urls, ARRAY(String))))
+        if last_url is not None:
+            stmt = stmt.where(Item.url > last_url)
+        async with session_maker() as session:
+            items = (await session.scalars(stmt)).all()
+        if not items:
+            break
+        yield items
+        last_url = items[-1].url
+
+
+async def fetch_content_hashes(session, urls: list[str]) -> dict[tuple[str, str], str | None]:
+    """Fetch the content hashes of the stored field embeddings of the given packages."""
+    result = await session.execute(
+        select(PackageEmbedding.package_url, PackageEmbedding.field, PackageEmbedding.content_hash).where(
+            PackageEmbedding.package_url == any_(bindparam("urls", urls, ARRAY(String)))
+        )
+    )
+    return {(url, field): content_hash for url, field, content_hash in result}
+
+
+async def embed_items(
+    items: list[Item],
+    openai_embed_client,
+    embed_model: str,
+    embed_deployment: str | None = None,
+    embed_dimensions: int = 1536,
+    concurrency: int = 4,
+    existing_hashes: dict[tuple[str, str], str] | None = None,
+) -> list[PackageEmbedding]:
+    """
+    Embed the non-empty fields of the given items in large batches.
+    Pass the existing content hashes to only embed the fields that changed.
+    """
+    pending = collect_pending_texts(items, embed_model, embed_dimensions, existing_hashes)
+    logger.info("Embedding %d fields of %d items...", len(pending), len(items))
+    embeddings = await compute_text_embeddings(
+        [field_value for _, _, field_value, _ in pending],
+        openai_embed_client,
+        embed_model,
+        embed_deployment,
+        embed_dimensions,
+        concurrency=concurrency,
+    )
+    return [
+        PackageEmbedding(package_url=url, field=field, embedding=embedding, content_hash=content_hash)
+        for (url, field, _, content_hash), embedding in zip(pending, embeddings)
+    ]
+
+
+async def save_package_embeddings(session, package_embeddings: list[PackageEmbedding], batch_size: int = 1000):
+    """Upsert field embeddings with multi-row INSERT ... ON CONFLICT statements."""
+    stmt = insert(PackageEmbedding)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PackageEmbedding.package_url, PackageEmbedding.field],
+        set_={"embedding": stmt.excluded.embedding, "content_hash": stmt.excluded.content_hash},
+    )
+    for start in range(0, len(package_embeddings), batch_size):
+        batch = package_embeddings[start : start + batch_size]
+        await session.execute(
+            stmt,
+            [
+                {
+                    "package_url": embedding.package_url,
+                    "field": embedding.field,
+                    "embedding": embedding.embedding,
+                    "content_hash": embedding.content_hash,
+                }
+                for embedding in batch
+            ],
+        )
+
+
+async def delete_package_embeddings(session, fields: list[tuple[str, str]]):
+    if fields:
+        await session.execute(
+            delete(PackageEmbedding).where(tuple_(PackageEmbedding.package_url, PackageEmbedding.field).in_(fields))
+        )
+
+
+async def reembed_changed_items_in_batches(
+    session_maker,
+    openai_embed_client,
+    embed_model: str,
+    embed_deployment: str | None = None,
+    embed_dimensions: int = 1536,
+    concurrency: int = 4,
+    batch_size: int = 100,
+    urls: list[str] | None = None,
+) -> int:
+    """
+    Incrementally re-embed the catalog (or the given URLs) page by page, committing after each page,
+    so neither memory use nor transaction length grows with the catalog size.
+    """
+    updated = 0
+    async for items in iter_item_batches(session_maker, batch_size, urls):
+        updated += await reembed_changed_items(
+            session_maker,
+            items,
+            openai_embed_client,
+            embed_model,
+            embed_deployment,
+            embed_dimensions,
+            concurrency=concurrency,
+        )
+        logger.info("Processed packages up to %s, %d field embeddings updated so far", items[-1].url, updated)
+    return updated
+
+
+async def reembed_changed_items(
+    session_maker,
+    items: list[Item],
+    openai_embed_client,
+    embed_model: str,
+    embed_deployment: str | None = None,
+    embed_dimensions: int = 1536,
+    concurrency: int = 4,
+) -> int:
+    """
+    Re-embed only the fields of the given items whose text or embedding model changed.
+    The embedding calls run between two short transactions, one reading the hashes and one writing the results.
+    """
+    async with session_maker() as session:
+        existing_hashes = await fetch_content_hashes(session, [item.url for item in items])
+    package_embeddings = await embed_items(
+        items,
+        openai_embed_client,
+        embed_model,
+        embed_deployment,
+        embed_dimensions,
+        concurrency=concurrency,
+        existing_hashes=existing_hashes,
+    )
+    async with session_maker() as session, session.begin():
+        await save_package_embeddings(session, package_embeddings)
+        await delete_package_embeddings(session, find_emptied_fields(items, existing_hashes))
+    return len(package_embeddings)
@@ -1,26 +1,131 @@
+import asyncio
+import logging
 from typing import (
     TypedDict,
 )
 
+import tiktoken
+from tenacity import before_sleep_log, retry, stop_after_attempt, wait_random_exponential
+
+from fastapi_app.local_embeddings import LocalEmbeddingsClient
+from fastapi_app.metrics import OPENAI_REQUEST_DURATION, count_retries
+
+logger = logging.getLogger("ragapp")
+
+SUPPORTED_DIMENSIONS_MODEL = {
+    "text-embedding-ada-002": False,
+    "text-embedding-3-small": True,
+    "text-embedding-3-large": True,
+}
+
+# Request limits of the OpenAI embeddings API
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_INPUT = 8191
+MAX_TOKENS_PER_REQUEST = 300_000
+
+
+class ExtraArgs(TypedDict, total=False):
+    dimensions: int
+
+
+def get_dimensions_args(embed_model: str, embedding_dimensions: int) -> ExtraArgs:
+    return {"dimensions": embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL.get(embed_model) else {}
+
 
 async def compute_text_embedding(
     q: str, openai_client, embed_model: str, embed_deployment: str = None, embedding_dimensions: int = 1536
 ):
-    SUPPORTED_DIMENSIONS_MODEL = {
-        "text-embedding-ada-002": False,
-        "text-embedding-3-small": True,
-        "text-embedding-3-large": True,
-    }
-
-    class ExtraArgs(TypedDict, total=False):
-        dimensions: int
-
-    dimensions_args: ExtraArgs = {"dimensions": embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[embed_model] else {}
-
-    embedding = await openai_client.embeddings.create(
-        # Azure OpenAI takes the deployment name as the model name
-        model=embed_deployment if embed_deployment else embed_model,
-        input=q,
-        **dimensions_args,
-    )
+    with OPENAI_REQUEST_DURATION.labels(operation="embeddings").time():
+        embedding = await openai_client.embeddings.create(
+            # Azure OpenAI takes the deployment name as the model name
+            model=embed_deployment if embed_deployment else embed_model,
+            input=q,
+            **get_dimensions_args(embed_model, embedding_dimensions),
+        )
     return embedding.data[0].embedding
+
+
+def get_encoding(embed_model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(embed_model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def build_embedding_batches(
+    texts: list[str],
+    embed_model: str,
+    max_inputs: int = MAX_INPUTS_PER_REQUEST,
+    max_tokens: int = MAX_TOKENS_PER_REQUEST,
+) -> list[list[str]]:
+    """
+    Split texts into request-sized batches, keeping their order.
+    Inputs longer than the per-input token limit are truncated, as the API would reject them.
+    """
+    encoding = get_encoding(embed_model)
+    batches: list[list[str]] = []
+    batch: list[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = encoding.encode(text)
+        if len(tokens) > MAX_TOKENS_PER_INPUT:
+            tokens = tokens[:MAX_TOKENS_PER_INPUT]
+            text = encoding.decode(tokens)
+        if batch and (len(batch) >= max_inputs or batch_tokens + len(tokens) > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += len(tokens)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(6),
+    before_sleep=count_retries("embeddings", before_sleep_log(logger, logging.WARNING)),
+)
+async def compute_text_embedding_batch(
+    texts: list[str], openai_client, embed_model: str, embed_deployment: str = None, embedding_dimensions: int = 1536
+) -> list[list[float]]:
+    with OPENAI_REQUEST_DURATION.labels(operation="embeddings").time():
+        response = await openai_client.embeddings.create(
+            # Azure OpenAI takes the deployment name as the model name
+            model=embed_deployment if embed_deployment else embed_model,
+            input=texts,
+            **get_dimensions_args(embed_model, embedding_dimensions),
+        )
+    return [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+
+
+async def compute_text_embeddings(
+    texts: list[str],
+    openai_client,
+    embed_model: str,
+    embed_deployment: str = None,
+    embedding_dimensions: int = 1536,
+    max_inputs: int = MAX_INPUTS_PER_REQUEST,
+    max_tokens: int = MAX_TOKENS_PER_REQUEST,
+    concurrency: int = 4,
+) -> list[list[float]]:
+    """
+    Embed many texts with as few requests as the provider limits allow, running up to `concurrency` at once.
+    Returns the embeddings in the same order as the texts.
+    A local model has no request limits and truncates inputs with its own tokenizer, so its batches are only
+    split by count, without the OpenAI tokenizer (which would need a download).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed_batch(batch: list[str]) -> list[list[float]]:
+        async with semaphore:
+            return await compute_text_embedding_batch(
+                batch, openai_client, embed_model, embed_deployment, embedding_dimensions
+            )
+
+    if isinstance(openai_client, LocalEmbeddingsClient):
+        batches = [texts[start : start + max_inputs] for start in range(0, len(texts), max_inputs)]
+    else:
+        batches = build_embedding_batches(texts, embed_model, max_inputs, max_tokens)
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [embedding for batch_embeddings in results for embedding in batch_embeddings]
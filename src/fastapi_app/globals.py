@@ -8,6 +8,14 @@ class Global:
         self.openai_embed_dimensions = None
         self.openai_chat_deployment = None
         self.openai_embed_deployment = None
+        self.embedding_cache = None
+        self.retrieval_cache = None
+        self.response_cache = None
+        self.product_card_snapshot = None
+        self.prompt_templates = None
+        self.searcher = None
+        self.advanced_rag_chat = None
+        self.simple_rag_chat = None
 
 
 global_storage = Global()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.create_embedding_response import Usage
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger("ragapp")
+
+
+def fit_dimensions(vector: list[float], dimensions: int) -> list[float]:
+    """
+    Fit a unit vector to the column size: truncate and re-normalize longer vectors,
+    and zero-pad shorter ones, which leaves their cosine distances unchanged.
+    """
+    if len(vector) > dimensions:
+        vector = vector[:dimensions]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+    return vector + [0.0] * (dimensions - len(vector))
+
+
+class LocalEmbeddingsClient:
+    """
+    Runs a sentence-transformers model on the CPU behind the same `embeddings.create` interface as the OpenAI client.
+    Concurrent calls that arrive within `batch_wait` seconds are encoded together in one model call.
+    """
+
+    def __init__(self, model, dimensions: int = 1536, batch_size: int = 32, max_workers: int = 1, batch_wait=0.005):
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        # The model releases the GIL while encoding, so threads run it in parallel without copying it per process
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-embeddings")
+        self.pending: list[tuple[list[str], int, asyncio.Future]] = []
+        self.pending_texts = 0
+        self.flush_handle: asyncio.TimerHandle | None = None
+        self.encode_tasks: set[asyncio.Task] = set()
+        self.embeddings = self
+
+    @classmethod
+    async def load(cls, model_name: str, **kwargs) -> "LocalEmbeddingsClient":
+        if SentenceTransformer is None:
+            raise ImportError(
+                "OPENAI_EMBED_HOST=local needs the sentence-transformers package: " "pip install sentence-transformers"
+            )
+        logger.info("Loading local embedding model %s...", model_name)
+        model = await asyncio.to_thread(SentenceTransformer, model_name, device="cpu")
+        return cls(model, **kwargs)
+
+    async def create(self, *, model: str, input: str | list[str], dimensions: int | None = None, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((texts, dimensions or self.dimensions, future))
+        self.pending_texts += len(texts)
+        if self.pending_texts >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_wait, self.flush)
+        vectors = await future
+        return CreateEmbeddingResponse(
+            object="list",
+            model=model,
+            data=[Embedding(object="embedding", index=index, embedding=vector) for index, vector in enumerate(vectors)],
+            usage=Usage(prompt_tokens=0, total_tokens=0),
+        )
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending, self.pending_texts = self.pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self.encode_batch(batch))
+            self.encode_tasks.add(task)
+            task.add_done_callback(self.encode_tasks.discard)
+
+    async def encode_batch(self, batch: list[tuple[list[str], int, asyncio.Future]]):
+        texts = [text for request_texts, _, _ in batch for text in request_texts]
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self.encode, texts)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for request_texts, dimensions, future in batch:
+            request_vectors = vectors[start : start + len(request_texts)]
+            start += len(request_texts)
+            if not future.done():
+                future.set_result([fit_dimensions(vector, dimensions) for vector in request_vectors])
+
+    def encode(self, texts: list[str]) -> list[list[float]]:
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+        return embeddings.tolist()
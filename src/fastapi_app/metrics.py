@@ -0,0 +1,116 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# With several gunicorn workers, PROMETHEUS_MULTIPROC_DIR is set by gunicorn.conf.py and every worker writes its
+# samples there, so /metrics reports the totals of all workers whichever worker serves the scrape.
+
+REQUEST_DURATION = Histogram(
+    "ragapp_http_request_duration_seconds",
+    "Time to serve a request, including the streamed response body",
+    ["method", "route", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+DB_POOL_CHECKED_OUT = Gauge("ragapp_db_pool_checked_out", "Database connections in use", multiprocess_mode="livesum")
+DB_POOL_OVERFLOW = Gauge(
+    "ragapp_db_pool_overflow", "Database connections opened beyond the pool size", multiprocess_mode="livesum"
+)
+DB_POOL_SIZE = Gauge("ragapp_db_pool_size", "Database connection pool size", multiprocess_mode="livesum")
+OPENAI_REQUEST_DURATION = Histogram(
+    "ragapp_openai_request_duration_seconds",
+    "Latency of a single OpenAI API call attempt (until the first chunk for streams)",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+OPENAI_RETRIES = Counter("ragapp_openai_retries_total", "OpenAI API calls retried after an error", ["operation"])
+OPENAI_TOKENS = Counter("ragapp_openai_tokens_total", "Tokens used by chat completions", ["flow", "kind"])
+CACHE_LOOKUPS = Counter("ragapp_cache_lookups_total", "Cache lookups by outcome", ["cache", "result"])
+
+
+def count_retries(operation: str, before_sleep=None):
+    """A tenacity before_sleep callback that counts the retry, then calls `before_sleep` (e.g. a logger)."""
+
+    def callback(retry_state):
+        OPENAI_RETRIES.labels(operation=operation).inc()
+        if before_sleep is not None:
+            before_sleep(retry_state)
+
+    return callback
+
+
+def record_token_usage(flow: str, usage):
+    """Count the tokens of a chat completion; streams only carry usage when the provider sends it."""
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels(flow=flow, kind="prompt").inc(usage.prompt_tokens or 0)
+    OPENAI_TOKENS.labels(flow=flow, kind="completion").inc(usage.completion_tokens or 0)
+    if (details := getattr(usage, "prompt_tokens_details", None)) and details.cached_tokens:
+        OPENAI_TOKENS.labels(flow=flow, kind="cached").inc(details.cached_tokens)
+
+
+def update_pool_metrics(engine):
+    if engine is None:
+        return
+    pool = engine.pool
+    DB_POOL_CHECKED_OUT.set(pool.checkedout())
+    DB_POOL_OVERFLOW.set(max(pool.overflow(), 0))
+    DB_POOL_SIZE.set(pool.size())
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class PrometheusMiddleware:
+    """Records request latency per route template, and refreshes this worker's pool gauges."""
+
+    def __init__(self, app: ASGIApp, get_engine):
+        self.app = app
+        self.get_engine = get_engine
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self.get_route(scope)
+        status = 500
+        started_at = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.labels(method=scope["method"], route=route, status=str(status)).observe(
+                time.perf_counter() - started_at
+            )
+            update_pool_metrics(self.get_engine())
+
+    def get_route(self, scope: Scope) -> str:
+        # Label by route template rather than raw path, to keep the number of series bounded
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "") or "/"
+        return "unmatched"
@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
+from fastapi_app.postgres_models import EMBEDDING_FIELDS, Item, PackageEmbedding
+from fastapi_app.retrieval_cache import bump_catalog_generation
+
+logger = logging.getLogger("ragapp")
+
+
+async def find_legacy_embedding_fields(conn) -> list[str]:
+    """The fields whose per-column embedding is still in the packages table."""
+    result = await conn.execute(
+        text(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = :table AND column_name = ANY(:columns)
+            """
+        ),
+        {"table": Item.__tablename__, "columns": [f"embedding_{field}" for field in EMBEDDING_FIELDS]},
+    )
+    columns = {column for (column,) in result}
+    return [field for field in EMBEDDING_FIELDS if f"embedding_{field}" in columns]
+
+
+async def migrate_package_embeddings(engine):
+    """
+    Copy the per-column embeddings of every package into the normalized package_embeddings table,
+    then drop the per-column embeddings and their HNSW indexes, which every write would otherwise keep updating.
+    """
+    async with engine.begin() as conn:
+        fields = await find_legacy_embedding_fields(conn)
+        if not fields:
+            logger.info("No per-column embeddings left in %s, nothing to migrate.", Item.__tablename__)
+            return
+        field_values = ",\n".join(f"('{field}', p.embedding_{field})" for field in fields)
+        logger.info("Copying embeddings from %s into %s...", Item.__tablename__, PackageEmbedding.__tablename__)
+        # The hashes of the copied embeddings are unknown, so reset them for the next run of update_embeddings.py
+        # to compute them (re-embedding those fields once)
+        result = await conn.execute(
+            text(
+                f"""
+                INSERT INTO {PackageEmbedding.__tablename__} (package_url, field, embedding, content_hash)
+                SELECT p.url, e.field, e.embedding, NULL
+                FROM {Item.__tablename__} p
+                CROSS JOIN LATERAL (VALUES
+                    {field_values}
+                ) AS e(field, embedding)
+                WHERE e.embedding IS NOT NULL
+                ON CONFLICT (package_url, field) DO UPDATE SET embedding = EXCLUDED.embedding, content_hash = NULL
+                """
+            )
+        )
+        logger.info("Migrated %d field embeddings.", result.rowcount)
+        logger.info("Dropping the per-column embeddings and their HNSW indexes from %s...", Item.__tablename__)
+        drop_columns = ", ".join(f"DROP COLUMN embedding_{field}" for field in fields)
+        await conn.execute(text(f"ALTER TABLE {Item.__tablename__} {drop_columns}"))
+        await bump_catalog_generation(conn)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrate package embeddings into the normalized table")
+    parser.add_argument("--host", type=str, help="Postgres host")
+    parser.add_argument("--username", type=str, help="Postgres username")
+    parser.add_argument("--password", type=str, help="Postgres password")
+    parser.add_argument("--database", type=str, help="Postgres database")
+    parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
+
+    # if no args are specified, use environment variables
+    args = parser.parse_args()
+    if args.host is None:
+        engine = await create_postgres_engine_from_env()
+    else:
+        engine = await create_postgres_engine_from_args(args)
+
+    await migrate_package_embeddings(engine)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -4,6 +4,8 @@ import os
 import azure.identity.aio
 import openai
 
+from fastapi_app.local_embeddings import LocalEmbeddingsClient
+
 logger = logging.getLogger("ragapp")
 
 
@@ -51,6 +53,18 @@ async def create_openai_embed_client(azure_credential):
         )
         openai_embed_model = os.getenv("AZURE_OPENAI_EMBED_MODEL")
         openai_embed_dimensions = os.getenv("AZURE_OPENAI_EMBED_DIMENSIONS")
+    elif OPENAI_EMBED_HOST == "local":
+        logger.info("Using a local embedding model...")
+        openai_embed_model = os.getenv(
+            "LOCAL_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        )
+        openai_embed_dimensions = int(os.getenv("LOCAL_EMBED_DIMENSIONS", "1536"))
+        openai_embed_client = await LocalEmbeddingsClient.load(
+            openai_embed_model,
+            dimensions=openai_embed_dimensions,
+            batch_size=int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "32")),
+            max_workers=int(os.getenv("LOCAL_EMBED_WORKERS", "1")),
+        )
     else:
         openai_embed_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAICOM_KEY"))
         openai_embed_model = os.getenv("OPENAICOM_EMBED_MODEL")
@@ -0,0 +1,250 @@
+import logging
+
+from sqlalchemy import text
+
+from fastapi_app.postgres_models import (
+    EMBEDDING_FIELDS,
+    Item,
+    PackageEmbedding,
+    PackageNeighbor,
+    PackageNeighborState,
+    VectorQuantization,
+)
+from fastapi_app.postgres_searcher import HNSW_MAX_EF_SEARCH
+
+logger = logging.getLogger("ragapp")
+
+# How the per-field similarities between two packages combine into their score:
+# "max" ranks by the single most similar field,
+# "mean" averages the similarity of every field of the package, counting unmatched fields as 0,
+# so it favors packages that are similar on many fields
+NEIGHBOR_AGGREGATIONS = {
+    "max": "MAX(1 - field_matches.distance)",
+    "mean": "SUM(1 - field_matches.distance) / field_counts.fields",
+}
+
+# Version of the field embeddings of a package, aggregated over the rows of package_embeddings aliased as embeddings.
+# Migrated embeddings have no content hash until update_embeddings.py computes it, so fall back to the vector.
+SOURCE_HASH_EXPRESSION = """
+    md5(string_agg(
+        embeddings.field || ':' || COALESCE(embeddings.content_hash, md5(embeddings.embedding::text)),
+        ',' ORDER BY embeddings.field
+    ))
+"""
+
+
+def build_same_field_matches_query(quantization: VectorQuantization | None) -> str:
+    """
+    Select the :candidates nearest fields of other packages that are the same field as source.field.
+    The HNSW index covers every field, so it is scanned for :scan_candidates (package, field) pairs,
+    through the same quantized first pass as PostgresSearcher.build_closest_fields_query,
+    and the pairs of other fields are discarded.
+    """
+    if quantization is None:
+        return f"""
+                SELECT
+                    package_url,
+                    distance
+                FROM (
+                    SELECT package_url, field, embedding <=> source.embedding AS distance
+                    FROM {PackageEmbedding.__tablename__}
+                    ORDER BY embedding <=> source.embedding
+                    LIMIT :scan_candidates
+                ) scanned
+                WHERE
+                    field = source.field AND package_url <> source.package_url
+                ORDER BY
+                    distance
+                LIMIT :candidates
+            """
+    query_expression = quantization.query_expression.replace(":embedding", "source.embedding")
+    return f"""
+                SELECT
+                    package_url,
+                    embedding <=> source.embedding AS distance
+                FROM (
+                    SELECT package_url, field, embedding
+                    FROM {PackageEmbedding.__tablename__}
+                    ORDER BY {quantization.expression} {quantization.distance_operator} {query_expression}
+                    LIMIT :scan_candidates
+                ) scanned
+                WHERE
+                    field = source.field AND package_url <> source.package_url
+                ORDER BY
+                    distance
+                LIMIT :candidates
+            """
+
+
+async def compute_package_neighbors(
+    session,
+    urls: list[str],
+    top: int = 10,
+    candidates: int = 50,
+    scan_candidates: int = HNSW_MAX_EF_SEARCH,
+    aggregation: str = "mean",
+    fields: list[str] = EMBEDDING_FIELDS,
+    quantization: VectorQuantization | None = None,
+):
+    """
+    Replace the neighbors of the given packages. Each embedded field of a package is compared with the same field
+    of the other packages through the HNSW index, and the similarities are aggregated per candidate package.
+    The state of each package records the embeddings its neighbors were computed from.
+    """
+    if aggregation not in NEIGHBOR_AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {aggregation!r}, expected one of: {', '.join(NEIGHBOR_AGGREGATIONS)}")
+    scan_candidates = min(max(scan_candidates, candidates), HNSW_MAX_EF_SEARCH)
+    # ef_search caps how many rows an HNSW scan can return, so it must cover the scanned pairs
+    await session.execute(text(f"SET LOCAL hnsw.ef_search = {max(int(scan_candidates), 40)}"))
+    await session.execute(
+        text(f"DELETE FROM {PackageNeighbor.__tablename__} WHERE package_url = ANY(:urls)"), {"urls": urls}
+    )
+    await session.execute(
+        text(
+            f"""
+            WITH source AS (
+                SELECT package_url, field, embedding
+                FROM {PackageEmbedding.__tablename__}
+                WHERE package_url = ANY(:urls) AND field = ANY(:fields)
+            ),
+            field_counts AS (
+                SELECT package_url, COUNT(*) AS fields FROM source GROUP BY package_url
+            ),
+            field_matches AS (
+                -- Each field of the source package, with the same field of a nearby package
+                SELECT
+                    source.package_url,
+                    candidate.package_url AS neighbor_url,
+                    candidate.distance
+                FROM
+                    source
+                    CROSS JOIN LATERAL ({build_same_field_matches_query(quantization)}) candidate
+            ),
+            scores AS (
+                SELECT
+                    field_matches.package_url,
+                    field_matches.neighbor_url,
+                    {NEIGHBOR_AGGREGATIONS[aggregation]} AS score
+                FROM
+                    field_matches
+                    JOIN field_counts USING (package_url)
+                GROUP BY
+                    field_matches.package_url, field_matches.neighbor_url, field_counts.fields
+            ),
+            ranked AS (
+                SELECT
+                    package_url,
+                    neighbor_url,
+                    score,
+                    ROW_NUMBER() OVER (PARTITION BY package_url ORDER BY score DESC, neighbor_url) AS rank
+                FROM
+                    scores
+            )
+            INSERT INTO {PackageNeighbor.__tablename__} (package_url, rank, neighbor_url, score)
+            SELECT package_url, rank, neighbor_url, score FROM ranked WHERE rank <= :top
+            """
+        ),
+        {
+            "urls": urls,
+            "fields": fields,
+            "candidates": candidates,
+            "scan_candidates": scan_candidates,
+            "top": top,
+        },
+    )
+    await session.execute(
+        text(
+            f"""
+            INSERT INTO {PackageNeighborState.__tablename__} (package_url, source_hash, neighbors, computed_at)
+            SELECT
+                packages.url,
+                (
+                    SELECT {SOURCE_HASH_EXPRESSION}
+                    FROM {PackageEmbedding.__tablename__} embeddings
+                    WHERE embeddings.package_url = packages.url AND embeddings.field = ANY(:fields)
+                ),
+                (SELECT COUNT(*) FROM {PackageNeighbor.__tablename__} WHERE package_url = packages.url),
+                now()
+            FROM
+                {Item.__tablename__} packages
+            WHERE
+                packages.url = ANY(:urls)
+            ON CONFLICT (package_url) DO UPDATE SET
+                source_hash = EXCLUDED.source_hash,
+                neighbors = EXCLUDED.neighbors,
+                computed_at = EXCLUDED.computed_at
+            """
+        ),
+        {"urls": urls, "fields": fields},
+    )
+
+
+async def find_stale_neighbor_urls(session, fields: list[str] = EMBEDDING_FIELDS) -> list[str]:
+    """
+    Find the packages whose neighbors may be out of date: those whose field embeddings changed since their
+    neighbors were computed (including new packages), those that list such a package as a neighbor,
+    and those that lost neighbors to deleted packages.
+    New and changed packages may also have become neighbors of unchanged packages, which only a full rebuild finds.
+    """
+    result = await session.execute(
+        text(
+            f"""
+            WITH current_hashes AS (
+                SELECT packages.url, {SOURCE_HASH_EXPRESSION} AS source_hash
+                FROM
+                    {Item.__tablename__} packages
+                    LEFT JOIN {PackageEmbedding.__tablename__} embeddings
+                        ON embeddings.package_url = packages.url AND embeddings.field = ANY(:fields)
+                GROUP BY
+                    packages.url
+            ),
+            changed AS (
+                SELECT current_hashes.url
+                FROM
+                    current_hashes
+                    LEFT JOIN {PackageNeighborState.__tablename__} states ON states.package_url = current_hashes.url
+                WHERE
+                    states.package_url IS NULL OR states.source_hash IS DISTINCT FROM current_hashes.source_hash
+            )
+            SELECT url FROM changed
+            UNION
+            SELECT neighbors.package_url
+            FROM {PackageNeighbor.__tablename__} neighbors JOIN changed ON neighbors.neighbor_url = changed.url
+            UNION
+            SELECT states.package_url
+            FROM {PackageNeighborState.__tablename__} states
+            WHERE states.neighbors > (
+                SELECT COUNT(*) FROM {PackageNeighbor.__tablename__} neighbors
+                WHERE neighbors.package_url = states.package_url
+            )
+            """
+        ),
+        {"fields": fields},
+    )
+    return sorted(url for (url,) in result)
+
+
+async def refresh_package_neighbors(
+    session_maker,
+    stale_only: bool = False,
+    batch_size: int = 100,
+    fields: list[str] = EMBEDDING_FIELDS,
+    **kwargs,
+) -> int:
+    """
+    Recompute the neighbors of all packages, or only of those found by find_stale_neighbor_urls,
+    committing after each page of packages. Returns the number of packages processed.
+    """
+    async with session_maker() as session:
+        if stale_only:
+            pending = await find_stale_neighbor_urls(session, fields)
+        else:
+            result = await session.execute(text(f"SELECT url FROM {Item.__tablename__} ORDER BY url"))
+            pending = [url for (url,) in result]
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start : start + batch_size]
+        async with session_maker() as session, session.begin():
+            await compute_package_neighbors(session, batch, fields=fields, **kwargs)
+        logger.info("Computed the neighbors of %d out of %d packages", start + len(batch), len(pending))
+    return len(pending)
@@ -1,41 +1,122 @@
+import asyncio
+import inspect
 import logging
 import os
+import time
+import uuid
 
-from azure.identity.aio import DefaultAzureCredential
+from azure.identity import DefaultAzureCredential
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
 logger = logging.getLogger("ragapp")
 
 
-async def create_postgres_engine(*, host, username, database, password, sslmode, azure_credential) -> AsyncEngine:
+AZURE_POSTGRES_SCOPE = "https://ossrdbms-aad.database.windows.net/.default"
+
+
+class AzurePostgresTokenProvider:
+    """
+    Caches the Entra ID token used as the Postgres password and refreshes it ahead of expiry.
+    Works with both the sync and the async azure.identity credentials.
+    """
+
+    def __init__(self, azure_credential, refresh_margin: float = 300):
+        self.azure_credential = azure_credential
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.lock = asyncio.Lock()
+
+    def needs_refresh(self) -> bool:
+        return self.token is None or self.token.expires_on - time.time() < self.refresh_margin
+
+    async def get_password(self) -> str:
+        if self.needs_refresh():
+            async with self.lock:
+                if self.needs_refresh():
+                    logger.info("Fetching a new Azure Identity token for PostgreSQL...")
+                    if inspect.iscoroutinefunction(self.azure_credential.get_token):
+                        self.token = await self.azure_credential.get_token(AZURE_POSTGRES_SCOPE)
+                    else:
+                        self.token = await asyncio.to_thread(self.azure_credential.get_token, AZURE_POSTGRES_SCOPE)
+        return self.token.token
+
+
+async def create_postgres_engine(
+    *,
+    host,
+    username,
+    database,
+    password,
+    sslmode,
+    azure_credential,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: float = 30,
+    pool_recycle: int = -1,
+    pool_pre_ping: bool = False,
+    prepared_statement_cache_size: int = 100,
+    unique_prepared_statement_names: bool = False,
+) -> AsyncEngine:
+    token_provider = None
     if host.endswith(".database.azure.com"):
         logger.info("Authenticating to Azure Database for PostgreSQL using Azure Identity...")
         if azure_credential is None:
             raise ValueError("Azure credential must be provided for Azure Database for PostgreSQL")
-        token = await azure_credential.get_token("https://ossrdbms-aad.database.windows.net/.default")
-        password = token.token
+        token_provider = AzurePostgresTokenProvider(azure_credential)
+        # Fail fast on bad credentials; new connections get their token from the provider below
+        await token_provider.get_password()
+        password = None
     else:
         logger.info("Authenticating to PostgreSQL using password...")
 
-    DATABASE_URI = f"postgresql+asyncpg://{username}:{password}@{host}:5432/{database}"
+    if unique_prepared_statement_names:
+        # asyncpg still prepares every statement on the server, but behind a transaction-mode pooler (e.g. PgBouncer
+        # with pool_mode=transaction) the next transaction may run on another server connection, so nothing is cached
+        # and each statement gets a unique name that cannot clash with one prepared by another client
+        prepared_statement_cache_size = 0
+
+    credentials = f"{username}:{password}" if password else username
+    DATABASE_URI = (
+        f"postgresql+asyncpg://{credentials}@{host}:5432/{database}"
+        # Prepared statements kept per connection, so repeated queries skip parsing and planning
+        f"?prepared_statement_cache_size={prepared_statement_cache_size}"
+    )
     # Specify SSL mode if needed
     if sslmode:
-        DATABASE_URI += f"?ssl={sslmode}"
+        DATABASE_URI += f"&ssl={sslmode}"
 
+    connect_args = {}
+    if unique_prepared_statement_names:
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
 
     engine = create_async_engine(
         DATABASE_URI,
         echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+        connect_args=connect_args,
     )
 
+    if token_provider is not None:
+
+        @event.listens_for(engine.sync_engine, "do_connect")
+        def provide_token(dialect, conn_rec, cargs, cparams):
+            # asyncpg awaits a callable password on every new connection, so pooled
+            # connections opened after the first token expires still authenticate
+            cparams["password"] = token_provider.get_password
+
     return engine
 
 
 async def create_postgres_engine_from_env(azure_credential=None) -> AsyncEngine:
-    must_close = False
     if azure_credential is None and os.environ["POSTGRES_HOST"].endswith(".database.azure.com"):
+        # A sync credential needs no closing, so it can keep refreshing tokens for the engine's lifetime
         azure_credential = DefaultAzureCredential()
-        must_close = True
 
     engine = await create_postgres_engine(
         host=os.environ["POSTGRES_HOST"],
@@ -44,19 +125,33 @@ async def create_postgres_engine_from_env(azure_credential=None) -> AsyncEngine:
         password=os.environ.get("POSTGRES_PASSWORD"),
         sslmode=os.environ.get("POSTGRES_SSL"),
         azure_credential=azure_credential,
+        pool_size=int(os.getenv("POSTGRES_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("POSTGRES_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("POSTGRES_POOL_RECYCLE", "-1")),
+        pool_pre_ping=os.getenv("POSTGRES_POOL_PRE_PING", "false").lower() == "true",
+        prepared_statement_cache_size=int(os.getenv("POSTGRES_PREPARED_STATEMENT_CACHE_SIZE", "100")),
+        unique_prepared_statement_names=os.getenv("POSTGRES_UNIQUE_PREPARED_STATEMENT_NAMES", "false").lower()
+        == "true",
     )
 
-    if must_close:
-        await azure_credential.close()
-
     return engine
 
 
+def get_pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "status": pool.status(),
+    }
+
+
 async def create_postgres_engine_from_args(args, azure_credential=None) -> AsyncEngine:
-    must_close = False
     if azure_credential is None and args.host.endswith(".database.azure.com"):
         azure_credential = DefaultAzureCredential()
-        must_close = True
 
     engine = await create_postgres_engine(
         host=args.host,
@@ -67,7 +162,4 @@ async def create_postgres_engine_from_args(args, azure_credential=None) -> Async
         azure_credential=azure_credential,
     )
 
-    if must_close:
-        await azure_credential.close()
-
     return engine
@@ -1,11 +1,123 @@
 from __future__ import annotations
 
-from dataclasses import asdict
+from datetime import datetime
+from typing import NamedTuple
 
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import Index
+from sqlalchemy import BigInteger, Computed, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, MappedAsDataclass, mapped_column
 
+# Text columns that get their own embedding, via the matching Item.to_str_for_embedding_<field> method
+EMBEDDING_FIELDS = [
+    "package_name", "package_picture", "url", "installment_month", "installment_limit",
+    "shop_name", "category", "category_tags",
+    "preview_1_10", "selling_point", "meta_keywords", "brand", "min_max_age",
+    "locations", "meta_description", "price_details", "package_details",
+    "important_info", "payment_booking_info", "general_info", "early_signs_for_diagnosis",
+    "how_to_diagnose", "hdcare_summary", "common_question", "know_this_disease",
+    "courses_of_action", "signals_to_proceed_surgery", "get_to_know_this_surgery",
+    "comparisons", "getting_ready", "recovery", "side_effects", "review_4_5_stars",
+    "brand_option_in_thai_name", "faq",
+]
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+class VectorQuantization(NamedTuple):
+    """A quantized form of the field embeddings, indexed for the first pass of vector search."""
+
+    index_name: str
+    # Indexed expression over package_embeddings.embedding, and the same expression for the query vector
+    expression: str
+    query_expression: str
+    operator_class: str
+    distance_operator: str
+
+
+# Quantizations selectable with POSTGRES_VECTOR_QUANTIZATION; the full-precision vectors are kept for rescoring
+VECTOR_QUANTIZATIONS = {
+    "halfvec": VectorQuantization(
+        index_name="hnsw_halfvec_index_for_package_embeddings",
+        expression=f"(embedding::halfvec({EMBEDDING_DIMENSIONS}))",
+        query_expression=f"CAST(:embedding AS halfvec({EMBEDDING_DIMENSIONS}))",
+        operator_class="halfvec_cosine_ops",
+        distance_operator="<=>",
+    ),
+    "binary": VectorQuantization(
+        index_name="hnsw_binary_index_for_package_embeddings",
+        expression=f"(binary_quantize(embedding)::bit({EMBEDDING_DIMENSIONS}))",
+        query_expression=f"binary_quantize(CAST(:embedding AS vector))::bit({EMBEDDING_DIMENSIONS})",
+        operator_class="bit_hamming_ops",
+        distance_operator="<~>",
+    ),
+}
+
+
+def get_vector_quantization(name: str | None) -> VectorQuantization | None:
+    """Look up a quantization by name, where an empty name or "none" means full-precision search."""
+    if not name or name == "none":
+        return None
+    if name not in VECTOR_QUANTIZATIONS:
+        raise ValueError(
+            f"Unknown vector quantization {name!r}, expected one of: none, {', '.join(VECTOR_QUANTIZATIONS)}"
+        )
+    return VECTOR_QUANTIZATIONS[name]
+
+
+# Text columns folded into the persisted full-text search vector, with their ts_rank_cd weight
+SEARCH_TSV_WEIGHTS = {
+    "package_name": "A",
+    "shop_name": "A",
+    "brand": "A",
+    "category": "A",
+    "category_tags": "A",
+    "brand_option_in_thai_name": "A",
+    "meta_keywords": "B",
+    "selling_point": "B",
+    "meta_description": "B",
+    "locations": "B",
+    "hdcare_summary": "B",
+    "package_picture": "D",
+    "url": "D",
+    "installment_month": "D",
+    "installment_limit": "D",
+    "preview_1_10": "C",
+    "min_max_age": "C",
+    "price_details": "C",
+    "package_details": "C",
+    "important_info": "C",
+    "payment_booking_info": "D",
+    "general_info": "C",
+    "early_signs_for_diagnosis": "C",
+    "how_to_diagnose": "C",
+    "common_question": "C",
+    "know_this_disease": "C",
+    "courses_of_action": "C",
+    "signals_to_proceed_surgery": "C",
+    "get_to_know_this_surgery": "C",
+    "comparisons": "C",
+    "getting_ready": "C",
+    "recovery": "C",
+    "side_effects": "C",
+    "review_4_5_stars": "D",
+    "faq": "C",
+}
+
+
+# Text search configuration of search_tsv and of the full-text queries. setup_postgres_database.py creates it
+# as a copy of POSTGRES_TEXT_SEARCH_CONFIG, or of "simple" when the server lacks that configuration,
+# so the generated column never depends on a configuration that stock Postgres does not ship.
+TEXT_SEARCH_CONFIG = "ragapp_search"
+
+
+def build_search_tsv_expression() -> str:
+    """SQL expression for the generated search_tsv column (must stay immutable, so the config is a literal)."""
+    return " || ".join(
+        f"setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', COALESCE({column}, '')), '{weight}')"
+        for column, weight in SEARCH_TSV_WEIGHTS.items()
+    )
+
 
 # Define the models
 class Base(DeclarativeBase, MappedAsDataclass):
@@ -53,126 +165,15 @@ class Item(Base):
     brand_option_in_thai_name: Mapped[str] = mapped_column()
     brand_ranking_position: Mapped[int] = mapped_column()
     faq: Mapped[str] = mapped_column()
-    embedding_package_name: Mapped[Vector] = mapped_column(Vector(1536))  # ada-002
-    embedding_package_picture: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_url: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_installment_month: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_installment_limit: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_shop_name: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_category: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_category_tags: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_preview_1_10: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_selling_point: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_meta_keywords: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_brand: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_min_max_age: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_locations: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_meta_description: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_price_details: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_package_details: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_important_info: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_payment_booking_info: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_general_info: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_early_signs_for_diagnosis: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_how_to_diagnose: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_hdcare_summary: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_common_question: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_know_this_disease: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_courses_of_action: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_signals_to_proceed_surgery: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_get_to_know_this_surgery: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_comparisons: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_getting_ready: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_recovery: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_side_effects: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_review_4_5_stars: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_brand_option_in_thai_name: Mapped[Vector] = mapped_column(Vector(1536))
-    embedding_faq: Mapped[Vector] = mapped_column(Vector(1536))
-
-    def to_dict(self, include_embedding: bool = False):
-        model_dict = asdict(self)
-        if include_embedding:
-            embedding_columns = [
-                "embedding_package_name",
-                "embedding_package_picture",
-                "embedding_url",
-                "embedding_installment_month",
-                "embedding_installment_limit",
-                "embedding_shop_name",
-                "embedding_category",
-                "embedding_category_tags",
-                "embedding_preview_1_10",
-                "embedding_selling_point",
-                "embedding_meta_keywords",
-                "embedding_brand",
-                "embedding_min_max_age",
-                "embedding_locations",
-                "embedding_meta_description",
-                "embedding_price_details",
-                "embedding_package_details",
-                "embedding_important_info",
-                "embedding_payment_booking_info",
-                "embedding_general_info",
-                "embedding_early_signs_for_diagnosis",
-                "embedding_how_to_diagnose",
-                "embedding_hdcare_summary",
-                "embedding_common_question",
-                "embedding_know_this_disease",
-                "embedding_courses_of_action",
-                "embedding_signals_to_proceed_surgery",
-                "embedding_get_to_know_this_surgery",
-                "embedding_comparisons",
-                "embedding_getting_ready",
-                "embedding_recovery",
-                "embedding_side_effects",
-                "embedding_review_4_5_stars",
-                "embedding_brand_option_in_thai_name",
-                "embedding_faq",
-            ]
-            for col in embedding_columns:
-                model_dict[col] = model_dict[col].tolist()
-        else:
-            # Remove embedding columns if not included
-            embedding_columns = [
-                "embedding_package_name",
-                "embedding_package_picture",
-                "embedding_url",
-                "embedding_installment_month",
-                "embedding_installment_limit",
-                "embedding_shop_name",
-                "embedding_category",
-                "embedding_category_tags",
-                "embedding_preview_1_10",
-                "embedding_selling_point",
-                "embedding_meta_keywords",
-                "embedding_brand",
-                "embedding_min_max_age",
-                "embedding_locations",
-                "embedding_meta_description",
-                "embedding_price_details",
-                "embedding_package_details",
-                "embedding_important_info",
-                "embedding_payment_booking_info",
-                "embedding_general_info",
-                "embedding_early_signs_for_diagnosis",
-                "embedding_how_to_diagnose",
-                "embedding_hdcare_summary",
-                "embedding_common_question",
-                "embedding_know_this_disease",
-                "embedding_courses_of_action",
-                "embedding_signals_to_proceed_surgery",
-                "embedding_get_to_know_this_surgery",
-                "embedding_comparisons",
-                "embedding_getting_ready",
-                "embedding_recovery",
-                "embedding_side_effects",
-                "embedding_review_4_5_stars",
-                "embedding_brand_option_in_thai_name",
-                "embedding_faq",
-            ]
-            for col in embedding_columns:
-                del model_dict[col]
-        return model_dict
+    search_tsv: Mapped[str] = mapped_column(
+        TSVECTOR, Computed(build_search_tsv_expression(), persisted=True), init=False, repr=False, deferred=True
+    )
+
+    def to_dict(self):
+        # Read columns one by one rather than with asdict(), so the deferred search_tsv column is not loaded
+        return {
+            column.key: getattr(self, column.key) for column in self.__table__.columns if column.key != "search_tsv"
+        }
 
     def to_str_for_broad_rag(self):
         return f"""
@@ -332,251 +333,106 @@ class Item(Base):
         return f"FAQ: {self.faq}" if self.faq else ""
 
 
-# Define HNSW indices to support vector similarity search for each embedding column
-indices = [
-    Index(
-        "hnsw_index_for_embedding_package_name",
-        Item.embedding_package_name,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_package_name": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_package_picture",
-        Item.embedding_package_picture,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_package_picture": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_url",
-        Item.embedding_url,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_url": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_installment_month",
-        Item.embedding_installment_month,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_installment_month": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_installment_limit",
-        Item.embedding_installment_limit,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_installment_limit": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_shop_name",
-        Item.embedding_shop_name,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_shop_name": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_category",
-        Item.embedding_category,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_category": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_category_tags",
-        Item.embedding_category_tags,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_category_tags": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_preview_1_10",
-        Item.embedding_preview_1_10,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_preview_1_10": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_selling_point",
-        Item.embedding_selling_point,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_selling_point": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_meta_keywords",
-        Item.embedding_meta_keywords,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_meta_keywords": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_brand",
-        Item.embedding_brand,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_brand": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_min_max_age",
-        Item.embedding_min_max_age,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_min_max_age": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_locations",
-        Item.embedding_locations,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_locations": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_meta_description",
-        Item.embedding_meta_description,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_meta_description": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_price_details",
-        Item.embedding_price_details,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_price_details": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_package_details",
-        Item.embedding_package_details,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_package_details": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_important_info",
-        Item.embedding_important_info,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_important_info": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_payment_booking_info",
-        Item.embedding_payment_booking_info,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_payment_booking_info": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_general_info",
-        Item.embedding_general_info,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_general_info": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_early_signs_for_diagnosis",
-        Item.embedding_early_signs_for_diagnosis,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_early_signs_for_diagnosis": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_how_to_diagnose",
-        Item.embedding_how_to_diagnose,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_how_to_diagnose": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_hdcare_summary",
-        Item.embedding_hdcare_summary,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_hdcare_summary": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_common_question",
-        Item.embedding_common_question,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_common_question": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_know_this_disease",
-        Item.embedding_know_this_disease,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_know_this_disease": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_courses_of_action",
-        Item.embedding_courses_of_action,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_courses_of_action": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_signals_to_proceed_surgery",
-        Item.embedding_signals_to_proceed_surgery,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_signals_to_proceed_surgery": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_get_to_know_this_surgery",
-        Item.embedding_get_to_know_this_surgery,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_get_to_know_this_surgery": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_comparisons",
-        Item.embedding_comparisons,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_comparisons": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_getting_ready",
-        Item.embedding_getting_ready,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_getting_ready": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_recovery",
-        Item.embedding_recovery,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_recovery": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_side_effects",
-        Item.embedding_side_effects,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_side_effects": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_review_4_5_stars",
-        Item.embedding_review_4_5_stars,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_review_4_5_stars": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_brand_option_in_thai_name",
-        Item.embedding_brand_option_in_thai_name,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_brand_option_in_thai_name": "vector_ip_ops"},
-    ),
-    Index(
-        "hnsw_index_for_embedding_faq",
-        Item.embedding_faq,
-        postgresql_using="hnsw",
-        postgresql_with={"m": 16, "ef_construction": 64},
-        postgresql_ops={"embedding_faq": "vector_ip_ops"},
-    ),
+class PackageEmbedding(Base):
+    """One row per (package, field) embedding, so a single HNSW index can serve vector search across all fields."""
+
+    __tablename__ = "package_embeddings"
+    package_url: Mapped[str] = mapped_column(
+        ForeignKey(f"{Item.__tablename__}.url", ondelete="CASCADE"), primary_key=True
+    )
+    field: Mapped[str] = mapped_column(primary_key=True)
+    embedding: Mapped[Vector] = mapped_column(Vector(EMBEDDING_DIMENSIONS))  # ada-002
+    # Hash of the embedded text and embedding model, used to skip re-embedding unchanged fields
+    content_hash: Mapped[str | None] = mapped_column(default=None)
+
+
+class PackageNeighbor(Base):
+    """The most similar packages of each package, precomputed from the field embeddings by package_neighbors.py."""
+
+    __tablename__ = "package_neighbors"
+    package_url: Mapped[str] = mapped_column(
+        ForeignKey(f"{Item.__tablename__}.url", ondelete="CASCADE"), primary_key=True
+    )
+    rank: Mapped[int] = mapped_column(primary_key=True)
+    neighbor_url: Mapped[str] = mapped_column(
+        ForeignKey(f"{Item.__tablename__}.url", ondelete="CASCADE"), index=True
+    )
+    score: Mapped[float] = mapped_column()
+
+
+class PackageNeighborState(Base):
+    """When the neighbors of a package were last computed, and from which version of its field embeddings."""
+
+    __tablename__ = "package_neighbor_states"
+    package_url: Mapped[str] = mapped_column(
+        ForeignKey(f"{Item.__tablename__}.url", ondelete="CASCADE"), primary_key=True
+    )
+    # Hash of the content hashes of the embeddings the neighbors were computed from
+    source_hash: Mapped[str | None] = mapped_column()
+    # Number of neighbors stored then; fewer rows now means some neighbors were deleted since
+    neighbors: Mapped[int] = mapped_column()
+    computed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+class EmbeddingCacheEntry(Base):
+    """Query embeddings shared between app workers, keyed by a hash of (model, dimensions, normalized text)."""
+
+    __tablename__ = "embedding_cache"
+    key: Mapped[str] = mapped_column(primary_key=True)
+    embedding: Mapped[Vector] = mapped_column(Vector())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+class CatalogVersion(Base):
+    """Single-row generation counter, bumped by the ingestion scripts whenever packages or embeddings change."""
+
+    __tablename__ = "catalog_version"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    generation: Mapped[int] = mapped_column(BigInteger)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+class ResponseCacheEntry(Base):
+    """Answers to single-turn chat questions, looked up by the similarity of the question embeddings."""
+
+    __tablename__ = "response_cache"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, init=False)
+    # Hash of the chat model and the overrides that shape the answer; only entries with the same key are reused
+    settings_key: Mapped[str] = mapped_column()
+    question: Mapped[str] = mapped_column()
+    embedding: Mapped[Vector] = mapped_column(Vector(EMBEDDING_DIMENSIONS))
+    answer: Mapped[str] = mapped_column()
+    data_points: Mapped[dict] = mapped_column(JSONB)
+    # Price of every package cited in the answer or its sources when it was cached, keyed by URL
+    cited_prices: Mapped[dict] = mapped_column(JSONB)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+# Lookups scan the fresh entries of one settings key exactly, so they never miss entries of that key the way an HNSW
+# scan filtered on the key would once other keys fill its candidates
+response_cache_settings_index = Index(
+    "btree_index_for_response_cache_settings", ResponseCacheEntry.settings_key, ResponseCacheEntry.created_at
+)
+
+# Lets catalog syncs find the cached answers that cite a changed package
+response_cache_cited_prices_index = Index(
+    "gin_index_for_response_cache_cited_prices", ResponseCacheEntry.cited_prices, postgresql_using="gin"
+)
+
+# Define an HNSW index on the normalized embeddings, using the same cosine distance as PostgresSearcher
+package_embeddings_index = Index(
+    "hnsw_index_for_package_embeddings",
+    PackageEmbedding.embedding,
+    postgresql_using="hnsw",
+    postgresql_with={"m": 16, "ef_construction": 64},
+    postgresql_ops={"embedding": "vector_cosine_ops"},
+)
+
+# Define B-tree indexes for the structured filters of PostgresSearcher (url is covered by the primary key)
+filter_indexes = [
+    Index(f"btree_index_for_{column.key}", column)
+    for column in (Item.price, Item.package_name, Item.category, Item.shop_name)
 ]
+
+# Define a GIN index to support full-text search over the generated tsvector column
+search_tsv_index = Index("gin_index_for_search_tsv", Item.search_tsv, postgresql_using="gin")
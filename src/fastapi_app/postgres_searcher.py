@@ -1,10 +1,22 @@
+import logging
+
 from openai import AsyncOpenAI
 from pgvector.utils import to_db
-from sqlalchemy import Float, Integer, select, text
+from sqlalchemy import ARRAY, Float, Integer, String, any_, bindparam, select, text
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from fastapi_app.embedding_cache import EmbeddingCache
 from fastapi_app.embeddings import compute_text_embedding
-from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_models import TEXT_SEARCH_CONFIG, Item, PackageEmbedding, VectorQuantization
+from fastapi_app.product_cards import ProductCardSnapshot
+from fastapi_app.query_filters import compile_filters
+from fastapi_app.retrieval_cache import RetrievalCache, SearchResults
+from fastapi_app.tracing import trace_stage
+
+logger = logging.getLogger("ragapp")
+
+# pgvector rejects larger hnsw.ef_search values, and an HNSW scan returns at most ef_search rows
+HNSW_MAX_EF_SEARCH = 1000
 
 
 class PostgresSearcher:
@@ -15,201 +27,173 @@ class PostgresSearcher:
         embed_deployment: str | None,  # Not needed for non-Azure OpenAI or for retrieval_mode="text"
         embed_model: str,
         embed_dimensions: int,
+        vector_candidates: int = 400,
+        filtered_vector_candidates: int = 1000,
+        embedding_cache: EmbeddingCache | None = None,
+        vector_quantization: VectorQuantization | None = None,
+        quantized_oversampling: int = 4,
+        exact_search_max_packages: int = 2000,
+        retrieval_cache: RetrievalCache | None = None,
+        product_card_snapshot: ProductCardSnapshot | None = None,
     ):
         self.async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
         self.openai_embed_client = openai_embed_client
         self.embed_model = embed_model
         self.embed_deployment = embed_deployment
         self.embed_dimensions = embed_dimensions
+        self.vector_candidates = vector_candidates
+        self.filtered_vector_candidates = filtered_vector_candidates
+        self.embedding_cache = embedding_cache
+        self.vector_quantization = vector_quantization
+        self.quantized_oversampling = quantized_oversampling
+        self.exact_search_max_packages = exact_search_max_packages
+        self.retrieval_cache = retrieval_cache
+        self.product_card_snapshot = product_card_snapshot
+        if vector_quantization is not None:
+            max_candidates = self.max_quantized_candidates()
+            if max(vector_candidates, filtered_vector_candidates) > max_candidates:
+                logger.info(
+                    "%d vector candidates oversampled %dx exceed hnsw.ef_search's maximum of %d, "
+                    "so quantized searches rescore at most %d candidates",
+                    max(vector_candidates, filtered_vector_candidates),
+                    quantized_oversampling,
+                    HNSW_MAX_EF_SEARCH,
+                    max_candidates,
+                )
 
-    def build_filter_clause(self, filters, use_or=False) -> tuple[str, str]:
-        if filters is None:
-            return "", ""
-        filter_clauses = []
-        for filter in filters:
-            if isinstance(filter["value"], str):
-                filter["value"] = f"'{filter['value']}'"
-            filter_clauses.append(f"{filter['column']} {filter['comparison_operator']} {filter['value']}")
-        filter_clause = f" {'OR' if use_or else 'AND'} ".join(filter_clauses)
+    def max_quantized_candidates(self) -> int:
+        """The most candidates whose oversampled first pass still fits in one HNSW scan."""
+        return max(HNSW_MAX_EF_SEARCH // max(self.quantized_oversampling, 1), 1)
+
+    def build_filter_clause(self, filters, use_or=False) -> tuple[str, str, dict]:
+        """Return the filters as WHERE and AND clauses, and their bind parameters."""
+        filter_clause, filter_params = compile_filters(filters, use_or=use_or)
         if len(filter_clause) > 0:
-            return f"WHERE {filter_clause}", f"AND {filter_clause}"
-        return "", ""
+            return f"WHERE ({filter_clause})", f"AND ({filter_clause})", filter_params
+        return "", "", {}
 
-    async def hybrid_search(
+    def build_closest_fields_query(self, exact: bool = False) -> str:
+        """
+        Select the :candidates nearest (package, field) pairs by full-precision cosine distance.
+        With a quantization, the HNSW scan runs on the smaller quantized index for :first_pass_candidates pairs,
+        which are then rescored against the full-precision vectors.
+        With exact, select every field of the :filtered_urls packages instead, without the index.
+        """
+        if exact:
+            return f"""
+                SELECT
+                    package_url,
+                    embedding <=> :embedding AS distance
+                FROM
+                    {PackageEmbedding.__tablename__}
+                WHERE
+                    package_url = ANY(:filtered_urls)
+            """
+        if self.vector_quantization is None:
+            return f"""
+                SELECT
+                    package_url,
+                    embedding <=> :embedding AS distance
+                FROM
+                    {PackageEmbedding.__tablename__}
+                ORDER BY
+                    embedding <=> :embedding
+                LIMIT :candidates
+            """
+        quantization = self.vector_quantization
+        return f"""
+                SELECT
+                    package_url,
+                    embedding <=> :embedding AS distance
+                FROM (
+                    SELECT package_url, embedding
+                    FROM {PackageEmbedding.__tablename__}
+                    ORDER BY {quantization.expression} {quantization.distance_operator} {quantization.query_expression}
+                    LIMIT :first_pass_candidates
+                ) first_pass
+                ORDER BY
+                    distance
+                LIMIT :candidates
+            """
+
+    async def fetch_items(self, session, urls: list[str]) -> list[Item]:
+        """
+        Load the items for the given URLs in a single query, keeping the order of the URLs.
+        The search_tsv column of Item is deferred, so it is not transferred.
+        """
+        if not urls:
+            return []
+        stmt = select(Item).where(Item.url == any_(bindparam("urls", urls, ARRAY(String))))
+        items = (await session.scalars(stmt)).all()
+        items_by_url = {item.url: item for item in items}
+        return [items_by_url[url] for url in urls if url in items_by_url]
+
+    async def find_filtered_urls(self, session, filter_clause_where: str, filter_params: dict) -> list[str] | None:
+        """
+        Return the URLs of the packages that pass the filters, or None when more than exact_search_max_packages do.
+        A selective filter can reject every candidate of an HNSW scan, so its few packages are searched exactly.
+        """
+        result = await session.execute(
+            text(f"SELECT url FROM {Item.__tablename__} {filter_clause_where} LIMIT :limit"),
+            filter_params | {"limit": self.exact_search_max_packages + 1},
+        )
+        urls = [url for (url,) in result]
+        return urls if len(urls) <= self.exact_search_max_packages else None
+
+    async def hybrid_search_results(
         self,
         query_text: str | None,
         query_vector: list[float] | list,
         top: int = 5,
         filters: list[dict] | None = None,
-    ):
-        filter_clause_where, filter_clause_and = self.build_filter_clause(filters)
+    ) -> SearchResults:
+        """Run the hybrid (or vector-only / text-only) search and return the top (url, score) pairs."""
+        filter_clause_where, filter_clause_and, filter_params = self.build_filter_clause(filters)
+
+        filtered_urls = None
+        if filter_clause_where and len(query_vector) > 0:
+            async with self.async_session_maker() as session:
+                filtered_urls = await self.find_filtered_urls(session, filter_clause_where, filter_params)
 
+        # Approximate nearest (package, field) pairs from the HNSW index, then keep each package's closest field.
+        # Broad filters are applied after the ANN step, so widen the candidate pool when they are present;
+        # selective ones get an exact search over their packages instead.
+        candidates = self.filtered_vector_candidates if filter_clause_where else self.vector_candidates
+        first_pass_candidates = candidates
+        if self.vector_quantization is not None:
+            # Keep fewer candidates rather than skip the oversampling the rescoring relies on
+            candidates = min(candidates, self.max_quantized_candidates())
+            first_pass_candidates = min(candidates * max(self.quantized_oversampling, 1), HNSW_MAX_EF_SEARCH)
         vector_query = f"""
-            WITH closest_embedding AS (
-                SELECT 
-                    id,
-                    LEAST(
-                        COALESCE(embedding_package_name <=> :embedding, 1), 
-                        COALESCE(embedding_package_picture <=> :embedding, 1), 
-                        COALESCE(embedding_url <=> :embedding, 1),
-                        COALESCE(embedding_installment_month <=> :embedding, 1),
-                        COALESCE(embedding_installment_limit <=> :embedding, 1),
-                        COALESCE(embedding_shop_name <=> :embedding, 1),
-                        COALESCE(embedding_category <=> :embedding, 1),
-                        COALESCE(embedding_category_tags <=> :embedding, 1),
-                        COALESCE(embedding_preview_1_10 <=> :embedding, 1),
-                        COALESCE(embedding_selling_point <=> :embedding, 1),
-                        COALESCE(embedding_meta_keywords <=> :embedding, 1),
-                        COALESCE(embedding_brand <=> :embedding, 1),
-                        COALESCE(embedding_min_max_age <=> :embedding, 1),
-                        COALESCE(embedding_locations <=> :embedding, 1),
-                        COALESCE(embedding_meta_description <=> :embedding, 1),
-                        COALESCE(embedding_price_details <=> :embedding, 1),
-                        COALESCE(embedding_package_details <=> :embedding, 1),
-                        COALESCE(embedding_important_info <=> :embedding, 1),
-                        COALESCE(embedding_payment_booking_info <=> :embedding, 1),
-                        COALESCE(embedding_general_info <=> :embedding, 1),
-                        COALESCE(embedding_early_signs_for_diagnosis <=> :embedding, 1),
-                        COALESCE(embedding_how_to_diagnose <=> :embedding, 1),
-                        COALESCE(embedding_hdcare_summary <=> :embedding, 1),
-                        COALESCE(embedding_common_question <=> :embedding, 1),
-                        COALESCE(embedding_know_this_disease <=> :embedding, 1),
-                        COALESCE(embedding_courses_of_action <=> :embedding, 1),
-                        COALESCE(embedding_signals_to_proceed_surgery <=> :embedding, 1),
-                        COALESCE(embedding_get_to_know_this_surgery <=> :embedding, 1),
-                        COALESCE(embedding_comparisons <=> :embedding, 1),
-                        COALESCE(embedding_getting_ready <=> :embedding, 1),
-                        COALESCE(embedding_recovery <=> :embedding, 1),
-                        COALESCE(embedding_side_effects <=> :embedding, 1),
-                        COALESCE(embedding_review_4_5_stars <=> :embedding, 1),
-                        COALESCE(embedding_brand_option_in_thai_name <=> :embedding, 1),
-                        COALESCE(embedding_faq <=> :embedding, 1)
-                    ) AS min_distance
-                FROM 
-                    packages
-                {filter_clause_where}
+            WITH closest_fields AS (
+                {self.build_closest_fields_query(exact=filtered_urls is not None)}
+            ),
+            closest_embedding AS (
+                SELECT
+                    package_url AS url,
+                    MIN(distance) AS min_distance
+                FROM
+                    closest_fields
+                GROUP BY
+                    package_url
             )
             SELECT 
-                id, 
+                url, 
                 RANK() OVER (ORDER BY min_distance) AS rank
             FROM 
                 closest_embedding
+                JOIN packages_all USING (url)
+            {filter_clause_where}
             ORDER BY 
                 min_distance
             LIMIT 20
             """
 
         fulltext_query = f"""
-            SELECT id, RANK () OVER (ORDER BY ts_rank_cd(
-                to_tsvector('thai', COALESCE(package_name, '')) ||
-                to_tsvector('thai', COALESCE(package_picture, '')) ||
-                to_tsvector('thai', COALESCE(url, '')) ||
-                to_tsvector('thai', COALESCE(installment_month, '')) ||
-                to_tsvector('thai', COALESCE(installment_limit, '')) ||
-                to_tsvector('thai', COALESCE(shop_name, '')) ||
-                to_tsvector('thai', COALESCE(category, '')) ||
-                to_tsvector('thai', COALESCE(category_tags, '')) ||
-                to_tsvector('thai', COALESCE(preview_1_10, '')) ||
-                to_tsvector('thai', COALESCE(selling_point, '')) ||
-                to_tsvector('thai', COALESCE(meta_keywords, '')) ||
-                to_tsvector('thai', COALESCE(brand, '')) ||
-                to_tsvector('thai', COALESCE(min_max_age, '')) ||
-                to_tsvector('thai', COALESCE(locations, '')) ||
-                to_tsvector('thai', COALESCE(meta_description, '')) ||
-                to_tsvector('thai', COALESCE(price_details, '')) ||
-                to_tsvector('thai', COALESCE(package_details, '')) ||
-                to_tsvector('thai', COALESCE(important_info, '')) ||
-                to_tsvector('thai', COALESCE(payment_booking_info, '')) ||
-                to_tsvector('thai', COALESCE(general_info, '')) ||
-                to_tsvector('thai', COALESCE(early_signs_for_diagnosis, '')) ||
-                to_tsvector('thai', COALESCE(how_to_diagnose, '')) ||
-                to_tsvector('thai', COALESCE(hdcare_summary, '')) ||
-                to_tsvector('thai', COALESCE(common_question, '')) ||
-                to_tsvector('thai', COALESCE(know_this_disease, '')) ||
-                to_tsvector('thai', COALESCE(courses_of_action, '')) ||
-                to_tsvector('thai', COALESCE(signals_to_proceed_surgery, '')) ||
-                to_tsvector('thai', COALESCE(get_to_know_this_surgery, '')) ||
-                to_tsvector('thai', COALESCE(comparisons, '')) ||
-                to_tsvector('thai', COALESCE(getting_ready, '')) ||
-                to_tsvector('thai', COALESCE(recovery, '')) ||
-                to_tsvector('thai', COALESCE(side_effects, '')) ||
-                to_tsvector('thai', COALESCE(review_4_5_stars, '')) ||
-                to_tsvector('thai', COALESCE(brand_option_in_thai_name, '')) ||
-                to_tsvector('thai', COALESCE(faq, '')), query) DESC)
-            FROM packages, plainto_tsquery('thai', :query) query
-            WHERE (
-                to_tsvector('thai', COALESCE(package_name, '')) ||
-                to_tsvector('thai', COALESCE(package_picture, '')) ||
-                to_tsvector('thai', COALESCE(url, '')) ||
-                to_tsvector('thai', COALESCE(installment_month, '')) ||
-                to_tsvector('thai', COALESCE(installment_limit, '')) ||
-                to_tsvector('thai', COALESCE(shop_name, '')) ||
-                to_tsvector('thai', COALESCE(category, '')) ||
-                to_tsvector('thai', COALESCE(category_tags, '')) ||
-                to_tsvector('thai', COALESCE(preview_1_10, '')) ||
-                to_tsvector('thai', COALESCE(selling_point, '')) ||
-                to_tsvector('thai', COALESCE(meta_keywords, '')) ||
-                to_tsvector('thai', COALESCE(brand, '')) ||
-                to_tsvector('thai', COALESCE(min_max_age, '')) ||
-                to_tsvector('thai', COALESCE(locations, '')) ||
-                to_tsvector('thai', COALESCE(meta_description, '')) ||
-                to_tsvector('thai', COALESCE(price_details, '')) ||
-                to_tsvector('thai', COALESCE(package_details, '')) ||
-                to_tsvector('thai', COALESCE(important_info, '')) ||
-                to_tsvector('thai', COALESCE(payment_booking_info, '')) ||
-                to_tsvector('thai', COALESCE(general_info, '')) ||
-                to_tsvector('thai', COALESCE(early_signs_for_diagnosis, '')) ||
-                to_tsvector('thai', COALESCE(how_to_diagnose, '')) ||
-                to_tsvector('thai', COALESCE(hdcare_summary, '')) ||
-                to_tsvector('thai', COALESCE(common_question, '')) ||
-                to_tsvector('thai', COALESCE(know_this_disease, '')) ||
-                to_tsvector('thai', COALESCE(courses_of_action, '')) ||
-                to_tsvector('thai', COALESCE(signals_to_proceed_surgery, '')) ||
-                to_tsvector('thai', COALESCE(get_to_know_this_surgery, '')) ||
-                to_tsvector('thai', COALESCE(comparisons, '')) ||
-                to_tsvector('thai', COALESCE(getting_ready, '')) ||
-                to_tsvector('thai', COALESCE(recovery, '')) ||
-                to_tsvector('thai', COALESCE(side_effects, '')) ||
-                to_tsvector('thai', COALESCE(review_4_5_stars, '')) ||
-                to_tsvector('thai', COALESCE(brand_option_in_thai_name, '')) ||
-                to_tsvector('thai', COALESCE(faq, ''))
-            ) @@ query {filter_clause_and}
-            ORDER BY ts_rank_cd(
-                to_tsvector('thai', COALESCE(package_name, '')) ||
-                to_tsvector('thai', COALESCE(package_picture, '')) ||
-                to_tsvector('thai', COALESCE(url, '')) ||
-                to_tsvector('thai', COALESCE(installment_month, '')) ||
-                to_tsvector('thai', COALESCE(installment_limit, '')) ||
-                to_tsvector('thai', COALESCE(shop_name, '')) ||
-                to_tsvector('thai', COALESCE(category, '')) ||
-                to_tsvector('thai', COALESCE(category_tags, '')) ||
-                to_tsvector('thai', COALESCE(preview_1_10, '')) ||
-                to_tsvector('thai', COALESCE(selling_point, '')) ||
-                to_tsvector('thai', COALESCE(meta_keywords, '')) ||
-                to_tsvector('thai', COALESCE(brand, '')) ||
-                to_tsvector('thai', COALESCE(min_max_age, '')) ||
-                to_tsvector('thai', COALESCE(locations, '')) ||
-                to_tsvector('thai', COALESCE(meta_description, '')) ||
-                to_tsvector('thai', COALESCE(price_details, '')) ||
-                to_tsvector('thai', COALESCE(package_details, '')) ||
-                to_tsvector('thai', COALESCE(important_info, '')) ||
-                to_tsvector('thai', COALESCE(payment_booking_info, '')) ||
-                to_tsvector('thai', COALESCE(general_info, '')) ||
-                to_tsvector('thai', COALESCE(early_signs_for_diagnosis, '')) ||
-                to_tsvector('thai', COALESCE(how_to_diagnose, '')) ||
-                to_tsvector('thai', COALESCE(hdcare_summary, '')) ||
-                to_tsvector('thai', COALESCE(common_question, '')) ||
-                to_tsvector('thai', COALESCE(know_this_disease, '')) ||
-                to_tsvector('thai', COALESCE(courses_of_action, '')) ||
-                to_tsvector('thai', COALESCE(signals_to_proceed_surgery, '')) ||
-                to_tsvector('thai', COALESCE(get_to_know_this_surgery, '')) ||
-                to_tsvector('thai', COALESCE(comparisons, '')) ||
-                to_tsvector('thai', COALESCE(getting_ready, '')) ||
-                to_tsvector('thai', COALESCE(recovery, '')) ||
-                to_tsvector('thai', COALESCE(side_effects, '')) ||
-                to_tsvector('thai', COALESCE(review_4_5_stars, '')) ||
-                to_tsvector('thai', COALESCE(brand_option_in_thai_name, '')) ||
-                to_tsvector('thai', COALESCE(faq, '')), query) DESC
+            SELECT url, RANK () OVER (ORDER BY ts_rank_cd(search_tsv, query) DESC)
+            FROM packages_all, plainto_tsquery('{TEXT_SEARCH_CONFIG}', :query) query
+            WHERE search_tsv @@ query {filter_clause_and}
+            ORDER BY ts_rank_cd(search_tsv, query) DESC
             LIMIT 20
         """
 
@@ -221,63 +205,114 @@ class PostgresSearcher:
             {fulltext_query}
         )
         SELECT
-            COALESCE(vector_search.id, fulltext_search.id) AS id,
+            COALESCE(vector_search.url, fulltext_search.url) AS url,
             COALESCE(1.0 / (:k + vector_search.rank), 0.0) +
             COALESCE(1.0 / (:k + fulltext_search.rank), 0.0) AS score
         FROM vector_search
-        FULL OUTER JOIN fulltext_search ON vector_search.id = fulltext_search.id
+        FULL OUTER JOIN fulltext_search ON vector_search.url = fulltext_search.url
         ORDER BY score DESC
         LIMIT 20
         """
 
         if query_text is not None and len(query_vector) > 0:
-            sql = text(hybrid_query).columns(id=Integer, score=Float)
+            sql = text(hybrid_query).columns(url=String, score=Float)
         elif len(query_vector) > 0:
-            sql = text(vector_query).columns(id=Integer, rank=Integer)
+            sql = text(vector_query).columns(url=String, rank=Integer)
         elif query_text is not None:
-            sql = text(fulltext_query).columns(id=Integer, rank=Integer)
+            sql = text(fulltext_query).columns(url=String, rank=Integer)
         else:
             raise ValueError("Both query text and query vector are empty")
 
         async with self.async_session_maker() as session:
+            if len(query_vector) > 0 and filtered_urls is None:
+                # ef_search caps how many rows an HNSW scan can return, so it must cover the candidate pool
+                await session.execute(text(f"SET LOCAL hnsw.ef_search = {int(first_pass_candidates)}"))
             results = (
                 await session.execute(
                     sql,
-                    {"embedding": to_db(query_vector), "query": query_text, "k": 60},
+                    {
+                        "embedding": to_db(query_vector),
+                        "query": query_text,
+                        "k": 60,
+                        "candidates": candidates,
+                        "first_pass_candidates": first_pass_candidates,
+                        "filtered_urls": filtered_urls,
+                    }
+                    | filter_params,
                 )
             ).fetchall()
 
-            # Convert results to Item models
-            items = []
-            for id, _ in results[:top]:
-                item = await session.execute(select(Item).where(Item.id == id))
-                items.append(item.scalar())
-            return items
+        return [(url, float(score)) for url, score in results[:top]]
 
-    async def search_and_embed(
+    async def hybrid_search(
         self,
-        query_text: str,
+        query_text: str | None,
+        query_vector: list[float] | list,
         top: int = 5,
-        enable_vector_search: bool = False,
-        enable_text_search: bool = False,
         filters: list[dict] | None = None,
     ) -> list[Item]:
+        results = await self.hybrid_search_results(query_text, query_vector, top, filters)
+        async with self.async_session_maker() as session:
+            return await self.fetch_items(session, [url for url, _ in results])
+
+    async def compute_query_embedding(self, query_text: str) -> list[float]:
         """
-        Search items by query text. Optionally converts the query text to a vector if enable_vector_search is True.
+        Embed the query text, going through the embedding cache when one is configured.
         """
-        vector: list[float] = []
-        if enable_vector_search:
-            vector = await compute_text_embedding(
+        if self.embedding_cache is None:
+            return await compute_text_embedding(
                 query_text,
                 self.openai_embed_client,
                 self.embed_model,
                 self.embed_deployment,
                 self.embed_dimensions,
             )
-        if not enable_text_search:
-            query_text = None
+        key = self.embedding_cache.make_key(self.embed_model, self.embed_dimensions, query_text)
+        if (vector := await self.embedding_cache.get(key)) is not None:
+            return vector
+        vector = await compute_text_embedding(
+            query_text,
+            self.openai_embed_client,
+            self.embed_model,
+            self.embed_deployment,
+            self.embed_dimensions,
+        )
+        await self.embedding_cache.set(key, vector)
+        return vector
+
+    async def search_and_embed(
+        self,
+        query_text: str,
+        top: int = 5,
+        enable_vector_search: bool = False,
+        enable_text_search: bool = False,
+        filters: list[dict] | None = None,
+    ) -> list[Item]:
+        """
+        Search items by query text. Optionally converts the query text to a vector if enable_vector_search is True.
+        Results are served from the retrieval cache when one is configured.
+        """
 
-        return await self.hybrid_search(query_text, vector, top, filters)
+        async def search() -> SearchResults:
+            vector: list[float] = []
+            if enable_vector_search:
+                with trace_stage("embedding"):
+                    vector = await self.compute_query_embedding(query_text)
+            with trace_stage("hybrid_sql"):
+                return await self.hybrid_search_results(
+                    query_text if enable_text_search else None, vector, top, filters
+                )
+
+        with trace_stage("retrieval"):
+            if self.retrieval_cache is None:
+                results = await search()
+            else:
+                key = self.retrieval_cache.make_key(query_text, filters, enable_vector_search, enable_text_search, top)
+                results = await self.retrieval_cache.get_or_search(key, search)
+
+        with trace_stage("hydration"):
+            async with self.async_session_maker() as session:
+                return await self.fetch_items(session, [url for url, _ in results])
 
     async def simple_sql_search(
         self, 
@@ -286,35 +321,37 @@ class PostgresSearcher:
         """
         Search items by simple SQL query with filters.
         """
-        filter_clause_where, _ = self.build_filter_clause(filters, use_or=True)
+        filter_clause_where, _, filter_params = self.build_filter_clause(filters, use_or=True)
+        if not filter_clause_where:
+            # Without a valid filter, this would return arbitrary packages
+            return []
         sql = f"""
-        SELECT id FROM packages
+        SELECT url FROM packages_all
         {filter_clause_where}
         LIMIT 10
         """
         
-        async with self.async_session_maker() as session:
-            results = (
-                await session.execute(
-                    text(sql).columns(id=Integer)
-                )
-            ).fetchall()
+        with trace_stage("sql_search"):
+            async with self.async_session_maker() as session:
+                results = (
+                    await session.execute(
+                        text(sql).columns(url=String), filter_params
+                    )
+                ).fetchall()
 
-            # Convert results to Item models
-            items = []
-            for result in results:
-                item_id = result.id
-                item = await session.execute(select(Item).where(Item.id == item_id))
-                items.append(item.scalar())
-            return items
+                return await self.fetch_items(session, [result.url for result in results])
         
     
     async def get_product_cards_info(self, urls: list[str]) -> list[dict]:
         """
         Fetch detailed information about items using their URLs as identifiers.
+        Served from the in-memory snapshot while it is kept up to date.
         """
+        if self.product_card_snapshot is not None and self.product_card_snapshot.listening:
+            return self.product_card_snapshot.get_cards(urls)
+
         sql = """
-        SELECT package_name, package_picture, url, price FROM packages WHERE url = ANY(:urls)
+        SELECT package_name, package_picture, url, price FROM packages_all WHERE url = ANY(:urls)
         """
         
         async with self.async_session_maker() as session:
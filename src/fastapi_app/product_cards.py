@@ -0,0 +1,143 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from typing import NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fastapi_app.metrics import CACHE_LOOKUPS
+from fastapi_app.postgres_models import Item
+
+logger = logging.getLogger("ragapp")
+
+PRODUCT_CARDS_CHANNEL = "product_cards"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more; larger changes ask listeners for a full reload
+MAX_NOTIFY_PAYLOAD_BYTES = 7900
+
+
+class ProductCard(NamedTuple):
+    package_name: str
+    package_picture: str | None
+    url: str
+    price: float
+
+
+async def notify_product_cards_changed(conn, urls: list[str] | None = None):
+    """
+    Tell the app workers that the cards of these packages changed, or that all may have changed when urls is None.
+    Postgres delivers the notification when the calling transaction commits.
+    """
+    payload = json.dumps(urls) if urls is not None else ""
+    if len(payload.encode()) > MAX_NOTIFY_PAYLOAD_BYTES:
+        payload = ""
+    await conn.execute(
+        text("SELECT pg_notify(:channel, :payload)"), {"channel": PRODUCT_CARDS_CHANNEL, "payload": payload}
+    )
+
+
+class ProductCardSnapshot:
+    """
+    In-memory copy of the product card fields of every package, keyed by URL.
+    A background listener on the product_cards channel loads it and keeps it fresh, holding one pooled connection.
+    """
+
+    def __init__(self, engine: AsyncEngine, reconnect_interval: float = 5):
+        self.engine = engine
+        self.reconnect_interval = reconnect_interval
+        self.cards: dict[str, ProductCard] = {}
+        self.listener_task: asyncio.Task | None = None
+        # Only trust the snapshot while the listener is connected, as notifications are missed otherwise
+        self.listening = False
+
+    def start(self):
+        self.listener_task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.listener_task is not None:
+            self.listener_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.listener_task
+
+    async def reload(self, urls: list[str] | None = None):
+        """Re-read the cards of the given packages, or of all packages when urls is None."""
+        sql = f"SELECT package_name, package_picture, url, price FROM {Item.__tablename__}"
+        async with self.engine.connect() as conn:
+            if urls is None:
+                result = await conn.execute(text(sql))
+            else:
+                result = await conn.execute(text(f"{sql} WHERE url = ANY(:urls)"), {"urls": urls})
+            cards = {row.url: ProductCard(*row) for row in result}
+        if urls is None:
+            self.cards = cards
+        else:
+            for url in urls:
+                # Deleted packages are missing from the result
+                if url in cards:
+                    self.cards[url] = cards[url]
+                else:
+                    self.cards.pop(url, None)
+        logger.info("Loaded %d product cards (%d in the snapshot)", len(cards), len(self.cards))
+
+    async def listen(self):
+        while True:
+            try:
+                async with self.engine.connect() as conn:
+                    raw_connection = (await conn.get_raw_connection()).driver_connection
+                    notifications: asyncio.Queue[str | None] = asyncio.Queue()
+
+                    def on_notification(_connection, _pid, _channel, payload):
+                        notifications.put_nowait(payload)
+
+                    def on_termination(_connection):
+                        notifications.put_nowait(None)
+
+                    await raw_connection.add_listener(PRODUCT_CARDS_CHANNEL, on_notification)
+                    raw_connection.add_termination_listener(on_termination)
+                    try:
+                        # Load every card on startup, and after reconnecting since notifications were missed meanwhile
+                        await self.reload()
+                        self.listening = True
+                        await self.apply_notifications(notifications)
+                    finally:
+                        self.listening = False
+                        raw_connection.remove_termination_listener(on_termination)
+                        # The connection goes back to the pool, so stop listening on it
+                        with contextlib.suppress(Exception):
+                            await raw_connection.remove_listener(PRODUCT_CARDS_CHANNEL, on_notification)
+                logger.warning("Product card listener connection closed, reconnecting...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Product card listener failed, reconnecting in %ss: %s", self.reconnect_interval, e)
+            await asyncio.sleep(self.reconnect_interval)
+
+    async def apply_notifications(self, notifications: asyncio.Queue):
+        """Reload the cards named by the notifications, until the connection terminates."""
+        while (payload := await notifications.get()) is not None:
+            payloads = [payload]
+            # Apply a burst of notifications with a single query
+            while not notifications.empty():
+                payloads.append(notifications.get_nowait())
+            if None in payloads:
+                return
+            if "" in payloads:
+                await self.reload()
+            else:
+                await self.reload(list({url for payload in payloads for url in json.loads(payload)}))
+
+    def get_cards(self, urls: list[str]) -> list[dict]:
+        urls = list(dict.fromkeys(urls))
+        cards = [card._asdict() for url in urls if (card := self.cards.get(url)) is not None]
+        CACHE_LOOKUPS.labels(cache="product_cards", result="hit").inc(len(cards))
+        CACHE_LOOKUPS.labels(cache="product_cards", result="miss").inc(len(urls) - len(cards))
+        return cards
+
+
+def create_product_card_snapshot_from_env(engine: AsyncEngine) -> ProductCardSnapshot | None:
+    if os.getenv("PRODUCT_CARD_SNAPSHOT_ENABLED", "true").lower() != "true":
+        logger.info("Product card snapshot is disabled")
+        return None
+    return ProductCardSnapshot(engine)
@@ -0,0 +1,21 @@
+import logging
+import pathlib
+
+logger = logging.getLogger("ragapp")
+
+
+class PromptTemplates:
+    """
+    Prompt templates read once from the prompts directory and shared by the RAG flows.
+    Call load() again to pick up edited prompts without restarting the worker.
+    """
+
+    def __init__(self, prompts_dir: pathlib.Path = pathlib.Path(__file__).parent / "prompts"):
+        self.prompts_dir = prompts_dir
+        self.load()
+
+    def load(self):
+        self.specify_package = (self.prompts_dir / "specify_package.txt").read_text()
+        self.query = (self.prompts_dir / "query.txt").read_text()
+        self.answer = (self.prompts_dir / "answer.txt").read_text()
+        logger.info("Loaded prompt templates from %s", self.prompts_dir)
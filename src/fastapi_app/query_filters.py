@@ -0,0 +1,60 @@
+import logging
+
+logger = logging.getLogger("ragapp")
+
+# Columns that filters may reference, with the Python type their values are coerced to.
+# Each one is backed by a B-tree index (url by its primary key), see filter_indexes in postgres_models.
+FILTER_COLUMNS = {
+    "price": float,
+    "url": str,
+    "package_name": str,
+    "category": str,
+    "shop_name": str,
+}
+
+COMPARISON_OPERATORS = {"=", "!=", "<>", "<", "<=", ">", ">="}
+LIST_OPERATORS = {"IN": "= ANY", "NOT IN": "<> ALL"}
+RANGE_OPERATOR = "BETWEEN"
+
+
+def coerce_filter_value(column: str, value):
+    if value is None:
+        raise ValueError("Filter values cannot be null")
+    return FILTER_COLUMNS[column](value)
+
+
+def compile_filters(filters: list[dict] | None, use_or: bool = False) -> tuple[str, dict]:
+    """
+    Compile filters like {"column": "price", "comparison_operator": "<=", "value": 3000} into a SQL condition
+    with bind parameters. IN and NOT IN take a list of values, BETWEEN takes a [low, high] pair.
+    Filters on unknown columns or operators, or with values of the wrong type, are skipped.
+    The SQL text only depends on the columns and operators, so the statement and its plan can be reused.
+    """
+    conditions = []
+    params = {}
+    for index, filter in enumerate(filters or []):
+        column = filter.get("column")
+        operator = str(filter.get("comparison_operator", "")).strip().upper()
+        value = filter.get("value")
+        if not isinstance(column, str) or column not in FILTER_COLUMNS:
+            logger.warning("Skipping a filter on an unsupported column: %r", column)
+            continue
+        name = f"filter_{index}"
+        try:
+            if operator in COMPARISON_OPERATORS:
+                params[name] = coerce_filter_value(column, value)
+                conditions.append(f"{column} {operator} :{name}")
+            elif operator in LIST_OPERATORS:
+                values = value if isinstance(value, list | tuple) else [value]
+                params[name] = [coerce_filter_value(column, item) for item in values]
+                # An array parameter keeps the statement text independent of the list length
+                conditions.append(f"{column} {LIST_OPERATORS[operator]}(:{name})")
+            elif operator == RANGE_OPERATOR:
+                low, high = (coerce_filter_value(column, bound) for bound in value)
+                params[f"{name}_low"], params[f"{name}_high"] = low, high
+                conditions.append(f"{column} BETWEEN :{name}_low AND :{name}_high")
+            else:
+                logger.warning("Skipping a filter with an unsupported operator: %r", operator)
+        except (TypeError, ValueError):
+            logger.warning("Skipping a filter on %s with an invalid value: %r", column, value)
+    return f" {'OR' if use_or else 'AND'} ".join(conditions), params
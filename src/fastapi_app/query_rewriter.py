@@ -20,6 +20,15 @@ def build_hybrid_search_function() -> list[ChatCompletionToolParam]:
                             "type": "string",
                             "description": "Query string to use for full text search, e.g. 'ตรวจสุขภาพ'",
                         },
+                        "price_range": {
+                            "type": "object",
+                            "description": "Filter search results to a price range in Thai Baht, e.g. 1000 to 3000",
+                            "properties": {
+                                "min": {"type": "number", "description": "Lowest price, e.g. 1000"},
+                                "max": {"type": "number", "description": "Highest price, e.g. 3000"},
+                            },
+                            "required": ["min", "max"],
+                        },
                         "price_filter": {
                             "type": "object",
                             "description": "Filter search results based on price in Thai Baht of the package",
@@ -53,6 +62,14 @@ def extract_search_arguments(chat_completion: ChatCompletion):
             if function.name == "search_database":
                 arg = json.loads(function.arguments)
                 search_query = arg.get("search_query")
+                if price_range := arg.get("price_range"):
+                    filters.append(
+                        {
+                            "column": "price",
+                            "comparison_operator": "BETWEEN",
+                            "value": [price_range.get("min"), price_range.get("max")],
+                        }
+                    )
                 if "price_filter" in arg and arg["price_filter"]:
                     price_filter = arg["price_filter"]
                     filters.append(
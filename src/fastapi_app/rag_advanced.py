@@ -1,28 +1,40 @@
+import asyncio
+import contextlib
 import re
-import copy
+import time
 import logging
-import pathlib
 from collections.abc import AsyncGenerator
+from dataclasses import asdict
 from typing import Any
 
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion
-from openai_messages_token_helper import get_token_limit
+from openai_messages_token_helper import build_messages, get_token_limit
 from tenacity import before_sleep_log, retry, stop_after_attempt, wait_random_exponential
 
 from .api_models import ThoughtStep
+from .context_budget import BROAD_RAG_FIELDS, NARROW_RAG_FIELDS, ContextAssembler
+from .metrics import OPENAI_REQUEST_DURATION, count_retries, record_token_usage
 from .postgres_searcher import PostgresSearcher
+from .prompt_templates import PromptTemplates
 from .query_rewriter import (
     build_hybrid_search_function,
     build_specify_package_function,
     extract_search_arguments,
     handle_specify_package_function_call,
 )
+from .tracing import get_stage_timings, record_stage, start_stage_timings, trace_stage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+async def cancel_task(task: asyncio.Task):
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+
 class AdvancedRAGChat:
     def __init__(
         self,
@@ -31,37 +43,74 @@ class AdvancedRAGChat:
         openai_chat_client: AsyncOpenAI,
         chat_model: str,
         chat_deployment: str | None,  # Not needed for non-Azure OpenAI
+        prompt_templates: PromptTemplates | None = None,
+        context_token_limit: int | None = None,
+        speculative_search: bool = False,
     ):
         self.searcher = searcher
         self.openai_chat_client = openai_chat_client
         self.chat_model = chat_model
         self.chat_deployment = chat_deployment
         self.chat_token_limit = get_token_limit(chat_model, default_to_minimum=True)
-        current_dir = pathlib.Path(__file__).parent
-        self.specify_package_prompt_template = open(current_dir / "prompts/specify_package.txt").read()
-        self.query_prompt_template = open(current_dir / "prompts/query.txt").read()
-        self.answer_prompt_template = open(current_dir / "prompts/answer.txt").read()
+        self.response_token_limit = 4096
+        # Prompt token budget; unknown models get the smallest known limit, so configure it for large-context models
+        self.context_token_limit = context_token_limit or max(
+            self.chat_token_limit - self.response_token_limit, self.chat_token_limit // 2
+        )
+        self.context_assembler = ContextAssembler(chat_model)
+        self.prompt_templates = prompt_templates or PromptTemplates()
+        # Off by default: turns answered by the specify-package path waste the speculative embedding and search
+        self.speculative_search = speculative_search
+
+    @property
+    def specify_package_prompt_template(self) -> str:
+        return self.prompt_templates.specify_package
 
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), before_sleep=before_sleep_log(logger, logging.WARNING))
+    @property
+    def query_prompt_template(self) -> str:
+        return self.prompt_templates.query
+
+    @property
+    def answer_prompt_template(self) -> str:
+        return self.prompt_templates.answer
+
+    @retry(
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        before_sleep=count_retries("chat", before_sleep_log(logger, logging.WARNING)),
+    )
     async def openai_chat_completion(self, *args, **kwargs) -> ChatCompletion:
-        return await self.openai_chat_client.chat.completions.create(*args, **kwargs)
+        with OPENAI_REQUEST_DURATION.labels(operation="chat").time():
+            response = await self.openai_chat_client.chat.completions.create(*args, **kwargs)
+        if not kwargs.get("stream"):
+            record_token_usage("advanced", response.usage)
+        return response
 
     async def hybrid_search(self, messages, top, vector_search, text_search):
         # Generate an optimized keyword search query based on the chat history and the last question
-        query_messages = copy.deepcopy(messages)
-        query_messages.insert(0, {"role": "system", "content": self.query_prompt_template})
         query_response_token_limit = 500
-
-        query_chat_completion: ChatCompletion = await self.openai_chat_completion(
-            messages=query_messages,
-            model=self.chat_deployment if self.chat_deployment else self.chat_model,
-            temperature=0.0,
-            max_tokens=query_response_token_limit,
-            n=1,
-            tools=build_hybrid_search_function(),
-            tool_choice="auto",
+        tools = build_hybrid_search_function()
+        query_messages = build_messages(
+            self.chat_model,
+            self.query_prompt_template,
+            tools=tools,
+            new_user_content=messages[-1]["content"],
+            past_messages=messages[:-1],
+            max_tokens=self.context_token_limit,
+            fallback_to_default=True,
         )
 
+        with trace_stage("query_rewrite"):
+            query_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                messages=query_messages,
+                model=self.chat_deployment if self.chat_deployment else self.chat_model,
+                temperature=0.0,
+                max_tokens=query_response_token_limit,
+                n=1,
+                tools=tools,
+                tool_choice="auto",
+            )
+
         query_text, filters = extract_search_arguments(query_chat_completion)
 
         # Retrieve relevant items from the database with the GPT optimized query
@@ -73,13 +122,15 @@ class AdvancedRAGChat:
             filters=filters,
         )
 
-        sources_content = [f"[{(item.url)}]:{item.to_str_for_broad_rag()}\n\n" for item in results]
-
         thought_steps = [
             ThoughtStep(
                 title="Prompt to generate search arguments",
                 description=[str(message) for message in query_messages],
-                props={"model": self.chat_model, "deployment": self.chat_deployment} if self.chat_deployment else {"model": self.chat_model}
+                props=(
+                    {"model": self.chat_model, "deployment": self.chat_deployment}
+                    if self.chat_deployment
+                    else {"model": self.chat_model}
+                ) | {"timings": get_stage_timings("query_rewrite")}
             ),
             ThoughtStep(
                 title="Generated search arguments",
@@ -92,97 +143,143 @@ class AdvancedRAGChat:
                 props={
                     "top": top,
                     "vector_search": vector_search,
-                    "text_search": text_search
+                    "text_search": text_search,
+                    "timings": get_stage_timings("retrieval", "embedding", "hybrid_sql", "hydration"),
                 }
             )
         ]
-        return sources_content, thought_steps
+        return results, thought_steps
+
+    async def specify_package(self, messages) -> tuple[list[dict], list[dict]]:
+        # Generate a prompt to specify the package if the user is referring to a specific package
+        specify_package_token_limit = 300
+        tools = build_specify_package_function()
+        specify_package_messages = build_messages(
+            self.chat_model,
+            self.specify_package_prompt_template,
+            tools=tools,
+            new_user_content=messages[-1]["content"],
+            past_messages=messages[:-1],
+            max_tokens=self.context_token_limit,
+            fallback_to_default=True,
+        )
+
+        with trace_stage("specify_package"):
+            specify_package_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                messages=specify_package_messages,
+                model=self.chat_deployment if self.chat_deployment else self.chat_model,
+                temperature=0.0,
+                max_tokens=specify_package_token_limit,
+                n=1,
+                tools=tools,
+            )
+
+        return specify_package_messages, handle_specify_package_function_call(specify_package_chat_completion)
 
     async def get_product_cards_details(self, urls: list[str]) -> list[dict]:
         return await self.searcher.get_product_cards_info(urls)
 
-    async def run(
+    async def prepare_context(
         self, messages: list[dict], overrides: dict[str, Any] = {}
-    ) -> dict[str, Any] | AsyncGenerator[dict[str, Any], None]:
-        # Normalize the message format
+    ) -> tuple[list[dict], list[str], list[ThoughtStep]]:
+        # Normalize the message format: user messages as content parts, assistant messages as text,
+        # which is what build_messages accepts
         for message in messages:
-            if isinstance(message['content'], str):
-                message['content'] = [{'type': 'text', 'text': message['content']}]
+            if message["role"] == "user" and isinstance(message["content"], str):
+                message["content"] = [{"type": "text", "text": message["content"]}]
+            elif message["role"] != "user" and not isinstance(message["content"], str):
+                message["content"] = "".join(part.get("text", "") for part in message["content"])
 
         # Determine the search mode and the number of results to return
         text_search = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         vector_search = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         top = overrides.get("top", 3)
 
-        # Generate a prompt to specify the package if the user is referring to a specific package
-        specify_package_messages = copy.deepcopy(messages)
-        specify_package_messages.insert(0, {"role": "system", "content": self.specify_package_prompt_template})
-        specify_package_token_limit = 300
+        # Speculatively start the hybrid search path (query rewrite, embedding and search) while the
+        # specify-package call decides which path to take, and cancel it if the SQL path wins
+        hybrid_search_task = None
+        if overrides.get("speculative_search", self.speculative_search):
+            hybrid_search_task = asyncio.create_task(self.hybrid_search(messages, top, vector_search, text_search))
 
-        specify_package_chat_completion: ChatCompletion = await self.openai_chat_completion(
-            messages=specify_package_messages,
-            model=self.chat_deployment if self.chat_deployment else self.chat_model,
-            temperature=0.0,
-            max_tokens=specify_package_token_limit,
-            n=1,
-            tools=build_specify_package_function()
-        )
+        try:
+            specify_package_messages, specify_package_filters = await self.specify_package(messages)
 
-        specify_package_filters = handle_specify_package_function_call(specify_package_chat_completion)
+            results = []
+            if specify_package_filters:  # Simple SQL search
+                results = await self.searcher.simple_sql_search(filters=specify_package_filters)
+        except BaseException:
+            if hybrid_search_task is not None:
+                await cancel_task(hybrid_search_task)
+            raise
 
-        if specify_package_filters:  # Simple SQL search
-            results = await self.searcher.simple_sql_search(filters=specify_package_filters)
+        if results:
+            if hybrid_search_task is not None:
+                await cancel_task(hybrid_search_task)
 
-            if results:
-                sources_content = [f"[{(item.url)}]:{item.to_str_for_narrow_rag()}\n\n" for item in results]
+            fields = NARROW_RAG_FIELDS
+            thought_steps = [
+                ThoughtStep(
+                    title="Prompt to specify package",
+                    description=[str(message) for message in specify_package_messages],
+                    props=(
+                        {"model": self.chat_model, "deployment": self.chat_deployment}
+                        if self.chat_deployment
+                        else {"model": self.chat_model}
+                    ) | {"timings": get_stage_timings("specify_package")}
+                ),
+                ThoughtStep(
+                    title="Specified package filters",
+                    description=specify_package_filters,
+                    props={}
+                ),
+                ThoughtStep(
+                    title="SQL search results",
+                    description=[result.to_dict() for result in results],
+                    props={"timings": get_stage_timings("sql_search")}
+                )
+            ]
+        elif hybrid_search_task is not None:
+            # No package specified, or no results found with SQL search: use the hybrid search
+            results, thought_steps = await hybrid_search_task
+            fields = BROAD_RAG_FIELDS
+        else:
+            results, thought_steps = await self.hybrid_search(messages, top, vector_search, text_search)
+            fields = BROAD_RAG_FIELDS
 
-                thought_steps = [
-                    ThoughtStep(
-                        title="Prompt to specify package",
-                        description=[str(message) for message in specify_package_messages],
-                        props={"model": self.chat_model, "deployment": self.chat_deployment} if self.chat_deployment else {"model": self.chat_model}
-                    ),
-                    ThoughtStep(
-                        title="Specified package filters",
-                        description=specify_package_filters,
-                        props={}
-                    ),
-                    ThoughtStep(
-                        title="SQL search results",
-                        description=[result.to_dict() for result in results],
-                        props={}
-                    )
-                ]
-            else:
-                # No results found with SQL search, fall back to the hybrid search
-                sources_content, thought_steps = await self.hybrid_search(messages, top, vector_search, text_search)
-        else:  # Hybrid search
-            sources_content, thought_steps = await self.hybrid_search(messages, top, vector_search, text_search)
-
-        content = "\n".join(sources_content)
-
-        # Build messages for the final chat completion
-        messages.insert(0, {"role": "system", "content": self.answer_prompt_template})
-        messages[-1]["content"].append({"type": "text", "text": "\n\nSources:\n" + content})
-        response_token_limit = 4096
-
-        chat_completion_response = await self.openai_chat_completion(
-            model=self.chat_deployment if self.chat_deployment else self.chat_model,
-            messages=messages,
-            temperature=overrides.get("temperature", 0.3),
-            max_tokens=response_token_limit,
-            n=1,
-            stream=False,
+        # Build messages for the final chat completion, dropping the least important fields and oldest turns
+        # that do not fit in the token budget
+        messages, sources_content, packing_report = self.context_assembler.assemble(
+            self.answer_prompt_template, messages, results, fields, self.context_token_limit
         )
+        thought_steps.append(ThoughtStep(title="Answer prompt token budget", description=asdict(packing_report)))
+        return messages, sources_content, thought_steps
+
+    async def get_product_cards_for_answer(self, answer: str) -> list[dict]:
+        package_urls = re.findall(r'https:\/\/hdmall\.co\.th\/[\w.,@?^=%&:\/~+#-]+', answer)
+        if package_urls:
+            with trace_stage("product_cards"):
+                return await self.get_product_cards_details(package_urls)
+        return []
+
+    async def run(
+        self, messages: list[dict], overrides: dict[str, Any] = {}
+    ) -> dict[str, Any] | AsyncGenerator[dict[str, Any], None]:
+        timings = start_stage_timings()
+        messages, sources_content, thought_steps = await self.prepare_context(messages, overrides)
+
+        with trace_stage("answer"):
+            chat_completion_response = await self.openai_chat_completion(
+                model=self.chat_deployment if self.chat_deployment else self.chat_model,
+                messages=messages,
+                temperature=overrides.get("temperature", 0.3),
+                max_tokens=self.response_token_limit,
+                n=1,
+                stream=False,
+            )
         chat_resp = chat_completion_response.model_dump()
 
         chat_resp_content = chat_resp["choices"][0]["message"]["content"]
-        package_urls = re.findall(r'https:\/\/hdmall\.co\.th\/[\w.,@?^=%&:\/~+#-]+', chat_resp_content)
-        
-        if package_urls:
-            product_cards_details = await self.get_product_cards_details(package_urls)
-        else:
-            product_cards_details = []
+        product_cards_details = await self.get_product_cards_for_answer(chat_resp_content)
 
         chat_resp["choices"][0]["context"] = {
             "data_points": {"text": sources_content},
@@ -190,8 +287,60 @@ class AdvancedRAGChat:
                 ThoughtStep(
                     title="Product Cards Details",
                     description=product_cards_details,
-                    props={}
-                )
+                    props={"timings": get_stage_timings("product_cards")}
+                ),
+                ThoughtStep(title="Stage timings (ms)", description=timings),
             ]
         }
-        return chat_resp
\ No newline at end of file
+        return chat_resp
+
+    async def run_stream(
+        self, messages: list[dict], overrides: dict[str, Any] = {}
+    ) -> AsyncGenerator[dict[str, Any], None]:
+        timings = start_stage_timings()
+        messages, sources_content, thought_steps = await self.prepare_context(messages, overrides)
+
+        # Send the retrieval context before the answer so the client can render it right away
+        yield {
+            "delta": {"role": "assistant"},
+            "context": {"data_points": {"text": sources_content}, "thoughts": thought_steps},
+        }
+
+        answer_parts = []
+        with trace_stage("answer", activate=False):
+            answer_started_at = time.perf_counter()
+            chat_completion_stream = await self.openai_chat_completion(
+                model=self.chat_deployment if self.chat_deployment else self.chat_model,
+                messages=messages,
+                temperature=overrides.get("temperature", 0.3),
+                max_tokens=self.response_token_limit,
+                n=1,
+                stream=True,
+                # The last chunk then carries the token usage of the whole stream
+                stream_options={"include_usage": True},
+            )
+            async for chunk in chat_completion_stream:
+                record_token_usage("advanced", getattr(chunk, "usage", None))
+                # Azure OpenAI sends a first chunk with no choices, holding the prompt filter results
+                if chunk.choices and (content := chunk.choices[0].delta.content):
+                    if not answer_parts:
+                        record_stage("answer_first_token", answer_started_at)
+                    answer_parts.append(content)
+                    yield {"delta": {"role": "assistant", "content": content}}
+
+        # Product cards depend on the URLs cited in the full answer, so they trail the stream
+        product_cards_details = await self.get_product_cards_for_answer("".join(answer_parts))
+        yield {
+            "delta": {"role": "assistant"},
+            "context": {
+                "product_cards": product_cards_details,
+                "thoughts": [
+                    ThoughtStep(
+                        title="Product Cards Details",
+                        description=product_cards_details,
+                        props={"timings": get_stage_timings("product_cards")}
+                    ),
+                    ThoughtStep(title="Stage timings (ms)", description=timings),
+                ],
+            },
+        }
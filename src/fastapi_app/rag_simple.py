@@ -1,4 +1,4 @@
-import pathlib
+import time
 from collections.abc import AsyncGenerator
 from typing import (
     Any,
@@ -8,7 +8,10 @@ from openai import AsyncOpenAI
 from openai_messages_token_helper import build_messages, get_token_limit
 
 from .api_models import ThoughtStep
+from .metrics import OPENAI_REQUEST_DURATION, record_token_usage
 from .postgres_searcher import PostgresSearcher
+from .prompt_templates import PromptTemplates
+from .tracing import get_stage_timings, record_stage, start_stage_timings, trace_stage
 
 
 class SimpleRAGChat:
@@ -19,18 +22,23 @@ class SimpleRAGChat:
         openai_chat_client: AsyncOpenAI,
         chat_model: str,
         chat_deployment: str | None,  # Not needed for non-Azure OpenAI
+        prompt_templates: PromptTemplates | None = None,
     ):
         self.searcher = searcher
         self.openai_chat_client = openai_chat_client
         self.chat_model = chat_model
         self.chat_deployment = chat_deployment
         self.chat_token_limit = get_token_limit(chat_model, default_to_minimum=True)
-        current_dir = pathlib.Path(__file__).parent
-        self.answer_prompt_template = open(current_dir / "prompts/answer.txt").read()
+        self.response_token_limit = 1024
+        self.prompt_templates = prompt_templates or PromptTemplates()
 
-    async def run(
+    @property
+    def answer_prompt_template(self) -> str:
+        return self.prompt_templates.answer
+
+    async def prepare_context(
         self, messages: list[dict], overrides: dict[str, Any] = {}
-    ) -> dict[str, Any] | AsyncGenerator[dict[str, Any], None]:
+    ) -> tuple[list[dict], list[str], list[ThoughtStep]]:
         text_search = overrides.get("retrieval_mode") in ["text", "hybrid", None]
         vector_search = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         top = overrides.get("top", 3)
@@ -43,55 +51,105 @@ class SimpleRAGChat:
             original_user_query, top=top, enable_vector_search=vector_search, enable_text_search=text_search
         )
 
-        sources_content = [f"[{(item.id)}]:{item.to_str_for_rag()}\n\n" for item in results]
+        sources_content = [f"[{(item.url)}]:{item.to_str_for_broad_rag()}\n\n" for item in results]
         content = "\n".join(sources_content)
 
         # Generate a contextual and content specific answer using the search results and chat history
-        response_token_limit = 1024
         messages = build_messages(
             model=self.chat_model,
             system_prompt=overrides.get("prompt_template") or self.answer_prompt_template,
             new_user_content=original_user_query + "\n\nSources:\n" + content,
             past_messages=past_messages,
-            max_tokens=self.chat_token_limit - response_token_limit,
+            max_tokens=self.chat_token_limit - self.response_token_limit,
             fallback_to_default=True,
         )
 
-        chat_completion_response = await self.openai_chat_client.chat.completions.create(
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.chat_deployment if self.chat_deployment else self.chat_model,
-            messages=messages,
-            temperature=overrides.get("temperature", 0.3),
-            max_tokens=response_token_limit,
-            n=1,
-            stream=False,
-        )
+        thought_steps = [
+            ThoughtStep(
+                title="Search query for database",
+                description=original_user_query if text_search else None,
+                props={
+                    "top": top,
+                    "vector_search": vector_search,
+                    "text_search": text_search,
+                    "timings": get_stage_timings("retrieval", "embedding", "hybrid_sql", "hydration"),
+                },
+            ),
+            ThoughtStep(
+                title="Search results",
+                description=[result.to_dict() for result in results],
+            ),
+            ThoughtStep(
+                title="Prompt to generate answer",
+                description=[str(message) for message in messages],
+                props=(
+                    {"model": self.chat_model, "deployment": self.chat_deployment}
+                    if self.chat_deployment
+                    else {"model": self.chat_model}
+                ),
+            ),
+        ]
+        return messages, sources_content, thought_steps
+
+    async def run(
+        self, messages: list[dict], overrides: dict[str, Any] = {}
+    ) -> dict[str, Any] | AsyncGenerator[dict[str, Any], None]:
+        timings = start_stage_timings()
+        messages, sources_content, thought_steps = await self.prepare_context(messages, overrides)
+
+        with trace_stage("answer"), OPENAI_REQUEST_DURATION.labels(operation="chat").time():
+            chat_completion_response = await self.openai_chat_client.chat.completions.create(
+                # Azure OpenAI takes the deployment name as the model name
+                model=self.chat_deployment if self.chat_deployment else self.chat_model,
+                messages=messages,
+                temperature=overrides.get("temperature", 0.3),
+                max_tokens=self.response_token_limit,
+                n=1,
+                stream=False,
+            )
+        record_token_usage("simple", chat_completion_response.usage)
         chat_resp = chat_completion_response.model_dump()
         chat_resp["choices"][0]["context"] = {
             "data_points": {"text": sources_content},
-            "thoughts": [
-                ThoughtStep(
-                    title="Search query for database",
-                    description=original_user_query if text_search else None,
-                    props={
-                        "top": top,
-                        "vector_search": vector_search,
-                        "text_search": text_search,
-                    },
-                ),
-                ThoughtStep(
-                    title="Search results",
-                    description=[result.to_dict() for result in results],
-                ),
-                ThoughtStep(
-                    title="Prompt to generate answer",
-                    description=[str(message) for message in messages],
-                    props=(
-                        {"model": self.chat_model, "deployment": self.chat_deployment}
-                        if self.chat_deployment
-                        else {"model": self.chat_model}
-                    ),
-                ),
-            ],
+            "thoughts": thought_steps + [ThoughtStep(title="Stage timings (ms)", description=timings)],
         }
         return chat_resp
+
+    async def run_stream(
+        self, messages: list[dict], overrides: dict[str, Any] = {}
+    ) -> AsyncGenerator[dict[str, Any], None]:
+        timings = start_stage_timings()
+        messages, sources_content, thought_steps = await self.prepare_context(messages, overrides)
+
+        # Send the retrieval context before the answer so the client can render it right away
+        yield {
+            "delta": {"role": "assistant"},
+            "context": {"data_points": {"text": sources_content}, "thoughts": thought_steps},
+        }
+
+        with trace_stage("answer", activate=False):
+            answer_started_at = time.perf_counter()
+            with OPENAI_REQUEST_DURATION.labels(operation="chat").time():
+                chat_completion_stream = await self.openai_chat_client.chat.completions.create(
+                    # Azure OpenAI takes the deployment name as the model name
+                    model=self.chat_deployment if self.chat_deployment else self.chat_model,
+                    messages=messages,
+                    temperature=overrides.get("temperature", 0.3),
+                    max_tokens=self.response_token_limit,
+                    n=1,
+                    stream=True,
+                    # The last chunk then carries the token usage of the whole stream
+                    stream_options={"include_usage": True},
+                )
+            async for chunk in chat_completion_stream:
+                record_token_usage("simple", getattr(chunk, "usage", None))
+                # Azure OpenAI sends a first chunk with no choices, holding the prompt filter results
+                if chunk.choices and (content := chunk.choices[0].delta.content):
+                    if "answer_first_token" not in timings:
+                        record_stage("answer_first_token", answer_started_at)
+                    yield {"delta": {"role": "assistant", "content": content}}
+
+        yield {
+            "delta": {"role": "assistant"},
+            "context": {"thoughts": [ThoughtStep(title="Stage timings (ms)", description=timings)]},
+        }
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import os
+import re
+
+from pgvector.utils import to_db
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fastapi_app.api_models import ThoughtStep
+from fastapi_app.embedding_cache import normalize_query_text
+from fastapi_app.metrics import CACHE_LOOKUPS
+from fastapi_app.postgres_models import Item, ResponseCacheEntry
+
+logger = logging.getLogger("ragapp")
+
+PACKAGE_URL_PATTERN = re.compile(r"https:\/\/hdmall\.co\.th\/[\w.,@?^=%&:\/~+#-]+")
+
+# Overrides that change the answer to a question, and so are part of the cache key
+ANSWER_OVERRIDES = ("use_advanced_flow", "retrieval_mode", "top", "temperature", "prompt_template")
+
+
+def find_package_urls(text_content: str) -> list[str]:
+    return list(dict.fromkeys(PACKAGE_URL_PATTERN.findall(text_content)))
+
+
+def get_single_turn_question(messages: list[dict]) -> str | None:
+    """Return the question of a conversation that has a single text-only user message, the only ones cached."""
+    if len(messages) != 1 or messages[0]["role"] != "user":
+        return None
+    content = messages[0]["content"]
+    if isinstance(content, str):
+        return content
+    if any(part["type"] != "text" for part in content):
+        return None
+    return "\n".join(part["text"] for part in content)
+
+
+async def invalidate_response_cache(conn, urls: list[str]):
+    """Drop the cached answers that cite any of the given packages; call it when a catalog sync changes them."""
+    if not urls:
+        return
+    if (await conn.execute(text("SELECT to_regclass(:table)"), {"table": ResponseCacheEntry.__tablename__})).scalar():
+        await conn.execute(
+            text(f"DELETE FROM {ResponseCacheEntry.__tablename__} WHERE cited_prices ?| CAST(:urls AS text[])"),
+            {"urls": urls},
+        )
+
+
+class ResponseCache:
+    """
+    Semantic cache of the answers to single-turn chat questions, shared by all workers through Postgres.
+    A cached answer is reused for a question whose embedding is similar enough, as long as the prices
+    of the packages it cites have not changed since. Lookups compare exact distances to the fresh entries
+    of the same settings key, which the TTL keeps few.
+    """
+
+    def __init__(self, engine: AsyncEngine, similarity_threshold: float = 0.95, ttl: float = 3600, candidates: int = 3):
+        self.engine = engine
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.candidates = candidates
+
+    @staticmethod
+    def make_settings_key(chat_model: str, overrides: dict) -> str:
+        settings = {"model": chat_model} | {name: overrides.get(name) for name in ANSWER_OVERRIDES}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def get_current_prices(self, conn, urls: list[str]) -> dict[str, float]:
+        result = await conn.execute(
+            text(f"SELECT url, price FROM {Item.__tablename__} WHERE url = ANY(:urls)"), {"urls": urls}
+        )
+        return {row.url: row.price for row in result}
+
+    async def lookup(self, settings_key: str, embedding: list[float]) -> dict | None:
+        """Return the closest valid cached entry, as a dict with its question, answer, data_points and similarity."""
+        try:
+            entry = await self._lookup(settings_key, embedding)
+        except Exception as e:
+            logger.warning("Failed to read from the response cache: %s", e)
+            entry = None
+        CACHE_LOOKUPS.labels(cache="response", result="hit" if entry is not None else "miss").inc()
+        return entry
+
+    async def _lookup(self, settings_key: str, embedding: list[float]) -> dict | None:
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                text(
+                    f"""
+                    WITH fresh_entries AS (
+                        SELECT id, question, answer, data_points, cited_prices,
+                            embedding <=> CAST(:embedding AS vector) AS distance
+                        FROM {ResponseCacheEntry.__tablename__}
+                        WHERE settings_key = :settings_key AND created_at > now() - make_interval(secs => :ttl)
+                    )
+                    SELECT id, question, answer, data_points, cited_prices, distance
+                    FROM fresh_entries
+                    WHERE distance <= :max_distance
+                    ORDER BY distance
+                    LIMIT :candidates
+                    """
+                ),
+                {
+                    "embedding": to_db(embedding),
+                    "settings_key": settings_key,
+                    "ttl": self.ttl,
+                    "candidates": self.candidates,
+                    "max_distance": 1 - self.similarity_threshold,
+                },
+            )
+            for row in result.fetchall():
+                current_prices = await self.get_current_prices(conn, list(row.cited_prices))
+                if current_prices == row.cited_prices:
+                    return {
+                        "question": row.question,
+                        "answer": row.answer,
+                        "data_points": row.data_points,
+                        "similarity": 1 - row.distance,
+                    }
+                # A cited package changed price or was removed since the answer was cached
+                await conn.execute(
+                    text(f"DELETE FROM {ResponseCacheEntry.__tablename__} WHERE id = :id"), {"id": row.id}
+                )
+        return None
+
+    @staticmethod
+    def build_chat_response(entry: dict, product_cards: list[dict] | None = None) -> dict:
+        """Shape a cached entry like the response of the RAG flows."""
+        thoughts = [
+            ThoughtStep(
+                title="Answer from the response cache",
+                description=entry["question"],
+                props={"similarity": round(entry["similarity"], 4)},
+            )
+        ]
+        if product_cards is not None:
+            thoughts.append(ThoughtStep(title="Product Cards Details", description=product_cards))
+        return {
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": entry["answer"]},
+                    "finish_reason": "stop",
+                    "context": {"data_points": entry["data_points"], "thoughts": thoughts},
+                }
+            ]
+        }
+
+    async def store(self, settings_key: str, question: str, embedding: list[float], answer: str, data_points: dict):
+        """Cache an answer, with the current prices of the packages cited in it or in its sources."""
+        urls = find_package_urls(answer + "\n" + json.dumps(data_points, ensure_ascii=False))
+        try:
+            async with self.engine.begin() as conn:
+                cited_prices = await self.get_current_prices(conn, urls)
+                await conn.execute(
+                    text(
+                        f"""
+                        INSERT INTO {ResponseCacheEntry.__tablename__}
+                            (settings_key, question, embedding, answer, data_points, cited_prices, created_at)
+                        VALUES (:settings_key, :question, CAST(:embedding AS vector), :answer,
+                            CAST(:data_points AS jsonb), CAST(:cited_prices AS jsonb), now())
+                        """
+                    ),
+                    {
+                        "settings_key": settings_key,
+                        "question": normalize_query_text(question),
+                        "embedding": to_db(embedding),
+                        "answer": answer,
+                        "data_points": json.dumps(data_points, ensure_ascii=False),
+                        "cited_prices": json.dumps(cited_prices),
+                    },
+                )
+        except Exception as e:
+            logger.warning("Failed to write to the response cache: %s", e)
+
+    async def purge_expired(self):
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(
+                    text(
+                        f"""
+                        DELETE FROM {ResponseCacheEntry.__tablename__}
+                        WHERE created_at <= now() - make_interval(secs => :ttl)
+                        """
+                    ),
+                    {"ttl": self.ttl},
+                )
+        except Exception as e:
+            logger.warning("Failed to purge the response cache: %s", e)
+
+
+def create_response_cache_from_env(engine: AsyncEngine) -> ResponseCache | None:
+    if os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() != "true":
+        return None
+    logger.info("Caching answers to single-turn chat questions in Postgres...")
+    return ResponseCache(
+        engine,
+        similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.95")),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    )
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fastapi_app.embedding_cache import normalize_query_text
+from fastapi_app.metrics import CACHE_LOOKUPS
+from fastapi_app.postgres_models import CatalogVersion
+
+logger = logging.getLogger("ragapp")
+
+# Ranked (url, score) pairs returned by a hybrid search
+SearchResults = list[tuple[str, float]]
+
+
+async def bump_catalog_generation(conn):
+    """Invalidate every cached retrieval result; call it in the transaction that changes the catalog."""
+    await conn.execute(
+        text(
+            f"""
+            INSERT INTO {CatalogVersion.__tablename__} (id, generation, updated_at) VALUES (1, 1, now())
+            ON CONFLICT (id) DO UPDATE SET
+                generation = {CatalogVersion.__tablename__}.generation + 1, updated_at = EXCLUDED.updated_at
+            """
+        )
+    )
+
+
+class RetrievalCache:
+    """
+    In-process LRU cache of search results, keyed on the normalized search arguments and the catalog generation,
+    so entries are dropped as soon as ingestion bumps the generation.
+    Concurrent misses for the same key share a single database search.
+    """
+
+    def __init__(
+        self, engine: AsyncEngine, max_size: int = 1000, ttl: float = 300, generation_refresh_interval: float = 5
+    ):
+        self.engine = engine
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation_refresh_interval = generation_refresh_interval
+        self.entries: OrderedDict[tuple[int, str], tuple[float, SearchResults]] = OrderedDict()
+        self.in_flight: dict[tuple[int, str], asyncio.Task] = {}
+        self.generation: int | None = None
+        self.generation_checked_at = 0.0
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        query_text: str | None,
+        filters: list[dict] | None,
+        enable_vector_search: bool,
+        enable_text_search: bool,
+        top: int,
+    ) -> str:
+        normalized = {
+            "query": normalize_query_text(query_text) if query_text else None,
+            "filters": sorted(json.dumps(filter, sort_keys=True, default=str) for filter in filters or []),
+            "vector": enable_vector_search,
+            "text": enable_text_search,
+            "top": top,
+        }
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+    async def get_generation(self) -> int | None:
+        """Return the catalog generation, re-reading it at most every generation_refresh_interval seconds."""
+        if time.monotonic() - self.generation_checked_at < self.generation_refresh_interval:
+            return self.generation
+        try:
+            async with self.engine.connect() as conn:
+                result = await conn.execute(text(f"SELECT generation FROM {CatalogVersion.__tablename__} WHERE id = 1"))
+                self.generation = result.scalar() or 0
+        except Exception as e:
+            logger.warning("Failed to read the catalog generation, bypassing the retrieval cache: %s", e)
+            self.generation = None
+        self.generation_checked_at = time.monotonic()
+        return self.generation
+
+    async def get_or_search(self, key: str, search: Callable[[], Awaitable[SearchResults]]) -> SearchResults:
+        generation = await self.get_generation()
+        if generation is None:
+            return await search()
+        cache_key = (generation, key)
+
+        if entry := self.entries.get(cache_key):
+            expires_at, results = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                CACHE_LOOKUPS.labels(cache="retrieval", result="hit").inc()
+                return results
+            del self.entries[cache_key]
+
+        if (task := self.in_flight.get(cache_key)) is not None:
+            self.coalesced += 1
+            CACHE_LOOKUPS.labels(cache="retrieval", result="coalesced").inc()
+        else:
+            self.misses += 1
+            CACHE_LOOKUPS.labels(cache="retrieval", result="miss").inc()
+            task = asyncio.create_task(search())
+            self.in_flight[cache_key] = task
+            task.add_done_callback(lambda task: self._finish_search(cache_key, task))
+        # Shield the shared search, so one cancelled request does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _finish_search(self, cache_key: tuple[int, str], task: asyncio.Task):
+        del self.in_flight[cache_key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.entries[cache_key] = (time.monotonic() + self.ttl, task.result())
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "generation": self.generation,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+def create_retrieval_cache_from_env(engine: AsyncEngine) -> RetrievalCache | None:
+    max_size = int(os.getenv("RETRIEVAL_CACHE_MAX_SIZE", "1000"))
+    if max_size <= 0:
+        logger.info("Retrieval result cache is disabled")
+        return None
+    return RetrievalCache(
+        engine,
+        max_size=max_size,
+        ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+        generation_refresh_interval=float(os.getenv("RETRIEVAL_CACHE_GENERATION_REFRESH_INTERVAL", "5")),
+    )
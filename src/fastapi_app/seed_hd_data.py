@@ -1,65 +1,30 @@
 import argparse
 import asyncio
 import logging
-import os
 
-import numpy as np
-import pandas as pd
-import sqlalchemy.exc
 from dotenv import load_dotenv
-from sqlalchemy import select, text
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import async_sessionmaker
-from tqdm import tqdm
 
+from fastapi_app.csv_loader import SYNC_COLUMNS, copy_csv_to_staging, latest_staged_rows_query
 from fastapi_app.postgres_engine import (
     create_postgres_engine_from_args,
     create_postgres_engine_from_env,
 )
 from fastapi_app.postgres_models import Item
+from fastapi_app.product_cards import notify_product_cards_changed
+from fastapi_app.retrieval_cache import bump_catalog_generation
 
 logger = logging.getLogger("ragapp")
 
-embedding_fields = [
-    'embedding_package_name', 'embedding_package_picture', 'embedding_url', 
-    'embedding_installment_month', 'embedding_installment_limit', 
-    'embedding_shop_name', 
-    'embedding_category', 'embedding_category_tags', 'embedding_preview_1_10', 
-    'embedding_selling_point', 'embedding_meta_keywords', 'embedding_brand', 
-    'embedding_min_max_age', 'embedding_locations', 'embedding_meta_description', 
-    'embedding_price_details', 'embedding_package_details', 'embedding_important_info', 
-    'embedding_payment_booking_info', 'embedding_general_info', 'embedding_early_signs_for_diagnosis', 
-    'embedding_how_to_diagnose', 'embedding_hdcare_summary', 'embedding_common_question', 
-    'embedding_know_this_disease', 'embedding_courses_of_action', 'embedding_signals_to_proceed_surgery', 
-    'embedding_get_to_know_this_surgery', 'embedding_comparisons', 'embedding_getting_ready', 
-    'embedding_recovery', 'embedding_side_effects', 'embedding_review_4_5_stars', 
-    'embedding_brand_option_in_thai_name', 'embedding_faq'
-]
-
-def convert_to_int(value):
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return None
-
-def convert_to_float(value):
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
-
-def convert_to_str(value):
-    if value is None:
-        return None
-    return str(value)
-
 async def seed_data(engine):
     logger.info("Checking if the packages table exists...")
     async with engine.begin() as conn:
         result = await conn.execute(
             text(
-                """
-                SELECT EXISTS 
-                (SELECT 1 FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'packages')
+                f"""
+                SELECT EXISTS
+                (SELECT 1 FROM information_schema.tables WHERE table_schema = 'public' AND table_name = '{Item.__tablename__}')
                 """  # noqa
             )
         )
@@ -68,68 +33,27 @@ async def seed_data(engine):
             return
 
     async with async_sessionmaker(engine, expire_on_commit=False)() as session:
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        csv_path = os.path.join(current_dir, "packages.csv")
-
-        try:
-            df = pd.read_csv(csv_path, delimiter=',', quotechar='"', escapechar='\\', on_bad_lines='skip', encoding='utf-8')
-        except pd.errors.ParserError as e:
-            logger.error(f"Error reading CSV file: {e}")
-            return
-
-        str_columns = df.select_dtypes(include=[object]).columns
-        df[str_columns] = df[str_columns].replace({np.nan: None})
-
-        num_columns = df.select_dtypes(include=[np.number]).columns
-        df[num_columns] = df[num_columns].replace({np.nan: None})
-
-        records = df.to_dict(orient='records')
-
         logger.info("Starting to insert records into the database...")
-        for record in tqdm(records, desc="Inserting records"):
-            try:
-                record["url"] = convert_to_int(record["url"])
-                if record["url"] is None:
-                    logger.error(f"Skipping record with invalid url: {record}")
-                    continue
-                
-                if "price" in record:
-                    record["price"] = convert_to_float(record["price"])
-                if "cash_discount" in record:
-                    record["cash_discount"] = convert_to_float(record["cash_discount"])
-                if "brand_ranking_position" in record:
-                    record["brand_ranking_position"] = convert_to_int(record["brand_ranking_position"])
-
-                if record["price"] is None or record["cash_discount"] is None:
-                    logger.error(f"Skipping record with invalid numeric fields: {record}")
-                    continue
-
-                item = await session.execute(select(Item).filter(Item.url == record["url"]))
-                if item.scalars().first():
-                    continue
-
-                item_data = {key: value for key, value in record.items() if key in Item.__table__.columns}
-
-                for field in embedding_fields:
-                    item_data[field] = None
-
-                for key, value in item_data.items():
-                    if key not in ["price", "cash_discount", "brand_ranking_position"]:
-                        item_data[key] = convert_to_str(value)
-
-                item = Item(**item_data)
-                session.add(item)
-
-            except Exception as e:
-                logger.error(f"Error inserting record with url {record['url']}: {e}")
-                await session.rollback()
-                continue
-
         try:
-            await session.commit()
-            logger.info("All records inserted successfully.")
-        except sqlalchemy.exc.IntegrityError as e:
-            logger.error(f"Integrity error during commit: {e}")
+            async with session.begin():
+                staged, rejected = await copy_csv_to_staging(session)
+                # Packages that already exist are left untouched, as before
+                result = await session.execute(
+                    text(
+                        f"""
+                        INSERT INTO {Item.__tablename__} ({", ".join(SYNC_COLUMNS)})
+                        {latest_staged_rows_query()}
+                        ON CONFLICT (url) DO NOTHING
+                        """
+                    )
+                )
+                await bump_catalog_generation(session)
+                await notify_product_cards_changed(session)
+            logger.info(f"Inserted {result.rowcount} new records out of {staged} CSV rows.")
+            if rejected:
+                logger.warning(f"Skipped {rejected} CSV rows with missing or invalid values.")
+        except Exception as e:
+            logger.error(f"Error inserting records, no changes were applied: {e}")
 
 async def main():
     parser = argparse.ArgumentParser(description="Seed database with CSV data")
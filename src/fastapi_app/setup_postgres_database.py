@@ -1,22 +1,121 @@
 import argparse
 import asyncio
 import logging
+import os
 
 from dotenv import load_dotenv
 from sqlalchemy import text
 
 from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
-from fastapi_app.postgres_models import Base
+from fastapi_app.postgres_models import (
+    TEXT_SEARCH_CONFIG,
+    VECTOR_QUANTIZATIONS,
+    Base,
+    Item,
+    PackageEmbedding,
+    ResponseCacheEntry,
+    build_search_tsv_expression,
+    filter_indexes,
+    get_vector_quantization,
+    package_embeddings_index,
+    response_cache_settings_index,
+)
 
 logger = logging.getLogger("ragapp")
 
 
-async def create_db_schema(engine):
+async def sync_vector_indexes(conn, quantization_name: str | None):
+    """
+    Keep exactly one HNSW index on package_embeddings: a quantized expression index when a quantization is chosen,
+    otherwise the full-precision index. Quantized indexes are 2x (halfvec) to 32x (binary) smaller.
+    """
+    quantization = get_vector_quantization(quantization_name)
+    for name, candidate in VECTOR_QUANTIZATIONS.items():
+        if candidate is quantization:
+            logger.info("Creating the %s quantized HNSW index...", name)
+            await conn.execute(
+                text(
+                    f"""
+                    CREATE INDEX IF NOT EXISTS {candidate.index_name} ON {PackageEmbedding.__tablename__}
+                    USING hnsw ({candidate.expression} {candidate.operator_class})
+                    WITH (m = 16, ef_construction = 64)
+                    """
+                )
+            )
+        else:
+            await conn.execute(text(f"DROP INDEX IF EXISTS {candidate.index_name}"))
+
+    if quantization is None:
+        await conn.execute(
+            text(
+                f"""
+                CREATE INDEX IF NOT EXISTS {package_embeddings_index.name} ON {PackageEmbedding.__tablename__}
+                USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+                """
+            )
+        )
+    else:
+        # The full-precision vectors are only read for rescoring, so their index is not needed
+        await conn.execute(text(f"DROP INDEX IF EXISTS {package_embeddings_index.name}"))
+
+
+async def ensure_text_search_config(conn, source_config: str):
+    """
+    Create the text search configuration used by search_tsv as a copy of source_config,
+    falling back to "simple" when the server does not have source_config (stock Postgres has no "thai").
+    An existing configuration is kept, as search_tsv was generated with it.
+    """
+    exists = await conn.execute(text("SELECT 1 FROM pg_ts_config WHERE cfgname = :name"), {"name": TEXT_SEARCH_CONFIG})
+    if exists.scalar():
+        return
+    available = await conn.execute(text("SELECT 1 FROM pg_ts_config WHERE cfgname = :name"), {"name": source_config})
+    if not available.scalar():
+        logger.warning("Text search configuration %r does not exist, falling back to 'simple'", source_config)
+        source_config = "simple"
+    logger.info("Creating the %s text search configuration from %r...", TEXT_SEARCH_CONFIG, source_config)
+    quoted_source_config = '"' + source_config.replace('"', '""') + '"'
+    await conn.execute(text(f"CREATE TEXT SEARCH CONFIGURATION {TEXT_SEARCH_CONFIG} (COPY = {quoted_source_config})"))
+
+
+async def create_db_schema(engine, quantization_name: str | None = None, text_search_config: str = "thai"):
     async with engine.begin() as conn:
         logger.info("Enabling the pgvector extension for Postgres...")
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        # The generated search_tsv column needs its configuration to exist before the table is created
+        await ensure_text_search_config(conn, text_search_config)
         logger.info("Creating database tables and indexes...")
         await conn.run_sync(Base.metadata.create_all)
+        # create_all skips tables that already exist, so add the full-text search column to older schemas
+        logger.info("Creating the full-text search column and GIN index...")
+        await conn.execute(
+            text(
+                f"""
+                ALTER TABLE {Item.__tablename__} ADD COLUMN IF NOT EXISTS search_tsv tsvector
+                GENERATED ALWAYS AS ({build_search_tsv_expression()}) STORED
+                """
+            )
+        )
+        await conn.execute(
+            text(f"CREATE INDEX IF NOT EXISTS gin_index_for_search_tsv ON {Item.__tablename__} USING gin (search_tsv)")
+        )
+        await conn.execute(
+            text(f"ALTER TABLE {PackageEmbedding.__tablename__} ADD COLUMN IF NOT EXISTS content_hash VARCHAR")
+        )
+        logger.info("Creating the B-tree indexes for structured filters...")
+        for index in filter_indexes:
+            column = index.expressions[0]
+            await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index.name} ON {Item.__tablename__} ({column.key})"))
+        # Response cache lookups scan the entries of one settings key, replacing the former HNSW index
+        await conn.execute(text("DROP INDEX IF EXISTS hnsw_index_for_response_cache"))
+        await conn.execute(
+            text(
+                f"""
+                CREATE INDEX IF NOT EXISTS {response_cache_settings_index.name}
+                ON {ResponseCacheEntry.__tablename__} (settings_key, created_at)
+                """
+            )
+        )
+        await sync_vector_indexes(conn, quantization_name)
 
     await conn.close()
 
@@ -28,6 +127,17 @@ async def main():
     parser.add_argument("--password", type=str, help="Postgres password")
     parser.add_argument("--database", type=str, help="Postgres database")
     parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
+    parser.add_argument(
+        "--quantization",
+        choices=["none", *VECTOR_QUANTIZATIONS],
+        default=os.getenv("POSTGRES_VECTOR_QUANTIZATION") or "none",
+        help="Index halfvec or binary quantized embeddings for the first pass of vector search",
+    )
+    parser.add_argument(
+        "--text-search-config",
+        default=os.getenv("POSTGRES_TEXT_SEARCH_CONFIG") or "thai",
+        help="Text search configuration for full-text search, falling back to 'simple' when the server lacks it",
+    )
 
     # if no args are specified, use environment variables
     args = parser.parse_args()
@@ -36,7 +146,7 @@ async def main():
     else:
         engine = await create_postgres_engine_from_args(args)
 
-    await create_db_schema(engine)
+    await create_db_schema(engine, args.quantization, args.text_search_config)
 
     await engine.dispose()
 
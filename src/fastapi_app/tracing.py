@@ -0,0 +1,89 @@
+import contextlib
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger("ragapp")
+
+tracer = trace.get_tracer("ragapp") if trace is not None else None
+
+# Durations in milliseconds of the stages traced while answering the current request
+_stage_timings: ContextVar[dict[str, float] | None] = ContextVar("stage_timings", default=None)
+
+
+def start_stage_timings() -> dict[str, float]:
+    """
+    Start collecting the stage durations of the current request. Tasks created from now on,
+    such as the speculative search, record into the same dict.
+    """
+    timings: dict[str, float] = {}
+    _stage_timings.set(timings)
+    return timings
+
+
+def record_stage(name: str, started_at: float):
+    if (timings := _stage_timings.get()) is not None:
+        timings[name] = round(timings.get(name, 0.0) + (time.perf_counter() - started_at) * 1000, 1)
+
+
+def get_stage_timings(*names: str) -> dict[str, float]:
+    timings = _stage_timings.get() or {}
+    return {name: timings[name] for name in names if name in timings}
+
+
+@contextlib.contextmanager
+def trace_stage(name: str, activate: bool = True):
+    """
+    Time a pipeline stage, in an OpenTelemetry span when opentelemetry is installed.
+    Pass activate=False around code that yields, so the span does not become the current span across yields.
+    """
+    started_at = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if tracer is not None and activate:
+            stack.enter_context(tracer.start_as_current_span(f"rag.{name}"))
+        elif tracer is not None:
+            stack.callback(tracer.start_span(f"rag.{name}").end)
+        try:
+            yield
+        finally:
+            record_stage(name, started_at)
+
+
+def configure_tracing(engine):
+    """
+    Export spans over OTLP when OTEL_EXPORTER_OTLP_ENDPOINT is set, instrumenting SQLAlchemy and the OpenAI client.
+    Needs the packages of the "tracing" extra.
+    """
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    if trace is None:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry is not installed, tracing is disabled")
+        return
+
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
+    from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    if not isinstance(trace.get_tracer_provider(), TracerProvider):
+        provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "ragapp")}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine)
+    OpenAIInstrumentor().instrument()
+    logger.info("Exporting traces to %s", os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"))
+
+
+def instrument_app(app):
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") and trace is not None:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+        FastAPIInstrumentor.instrument_app(app)
@@ -1,16 +1,26 @@
+import argparse
 import asyncio
 import logging
+import os
 
 from azure.identity.aio import DefaultAzureCredential
 from dotenv import load_dotenv
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import async_sessionmaker
-from tqdm import tqdm
 
-from fastapi_app.embeddings import compute_text_embedding
+from fastapi_app.embedding_pipeline import (
+    delete_package_embeddings,
+    embed_items,
+    fetch_content_hashes,
+    find_emptied_fields,
+    iter_item_batches,
+    reembed_changed_items_in_batches,
+    save_package_embeddings,
+)
 from fastapi_app.openai_clients import create_openai_embed_client
+from fastapi_app.package_neighbors import refresh_package_neighbors
 from fastapi_app.postgres_engine import create_postgres_engine_from_env
-from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_models import get_vector_quantization
+from fastapi_app.retrieval_cache import bump_catalog_generation
 
 load_dotenv()
 
@@ -18,51 +28,57 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-EMBEDDING_FIELDS = [
-    'package_name', 'package_picture', 'url', 'installment_month', 'installment_limit',
-    'shop_name', 'category', 'category_tags',
-    'preview_1_10', 'selling_point', 'meta_keywords', 'brand', 'min_max_age',
-    'locations', 'meta_description','price_details', 'package_details', 'important_info',
-    'payment_booking_info', 'general_info', 'early_signs_for_diagnosis', 'how_to_diagnose',
-    'hdcare_summary', 'common_question', 'know_this_disease', 'courses_of_action',
-    'signals_to_proceed_surgery', 'get_to_know_this_surgery', 'comparisons', 'getting_ready',
-    'recovery', 'side_effects', 'review_4_5_stars', 'brand_option_in_thai_name', 'faq'
-]
-
-def get_to_str_method(item, field):
-    method_name = f"to_str_for_embedding_{field}"
-    return getattr(item, method_name, None)
-
-async def update_embeddings():
+async def update_embeddings(incremental: bool = False, concurrency: int = 4):
     engine = await create_postgres_engine_from_env()
     azure_credential = DefaultAzureCredential()
     openai_embed_client, openai_embed_model, openai_embed_dimensions = await create_openai_embed_client(azure_credential)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
-    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
-        async with session.begin():
-            items = (await session.scalars(select(Item))).all()
-            logger.info(f"Found {len(items)} items to process.")
+    if incremental:
+        updated = await reembed_changed_items_in_batches(
+            session_maker,
+            openai_embed_client,
+            openai_embed_model,
+            embed_dimensions=openai_embed_dimensions,
+            concurrency=concurrency,
+        )
+    else:
+        updated = 0
+        async for items in iter_item_batches(session_maker):
+            package_embeddings = await embed_items(
+                items,
+                openai_embed_client,
+                openai_embed_model,
+                embed_dimensions=openai_embed_dimensions,
+                concurrency=concurrency,
+            )
+            async with session_maker() as session, session.begin():
+                await save_package_embeddings(session, package_embeddings)
+                # Fields whose text became empty keep their old embedding, which would still match searches
+                existing_hashes = await fetch_content_hashes(session, [item.url for item in items])
+                await delete_package_embeddings(session, find_emptied_fields(items, existing_hashes))
+            updated += len(package_embeddings)
+            logger.info(f"Processed packages up to {items[-1].url}, {updated} field embeddings updated so far")
+    logger.info(f"Updated {updated} field embeddings.")
+    async with engine.begin() as conn:
+        await bump_catalog_generation(conn)
+    if updated:
+        processed = await refresh_package_neighbors(
+            session_maker, quantization=get_vector_quantization(os.getenv("POSTGRES_VECTOR_QUANTIZATION"))
+        )
+        logger.info(f"Recomputed the neighbors of {processed} packages.")
 
-            for item in tqdm(items, desc="Processing items"):
-                for field in EMBEDDING_FIELDS:
-                    to_str_method = get_to_str_method(item, field)
-                    if to_str_method:
-                        field_value = to_str_method()
-                        if field_value:
-                            try:
-                                embedding = await compute_text_embedding(
-                                    field_value,
-                                    openai_client=openai_embed_client,
-                                    embed_model=openai_embed_model,
-                                    embedding_dimensions=openai_embed_dimensions,
-                                )
-                                setattr(item, f'embedding_{field}', embedding)
-                                logger.info(f"Updated embedding for {field} of item {item.url}")
-                            except Exception as e:
-                                logger.error(f"Error updating embedding for {field} of item {item.url}: {e}")
+    await azure_credential.close()
+    await engine.dispose()
 
-                session.add(item)
-            await session.commit()
 
 if __name__ == "__main__":
-    asyncio.run(update_embeddings())
+    parser = argparse.ArgumentParser(description="Generate embeddings for all packages")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-embed fields whose text or embedding model changed since they were last embedded",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of concurrent embedding requests")
+    args = parser.parse_args()
+    asyncio.run(update_embeddings(incremental=args.incremental, concurrency=args.concurrency))
@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.package_neighbors import NEIGHBOR_AGGREGATIONS, refresh_package_neighbors
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import EMBEDDING_FIELDS, get_vector_quantization
+
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def update_package_neighbors(
+    top: int = 10,
+    candidates: int = 50,
+    aggregation: str = "mean",
+    fields: list[str] = EMBEDDING_FIELDS,
+    stale_only: bool = False,
+):
+    engine = await create_postgres_engine_from_env()
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+    processed = await refresh_package_neighbors(
+        session_maker,
+        stale_only=stale_only,
+        top=top,
+        candidates=candidates,
+        aggregation=aggregation,
+        fields=fields,
+        quantization=get_vector_quantization(os.getenv("POSTGRES_VECTOR_QUANTIZATION")),
+    )
+    logger.info(f"Computed the neighbors of {processed} packages.")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the most similar packages of every package")
+    parser.add_argument("--top", type=int, default=10, help="Number of neighbors to store per package")
+    parser.add_argument("--candidates", type=int, default=50, help="Nearest packages looked up on each embedded field")
+    parser.add_argument(
+        "--aggregation",
+        choices=list(NEIGHBOR_AGGREGATIONS),
+        default="mean",
+        help="Combine the field similarities with their max, or their mean over the fields of the package",
+    )
+    parser.add_argument(
+        "--fields",
+        nargs="+",
+        choices=EMBEDDING_FIELDS,
+        default=EMBEDDING_FIELDS,
+        metavar="FIELD",
+        help="Embedded fields to compare packages on (default: all)",
+    )
+    parser.add_argument(
+        "--stale-only",
+        action="store_true",
+        help="Only recompute the packages whose embeddings or neighbors changed since their last computation",
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        update_package_neighbors(
+            top=args.top,
+            candidates=args.candidates,
+            aggregation=args.aggregation,
+            fields=args.fields,
+            stale_only=args.stale_only,
+        )
+    )
@@ -1,7 +1,13 @@
 import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Workers write their Prometheus samples to this directory, so /metrics aggregates all of them.
+# prometheus_client picks its multiprocess value class when first imported, so this must be set before any import
+# of it, here or in the app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "ragapp-prometheus"))
 
-max_requests = 1000
-max_requests_jitter = 50
 log_file = "-"
 bind = "0.0.0.0:8000"
 workers = (multiprocessing.cpu_count() * 2) + 1
@@ -9,3 +15,15 @@ workers = (multiprocessing.cpu_count() * 2) + 1
 worker_class = "uvicorn.workers.UvicornWorker"
 
 timeout = 600
+
+
+def on_starting(server):
+    # Drop samples left over from a previous run
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
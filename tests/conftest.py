@@ -0,0 +1,16 @@
+import pytest
+
+
+class WordEncoding:
+    """Stand-in for a tiktoken encoding that counts one token per space-separated word, without downloads."""
+
+    def encode(self, text: str) -> list[str]:
+        return text.split(" ") if text else []
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def word_encoding():
+    return WordEncoding()
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+
+from fastapi_app import context_budget
+from fastapi_app.context_budget import TRUNCATION_MARKER, ContextAssembler, PackingReport
+
+FIELDS = ("package_name", "price", "brand")
+
+
+@pytest.fixture
+def assembler(monkeypatch, word_encoding):
+    monkeypatch.setattr(context_budget, "encoding_for_model", lambda model, default_to_cl100k=False: word_encoding)
+    return ContextAssembler("gpt-4o-mini", max_field_tokens=10, min_field_tokens=3)
+
+
+def make_items(count: int, brand: str = "Brand") -> list[SimpleNamespace]:
+    return [
+        SimpleNamespace(url=f"https://example.com/{i}", package_name=f"Package {i}", price=1000 * i, brand=brand)
+        for i in range(count)
+    ]
+
+
+def first_field_cost(assembler: ContextAssembler, item) -> int:
+    return assembler.count_tokens(f"    package_name: {item.package_name}\n") + assembler.count_tokens(
+        f"[{item.url}]:\n\n"
+    )
+
+
+def test_every_field_is_sent_when_the_budget_allows(assembler):
+    items = make_items(2)
+    report = PackingReport(token_budget=1000)
+    sources, used = assembler.pack_sources(items, FIELDS, 1000, report)
+    assert sources == [
+        f"[{item.url}]:\n    package_name: {item.package_name}\n    price: {item.price}\n    brand: Brand\n\n"
+        for item in items
+    ]
+    assert used <= 1000
+    assert report == PackingReport(token_budget=1000)
+
+
+def test_every_package_gets_its_first_field_before_any_gets_the_next(assembler):
+    items = make_items(3)
+    budget = sum(first_field_cost(assembler, item) for item in items)
+    report = PackingReport(token_budget=budget)
+    sources, used = assembler.pack_sources(items, FIELDS, budget, report)
+    assert sources == [f"[{item.url}]:\n    package_name: {item.package_name}\n\n" for item in items]
+    assert used == budget
+    assert report.dropped_sources == []
+    assert report.dropped_fields == {item.url: ["price", "brand"] for item in items}
+
+
+def test_packages_that_do_not_fit_are_dropped_in_rank_order(assembler):
+    items = make_items(3)
+    budget = first_field_cost(assembler, items[0])
+    report = PackingReport(token_budget=budget)
+    sources, _ = assembler.pack_sources(items, FIELDS, budget, report)
+    assert [source.splitlines()[0] for source in sources] == [f"[{items[0].url}]:"]
+    assert report.dropped_sources == [items[1].url, items[2].url]
+
+
+def test_long_fields_are_truncated(assembler):
+    items = make_items(1, brand=" ".join(["word"] * 50))
+    report = PackingReport(token_budget=1000)
+    sources, _ = assembler.pack_sources(items, FIELDS, 1000, report)
+    brand_line = next(line for line in sources[0].splitlines() if line.startswith("    brand: "))
+    assert brand_line.endswith(TRUNCATION_MARKER)
+    assert assembler.count_tokens(brand_line.removeprefix("    brand: ")) <= assembler.max_field_tokens
+    assert report.truncated_fields == {items[0].url: ["brand"]}
+
+
+def test_the_last_field_is_cut_to_the_remaining_budget(assembler):
+    items = make_items(1, brand=" ".join(["word"] * 8))
+    full_sources, full_used = assembler.pack_sources(items, FIELDS, 1000, PackingReport(token_budget=1000))
+    budget = full_used - 4
+    report = PackingReport(token_budget=budget)
+    sources, used = assembler.pack_sources(items, FIELDS, budget, report)
+    assert used <= budget
+    assert sources[0].splitlines()[-2].startswith("    brand: ")
+    assert sources[0].splitlines()[-2].endswith(TRUNCATION_MARKER)
+    assert report.truncated_fields == {items[0].url: ["brand"]}
+    assert full_sources != sources
@@ -0,0 +1,84 @@
+import asyncio
+
+import pandas as pd
+
+from fastapi_app.csv_loader import NUMERIC_COLUMNS, REQUIRED_COLUMNS, SYNC_COLUMNS, normalize_chunk, stream_csv_rows
+
+
+def make_row(url: str = "https://example.com/1", **values) -> dict:
+    """A CSV row with every column set, as text."""
+    row = {column: "1" if column in NUMERIC_COLUMNS else f"{column} text" for column in SYNC_COLUMNS}
+    return row | {"url": url} | values
+
+
+def make_chunk(*rows: dict) -> pd.DataFrame:
+    # read_csv_chunks reads every column as text
+    return pd.DataFrame(list(rows), dtype=str)
+
+
+def as_dicts(rows: list[tuple]) -> list[dict]:
+    return [dict(zip(SYNC_COLUMNS, row)) for row in rows]
+
+
+def test_every_synced_column_is_required():
+    assert REQUIRED_COLUMNS == SYNC_COLUMNS
+
+
+def test_rows_follow_the_sync_columns_order():
+    rows = normalize_chunk(make_chunk(make_row(package_name="Checkup")))
+    assert len(rows) == 1
+    assert len(rows[0]) == len(SYNC_COLUMNS)
+    row = as_dicts(rows)[0]
+    assert row["url"] == "https://example.com/1"
+    assert row["package_name"] == "Checkup"
+
+
+def test_numeric_columns_are_coerced():
+    row = as_dicts(normalize_chunk(make_chunk(make_row(price="1500.50", brand_ranking_position="3"))))[0]
+    assert row["price"] == 1500.5
+    assert row["brand_ranking_position"] == 3
+
+
+def test_rows_with_unparseable_numbers_are_rejected():
+    chunk = make_chunk(
+        make_row("https://example.com/1"),
+        make_row("https://example.com/2", cash_discount="n/a"),
+        make_row("https://example.com/3", brand_ranking_position="2.5"),
+        make_row("https://example.com/4", price="free"),
+    )
+    assert [row["url"] for row in as_dicts(normalize_chunk(chunk))] == ["https://example.com/1"]
+
+
+def test_rows_with_missing_values_are_rejected():
+    chunk = make_chunk(
+        make_row("https://example.com/1"),
+        make_row("https://example.com/2", brand=None),
+        make_row(None),
+    )
+    assert [row["url"] for row in as_dicts(normalize_chunk(chunk))] == ["https://example.com/1"]
+
+
+def test_rows_missing_a_column_of_the_csv_are_rejected():
+    row = make_row()
+    del row["faq"]
+    assert normalize_chunk(make_chunk(row)) == []
+
+
+def test_required_columns_can_be_narrowed():
+    chunk = make_chunk(make_row("https://example.com/1", brand=None), make_row("https://example.com/2", price="free"))
+    rows = as_dicts(normalize_chunk(chunk, required_columns=("url", "price")))
+    assert [row["url"] for row in rows] == ["https://example.com/1"]
+    assert rows[0]["brand"] is None
+
+
+def test_streamed_chunks_count_their_rejected_rows(tmp_path):
+    csv_path = tmp_path / "packages.csv"
+    rows = [make_row(f"https://example.com/{i}", price="free" if i % 3 == 0 else "100") for i in range(7)]
+    pd.DataFrame(rows).to_csv(csv_path, index=False)
+
+    async def collect():
+        return [
+            (len(valid_rows), rejected) async for valid_rows, rejected in stream_csv_rows(str(csv_path), chunksize=4)
+        ]
+
+    assert asyncio.run(collect()) == [(2, 2), (2, 1)]
@@ -0,0 +1,19 @@
+from fastapi_app.embedding_cache import EmbeddingCache, normalize_query_text
+
+
+def test_normalize_query_text_folds_case_whitespace_and_unicode_forms():
+    assert normalize_query_text("  Health   CHECK\tup \n") == "health check up"
+    # The decomposed and composed forms of é share a key
+    assert normalize_query_text("Cafe\u0301") == normalize_query_text("Caf\u00e9")
+
+
+def test_trivially_different_queries_share_a_key():
+    key = EmbeddingCache.make_key("text-embedding-3-small", 1536, "Health check up")
+    assert EmbeddingCache.make_key("text-embedding-3-small", 1536, " health  CHECK up ") == key
+
+
+def test_the_key_depends_on_the_model_and_dimensions():
+    key = EmbeddingCache.make_key("text-embedding-3-small", 1536, "health check")
+    assert EmbeddingCache.make_key("text-embedding-3-large", 1536, "health check") != key
+    assert EmbeddingCache.make_key("text-embedding-3-small", 256, "health check") != key
+    assert EmbeddingCache.make_key("text-embedding-3-small", 1536, "health checks") != key
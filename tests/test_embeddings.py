@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from fastapi_app import embeddings
+from fastapi_app.embeddings import build_embedding_batches, compute_text_embeddings
+from fastapi_app.local_embeddings import LocalEmbeddingsClient
+
+
+@pytest.fixture(autouse=True)
+def patch_encoding(monkeypatch, word_encoding):
+    monkeypatch.setattr(embeddings, "get_encoding", lambda embed_model: word_encoding)
+
+
+def test_batches_keep_the_order_of_the_texts():
+    texts = [f"text {i}" for i in range(7)]
+    batches = build_embedding_batches(texts, "text-embedding-3-small", max_inputs=3)
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [text for batch in batches for text in batch] == texts
+
+
+def test_batches_respect_the_token_limit():
+    texts = ["one two three", "four five", "six", "seven eight nine ten"]
+    batches = build_embedding_batches(texts, "text-embedding-3-small", max_tokens=5)
+    assert batches == [["one two three", "four five"], ["six", "seven eight nine ten"]]
+
+
+def test_an_input_over_the_token_limit_gets_its_own_batch():
+    batches = build_embedding_batches(["a b", "c d e f g h", "i"], "text-embedding-3-small", max_tokens=4)
+    assert batches == [["a b"], ["c d e f g h"], ["i"]]
+
+
+def test_inputs_over_the_per_input_limit_are_truncated(monkeypatch):
+    monkeypatch.setattr(embeddings, "MAX_TOKENS_PER_INPUT", 3)
+    batches = build_embedding_batches(["a b c d e", "f g"], "text-embedding-3-small")
+    assert batches == [["a b c", "f g"]]
+
+
+def test_no_texts_make_no_batches():
+    assert build_embedding_batches([], "text-embedding-3-small") == []
+
+
+def test_local_models_are_batched_without_the_openai_tokenizer(monkeypatch):
+    def get_encoding(embed_model):
+        raise AssertionError("the OpenAI tokenizer must not be loaded for a local model")
+
+    monkeypatch.setattr(embeddings, "get_encoding", get_encoding)
+    client = LocalEmbeddingsClient(model=None)
+    requests = []
+
+    async def create(*, model, input, **kwargs):
+        requests.append(list(input))
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=index, embedding=[float(len(text))]) for index, text in enumerate(input)]
+        )
+
+    client.create = create
+    texts = ["a", "bb " * 10_000, "ccc"]
+    vectors = asyncio.run(compute_text_embeddings(texts, client, "local-model", max_inputs=2))
+    assert requests == [texts[:2], texts[2:]]
+    assert vectors == [[float(len(text))] for text in texts]
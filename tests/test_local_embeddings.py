@@ -0,0 +1,93 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+from fastapi_app.local_embeddings import LocalEmbeddingsClient, fit_dimensions
+
+
+class FakeModel:
+    """Stand-in for a SentenceTransformer that records its encode calls and returns unit vectors."""
+
+    def __init__(self, dimensions: int = 4):
+        self.dimensions = dimensions
+        self.calls: list[list[str]] = []
+
+    def encode(self, texts: list[str], batch_size: int, normalize_embeddings: bool):
+        self.calls.append(list(texts))
+        vectors = np.zeros((len(texts), self.dimensions))
+        for row, text in enumerate(texts):
+            vectors[row, len(text) % self.dimensions] = 1.0
+        return vectors
+
+
+def test_fit_dimensions_keeps_vectors_of_the_column_size():
+    assert fit_dimensions([0.6, 0.8], 2) == [0.6, 0.8]
+
+
+def test_fit_dimensions_truncates_and_renormalizes_longer_vectors():
+    vector = fit_dimensions([0.5, 0.5, 0.5, 0.5], 2)
+    assert vector == pytest.approx([math.sqrt(0.5), math.sqrt(0.5)])
+    assert math.fsum(value * value for value in vector) == pytest.approx(1.0)
+
+
+def test_fit_dimensions_zero_pads_shorter_vectors():
+    assert fit_dimensions([0.6, 0.8], 4) == [0.6, 0.8, 0.0, 0.0]
+
+
+def test_fit_dimensions_leaves_truncated_zero_vectors_alone():
+    assert fit_dimensions([0.0, 0.0, 1.0], 2) == [0.0, 0.0]
+
+
+def test_concurrent_requests_share_one_model_call():
+    model = FakeModel()
+    client = LocalEmbeddingsClient(model, dimensions=6, batch_size=32, batch_wait=0.01)
+
+    async def embed_concurrently():
+        return await asyncio.gather(
+            client.embeddings.create(model="local", input="a"),
+            client.embeddings.create(model="local", input=["bb", "ccc"]),
+            client.embeddings.create(model="local", input="dddd", dimensions=2),
+        )
+
+    first, second, third = asyncio.run(embed_concurrently())
+    assert model.calls == [["a", "bb", "ccc", "dddd"]]
+    assert [data.embedding for data in first.data] == [[0.0, 1.0, 0.0, 0.0, 0.0, 0.0]]
+    assert [data.index for data in second.data] == [0, 1]
+    assert [data.embedding for data in second.data] == [
+        [0.0, 0.0, 1.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0, 0.0, 0.0],
+    ]
+    # Requested dimensions override the client's
+    assert [data.embedding for data in third.data] == [[1.0, 0.0]]
+
+
+def test_a_full_batch_is_encoded_without_waiting():
+    model = FakeModel()
+    client = LocalEmbeddingsClient(model, dimensions=4, batch_size=2, batch_wait=60)
+
+    async def embed():
+        return await asyncio.wait_for(client.embeddings.create(model="local", input=["a", "b"]), timeout=5)
+
+    response = asyncio.run(embed())
+    assert model.calls == [["a", "b"]]
+    assert len(response.data) == 2
+
+
+def test_encoding_errors_reach_every_request_of_the_batch():
+    class FailingModel(FakeModel):
+        def encode(self, texts, batch_size, normalize_embeddings):
+            raise RuntimeError("out of memory")
+
+    client = LocalEmbeddingsClient(FailingModel(), batch_wait=0.01)
+
+    async def embed_concurrently():
+        return await asyncio.gather(
+            client.embeddings.create(model="local", input="a"),
+            client.embeddings.create(model="local", input="b"),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(embed_concurrently())
+    assert [str(result) for result in results] == ["out of memory", "out of memory"]
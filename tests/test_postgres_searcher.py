@@ -0,0 +1,19 @@
+from fastapi_app.postgres_models import VECTOR_QUANTIZATIONS
+from fastapi_app.postgres_searcher import HNSW_MAX_EF_SEARCH, PostgresSearcher
+
+
+def make_searcher(**kwargs) -> PostgresSearcher:
+    return PostgresSearcher(
+        None, openai_embed_client=None, embed_deployment=None, embed_model="model", embed_dimensions=3, **kwargs
+    )
+
+
+def test_quantized_candidates_leave_room_for_the_oversampling():
+    searcher = make_searcher(vector_quantization=VECTOR_QUANTIZATIONS["binary"], quantized_oversampling=4)
+    assert searcher.max_quantized_candidates() == HNSW_MAX_EF_SEARCH // 4
+    assert searcher.max_quantized_candidates() * 4 <= HNSW_MAX_EF_SEARCH
+
+
+def test_quantized_candidates_with_extreme_oversampling():
+    assert make_searcher(quantized_oversampling=0).max_quantized_candidates() == HNSW_MAX_EF_SEARCH
+    assert make_searcher(quantized_oversampling=5000).max_quantized_candidates() == 1
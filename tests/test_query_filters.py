@@ -0,0 +1,89 @@
+import pytest
+
+from fastapi_app.query_filters import compile_filters
+
+
+def test_no_filters_compile_to_an_empty_condition():
+    assert compile_filters(None) == ("", {})
+    assert compile_filters([]) == ("", {})
+
+
+@pytest.mark.parametrize("operator", ["=", "!=", "<>", "<", "<=", ">", ">="])
+def test_comparisons_bind_their_value(operator):
+    clause, params = compile_filters([{"column": "price", "comparison_operator": operator, "value": "3000"}])
+    assert clause == f"price {operator} :filter_0"
+    assert params == {"filter_0": 3000.0}
+
+
+def test_operators_are_case_and_whitespace_insensitive():
+    clause, params = compile_filters([{"column": "category", "comparison_operator": " not in ", "value": ["a"]}])
+    assert clause == "category <> ALL(:filter_0)"
+    assert params == {"filter_0": ["a"]}
+
+
+def test_in_binds_a_single_array_parameter():
+    clause, params = compile_filters([{"column": "shop_name", "comparison_operator": "IN", "value": ["a", "b", "c"]}])
+    assert clause == "shop_name = ANY(:filter_0)"
+    assert params == {"filter_0": ["a", "b", "c"]}
+
+
+def test_in_accepts_a_single_value():
+    _, params = compile_filters([{"column": "price", "comparison_operator": "IN", "value": 100}])
+    assert params == {"filter_0": [100.0]}
+
+
+def test_between_binds_both_bounds():
+    clause, params = compile_filters([{"column": "price", "comparison_operator": "BETWEEN", "value": [100, "200"]}])
+    assert clause == "price BETWEEN :filter_0_low AND :filter_0_high"
+    assert params == {"filter_0_low": 100.0, "filter_0_high": 200.0}
+
+
+def test_filters_are_joined_with_and_or_or():
+    filters = [
+        {"column": "price", "comparison_operator": "<=", "value": 3000},
+        {"column": "category", "comparison_operator": "=", "value": "checkup"},
+    ]
+    assert compile_filters(filters)[0] == "price <= :filter_0 AND category = :filter_1"
+    assert compile_filters(filters, use_or=True)[0] == "price <= :filter_0 OR category = :filter_1"
+
+
+@pytest.mark.parametrize(
+    "filter",
+    [
+        # Unknown columns, including SQL smuggled in the column name
+        {"column": "search_tsv", "comparison_operator": "=", "value": "x"},
+        {"column": "price; DROP TABLE packages_all; --", "comparison_operator": "=", "value": 1},
+        {"column": ["price"], "comparison_operator": "=", "value": 1},
+        {"comparison_operator": "=", "value": 1},
+        # Unknown operators, including SQL smuggled in the operator
+        {"column": "price", "comparison_operator": "LIKE", "value": "1%"},
+        {"column": "price", "comparison_operator": "= 1 OR 1 =", "value": 1},
+        {"column": "price", "value": 1},
+        # Values of the wrong type or shape
+        {"column": "price", "comparison_operator": "<", "value": "cheap"},
+        {"column": "price", "comparison_operator": "=", "value": None},
+        {"column": "price", "comparison_operator": "IN", "value": [1, "two"]},
+        {"column": "price", "comparison_operator": "BETWEEN", "value": [1]},
+        {"column": "price", "comparison_operator": "BETWEEN", "value": 1},
+    ],
+)
+def test_invalid_filters_are_skipped(filter):
+    assert compile_filters([filter]) == ("", {})
+
+
+def test_values_never_reach_the_sql_text():
+    value = "x' OR '1'='1"
+    clause, params = compile_filters([{"column": "package_name", "comparison_operator": "=", "value": value}])
+    assert value not in clause
+    assert params == {"filter_0": value}
+
+
+def test_skipped_filters_keep_the_others():
+    clause, params = compile_filters(
+        [
+            {"column": "unknown", "comparison_operator": "=", "value": 1},
+            {"column": "price", "comparison_operator": ">", "value": 10},
+        ]
+    )
+    assert clause == "price > :filter_1"
+    assert params == {"filter_1": 10.0}
@@ -0,0 +1,27 @@
+from fastapi_app.retrieval_cache import RetrievalCache
+
+PRICE_FILTER = {"column": "price", "comparison_operator": "<=", "value": 3000}
+CATEGORY_FILTER = {"column": "category", "comparison_operator": "=", "value": "checkup"}
+
+
+def make_key(query_text="health check", filters=None, enable_vector_search=True, enable_text_search=True, top=5):
+    return RetrievalCache.make_key(query_text, filters, enable_vector_search, enable_text_search, top)
+
+
+def test_trivially_different_queries_share_a_key():
+    assert make_key(" Health  CHECK ") == make_key("health check")
+
+
+def test_filter_order_does_not_change_the_key():
+    assert make_key(filters=[PRICE_FILTER, CATEGORY_FILTER]) == make_key(filters=[CATEGORY_FILTER, PRICE_FILTER])
+    assert make_key(filters=[]) == make_key(filters=None)
+
+
+def test_the_key_depends_on_every_search_argument():
+    key = make_key(filters=[PRICE_FILTER])
+    assert make_key(query_text="health checks", filters=[PRICE_FILTER]) != key
+    assert make_key(filters=[PRICE_FILTER | {"value": 2000}]) != key
+    assert make_key(filters=[PRICE_FILTER], enable_vector_search=False) != key
+    assert make_key(filters=[PRICE_FILTER], enable_text_search=False) != key
+    assert make_key(filters=[PRICE_FILTER], top=3) != key
+    assert make_key(query_text=None, filters=[PRICE_FILTER]) != key